@@ -0,0 +1,98 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+# An opt-in cache for ApiContext lookups (get_by_id and basic_search). Each entry belongs to a
+# type ("content", "user", "search", ...) which decides how long it lives; the whole cache holds
+# at most max_entries, dropping the least recently used first. Entries can be thrown out early
+# by id, which is what the websocket side does when a live event touches something we cached
+class ResultCache:
+
+    DEFAULT_TTLS = {
+        "content" : 300,
+        "user" : 300,
+        "search" : 30
+    }
+
+    def __init__(self, ttls = None, max_entries = 500, default_ttl = 60):
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict() # key -> (value, type, id, expire time)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Return the cached value for key, or None on a miss (expired counts as a miss)
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[3] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # Store a value. 'id' is optional, but without it the entry can only be invalidated by type
+    def put(self, key, value, type, id = None):
+        ttl = self.ttls.get(type, self.default_ttl)
+        if not ttl:
+            return
+        with self.lock:
+            self.entries[key] = (value, type, id, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+
+    # Throw out everything cached for the given type and id. Searches are always thrown out too,
+    # since we can't know whether the changed item would show up in them
+    def invalidate(self, type, id):
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if (e[1] == type and e[2] == id) or e[1] == "search"]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    def invalidate_type(self, type):
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if e[1] == type]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "entries" : len(self.entries),
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "invalidations" : self.invalidations
+        }
+
+
+# Every content id a live update touches: content objects themselves, plus the content that
+# activity points at through contentId. Messages also carry a contentId but are left out: a new
+# message doesn't change the room, and dropping it from the cache on every one would empty it
+def live_content_ids(data):
+    ids = set()
+    for objects in data.get("objects", {}).values():
+        if not isinstance(objects, dict):
+            continue
+        for content in objects.get("content", []):
+            if "id" in content:
+                ids.add(content["id"])
+        for activity in objects.get("activity", []):
+            if "contentId" in activity:
+                ids.add(activity["contentId"])
+    return ids
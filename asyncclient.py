@@ -0,0 +1,131 @@
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, Future
+
+# The single-threaded core of the client. Everything that touches client state (websocket
+# messages, keypresses, results of HTTP lookups) runs as a callback on one asyncio loop, so
+# nothing needs locking. The blocking pieces (reading the socket, reading the keyboard, HTTP)
+# still live on their own threads, but all they do is hand events to the loop. Nothing that waits
+# on a person or the network ever runs on the loop itself, so messages keep being dispatched.
+#
+# This only uses callbacks and futures (no coroutine syntax) so it still runs on python 3.4.
+
+class ClientEngine:
+
+    def __init__(self, loop = None, workers = 4):
+        self.loop = loop or asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(workers)
+
+    # Schedule fn(*args) on the loop. Safe to call from any thread
+    def post(self, fn, *args):
+        self.loop.call_soon_threadsafe(fn, *args)
+
+    # Wrap a function so calling it from any thread runs it on the loop instead
+    def threadsafe(self, fn):
+        def posted(*args):
+            self.post(fn, *args)
+        return posted
+
+    # Schedule fn(*args) on the loop after 'delay' seconds. Safe to call from any thread
+    def later(self, delay, fn, *args):
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, fn, *args)
+
+    # Run a blocking function on a worker thread; returns an asyncio future (done callbacks run on the loop)
+    def run_blocking(self, fn, *args):
+        return self.loop.run_in_executor(self.executor, fn, *args)
+
+    # Run fn(*args) on the loop and wait for what it returns (or raises). This is how other threads
+    # read or change client state. Never call it from the loop itself; it would wait forever
+    def call(self, fn, *args):
+        future = Future()
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except Exception as ex:
+                future.set_exception(ex)
+        self.post(run)
+        return future.result()
+
+    # Run a blocking function on a worker thread and wait for it, from a thread that isn't the loop
+    def wait_blocking(self, fn, *args):
+        return self.executor.submit(fn, *args).result()
+
+    # Run something that blocks forever (like a websocket reader) on its own daemon thread
+    def start_thread(self, target, *args):
+        thread = threading.Thread(target = target, args = args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    # Read keypresses on a background thread. Each key is handed to on_key on that same thread, and
+    # the next key isn't read until it returns, so on_key is free to prompt for more input while
+    # the loop carries on. on_key must go through call/post for anything touching client state.
+    # Reading stops once on_key returns False
+    def start_input(self, read_key, on_key):
+        def reader():
+            while on_key(read_key()) is not False:
+                pass
+        return self.start_thread(reader)
+
+    def run_forever(self):
+        try:
+            self.loop.run_forever()
+        finally:
+            self.executor.shutdown(wait = False)
+
+    def stop(self):
+        self.post(self.loop.stop)
+
+
+# The async face of ApiContext: same calls, but each returns an asyncio future instead of
+# blocking. The work is done by the normal synchronous ApiContext on a worker thread, so
+# everything it does (pooling, caching, the user directory) still applies
+class AsyncApiContext:
+
+    def __init__(self, context, engine):
+        self.context = context
+        self.engine = engine
+
+    def call(self, name, *args):
+        return self.engine.run_blocking(getattr(self.context, name), *args)
+
+    def api_status(self):
+        return self.call("api_status")
+
+    def user_me(self):
+        return self.call("user_me")
+
+    def is_token_valid(self):
+        return self.call("is_token_valid")
+
+    def login(self, username, password, expire_seconds = False):
+        return self.call("login", username, password, expire_seconds)
+
+    def search(self, requests):
+        return self.call("search", requests)
+
+    def basic_search(self, searchterm, limit = 0, skip = 0, fields = "~text,engagement"):
+        return self.call("basic_search", searchterm, limit, skip, fields)
+
+    def get_by_id(self, type, id, fields = "*"):
+        return self.call("get_by_id", type, id, fields)
+
+    def query(self, queries, values = None):
+        return self.call("query", queries, values)
+
+
+# Runs a LiveConnection's reader on a background thread while its open/close callbacks run on the
+# engine's loop. Messages go to the dispatcher's feed (which is built to be called from the reader
+# thread and hands messages to the loop itself). Pass the unwrapped handlers; they're made threadsafe here
+class AsyncLiveSession:
+
+    def __init__(self, engine, connection_type, context, dispatcher, on_open = None, on_close = None, *args):
+        self.engine = engine
+        self.dispatcher = dispatcher
+        self.connection = connection_type(context, dispatcher.feed,
+            engine.threadsafe(on_open) if on_open else None,
+            engine.threadsafe(on_close) if on_close else None, *args)
+
+    def start(self):
+        return self.engine.start_thread(self.connection.run_forever)
@@ -0,0 +1,327 @@
+import io
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import statistics
+import tracemalloc
+
+import main
+import output
+import history
+import headless
+import records
+import jsonstream
+import roomindex
+import mockserver
+import userdirectory
+
+# End-to-end benchmarks for the client, run against the local mock contentapi so the numbers are
+# repeatable. Each benchmark adds { name, value, unit } results; the whole run is written out as
+# json so two runs can be compared (--compare) to spot regressions.
+
+class Results:
+
+    def __init__(self):
+        self.results = []
+
+    def add(self, name, value, unit):
+        self.results.append({ "name" : name, "value" : round(value, 4), "unit" : unit })
+        print("%-40s %12.4f %s" % (name, value, unit))
+
+    def as_dict(self, args):
+        return {
+            "time" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python" : sys.version.split()[0],
+            "args" : vars(args),
+            "results" : self.results
+        }
+
+# A config like the client's own, but pointed at the mock
+def mock_config(server):
+    config = dict(main.config)
+    config["api"] = server.url
+    config["cache_enabled"] = False
+    return config
+
+# Output goes nowhere; we're timing the formatting and the write, not the terminal
+def quiet_display():
+    main.display = output.OutputEngine(stream = io.StringIO())
+
+def median_time(fn, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+# Start the session and wait until the mock is pushing to it (it registers the socket just after
+# the handshake, so anything posted before that would be missed)
+def connect(server, session, opened):
+    before = len(server.sockets)
+    session.start()
+    opened.wait(10)
+    deadline = time.monotonic() + 10
+    while len(server.sockets) <= before and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+# From nothing to a connected websocket: status, token check, user info, default room and history, socket open
+def bench_startup(server, results, args):
+    times = []
+    for i in range(args.repeat):
+        opened = threading.Event()
+        start = time.perf_counter()
+        config = mock_config(server)
+        context = main.create_context(config)
+        context.api_status()
+        context.token = server.make_token(1)
+        context.is_token_valid()
+        session = main.create_session(context, config, on_open = lambda ws, r: opened.set(), on_close = lambda ws: None)
+        history.join(context, 1, config["history_chunk_size"])
+        threading.Thread(target = session.engine.run_forever, daemon = True).start()
+        session.start()
+        opened.wait(10)
+        times.append(time.perf_counter() - start)
+        session.connection.close()
+        session.engine.stop()
+    results.add("startup_to_connected", statistics.median(times) * 1000, "ms")
+
+# Live messages through the whole receive path: socket, dispatcher queue, ws_onlive, rendering
+def bench_messages(server, results, args):
+    quiet_display()
+    config = mock_config(server)
+    context = main.create_context(config)
+    context.token = server.make_token(1)
+    opened = threading.Event()
+    done = threading.Event()
+    handled = [0]
+    session = main.create_session(context, config, on_open = lambda ws, r: opened.set(), on_close = lambda ws: None)
+    ws = session.connection
+    main.set_current_room(ws, 1, { "id" : 1, "name" : "Benchmark" })
+    def counting(ws, result):
+        main.ws_onlive(ws, result)
+        handled[0] += 1
+        if handled[0] >= args.messages:
+            done.set()
+    session.dispatcher.register("live", counting)
+    threading.Thread(target = session.engine.run_forever, daemon = True).start()
+    connect(server, session, opened)
+    start = time.perf_counter()
+    for i in range(args.messages):
+        server.post_message(1, (i % 10) + 1, "Benchmark message %d" % i)
+    done.wait(60)
+    elapsed = time.perf_counter() - start
+    ws.close()
+    session.engine.stop()
+    results.add("ws_messages_per_second", handled[0] / elapsed, "msg/s")
+    results.add("ws_messages_dropped", session.dispatcher.stats["dropped"], "msg")
+
+# Live messages through headless mode: socket, dispatcher queue, json lines out (to memory)
+def bench_headless(server, results, args):
+    config = mock_config(server)
+    context = main.create_context(config)
+    context.token = server.make_token(1)
+    opened = threading.Event()
+    writer = headless.JsonLinesWriter(io.StringIO()).start()
+    session = main.create_session(context, config, lambda ws, r: opened.set(), lambda ws: None, { "id" : 1, "username" : "user1" })
+    ws = headless.attach(session, writer)
+    threading.Thread(target = session.engine.run_forever, daemon = True).start()
+    connect(server, session, opened)
+    start = time.perf_counter()
+    for i in range(args.messages):
+        server.post_message(1, (i % 10) + 1, "Benchmark message %d" % i)
+    deadline = time.monotonic() + 60
+    while writer.stats["lines"] + writer.queue.qsize() < args.messages and time.monotonic() < deadline:
+        time.sleep(0.005)
+    writer.close()
+    elapsed = time.perf_counter() - start
+    ws.close()
+    session.engine.stop()
+    results.add("headless_events_per_second", writer.stats["lines"] / elapsed, "events/s")
+
+# A big paste going out through the send queue: every message written and acked (rate limit off)
+def bench_send(server, results, args):
+    config = mock_config(server)
+    config["send_rate"] = config["send_burst"] = 1000000
+    count = min(args.messages, config["send_max_pending"])
+    context = main.create_context(config)
+    context.token = server.make_token(1)
+    opened = threading.Event()
+    session = main.create_session(context, config, on_open = lambda ws, r: opened.set(), on_close = lambda ws: None)
+    ws = session.connection
+    threading.Thread(target = session.engine.run_forever, daemon = True).start()
+    connect(server, session, opened)
+    start = time.perf_counter()
+    for i in range(count):
+        ws.sends.submit(2, "Pasted line %d" % i)
+    session.engine.post(main.pump_sends, ws)
+    deadline = time.monotonic() + 60
+    while ws.sends.stats["acked"] < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    ws.close()
+    session.engine.stop()
+    results.add("send_acked_per_second", ws.sends.stats["acked"] / elapsed, "msg/s")
+
+# Formatting and writing the userlist as the user count grows
+def bench_userlist(server, results, args):
+    quiet_display()
+    for count in [100, 500, 2000, 5000]:
+        users = userdirectory.UserDirectory(count)
+        users.add_all({ "id" : i, "username" : "user%d" % i } for i in range(1, count + 1))
+        statuses = dict((str(i), "online") for i in range(1, count + 1))
+        elapsed = median_time(lambda: main.printr_lines([" -- Global userlist --"] + main.userlist_lines(statuses, users)), args.repeat)
+        results.add("userlist_render_%d" % count, elapsed * 1000, "ms")
+
+# Server search round trip versus the same search answered by the local room index
+def bench_search(server, results, args):
+    context = main.create_context(mock_config(server))
+    elapsed = median_time(lambda: context.basic_search("mega"), args.repeat)
+    results.add("search_server", elapsed * 1000, "ms")
+    elapsed = median_time(lambda: next(context.basic_search_pages("a", 25)), args.repeat)
+    results.add("search_server_first_page", elapsed * 1000, "ms")
+    index = roomindex.RoomIndex()
+    index.build(context)
+    elapsed = median_time(lambda: index.search("mega"), args.repeat)
+    results.add("search_room_index", elapsed * 1000, "ms")
+
+# Joining a room (room, newest messages and their authors in one request), then paging back through history
+def bench_history(server, results, args):
+    room = args.rooms # Give the last room 300 messages of its own (room 1 gets the message benchmark's thousands)
+    for i in range(300):
+        server.data.post_message(room, (i % 10) + 1, "History message %d" % i)
+    context = main.create_context(mock_config(server))
+    elapsed = median_time(lambda: history.join(context, room, 30), args.repeat)
+    results.add("history_join", elapsed * 1000, "ms")
+    def page_back():
+        room_history = history.RoomHistory(context, room, 30)
+        while room_history.load_older():
+            pass
+    elapsed = median_time(page_back, args.repeat)
+    results.add("history_all_chunks", elapsed * 1000, "ms")
+
+# What asking for only the fields we use saves: bytes over the wire for a full room listing, and
+# memory still held for the rows once the response is decoded (dicts of everything versus records)
+def bench_records(server, results, args):
+    context = main.create_context(mock_config(server))
+    raw = {}
+    record_response = context.record_response
+    def keep(endpoint, response, decoded = None):
+        raw[endpoint] = response.text
+        record_response(endpoint, response, decoded) # Still counted in the metrics
+    context.record_response = keep
+    context.search({ "requests" : [{ "type" : "content", "fields" : "*", "query" : "" }] })
+    everything = raw["request"]
+    context.query([records.Query(records.ContentRecord)])
+    projected = raw["request"]
+    results.add("rooms_payload_all_fields", len(everything) / 1024, "KiB")
+    results.add("rooms_payload_record_fields", len(projected) / 1024, "KiB")
+    for name, decode in [("dicts", lambda: json.loads(everything)["objects"]["content"]),
+            ("records", lambda: records.ContentRecord.from_list(json.loads(projected)["objects"]["content"]))]:
+        tracemalloc.start()
+        kept = decode()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results.add("rooms_memory_%s" % name, size / 1024, "KiB")
+        del kept
+
+# A full room listing with and without compressed responses: bytes over the wire and time per
+# search (on localhost the time is mostly the cost of compressing; over a real link it's the bytes)
+def bench_compression(server, results, args):
+    request = { "requests" : [{ "type" : "content", "fields" : "*", "query" : "" }] }
+    for name, encodings in [("gzip", "gzip, deflate"), ("identity", "")]:
+        config = mock_config(server)
+        config["http_compression"] = encodings
+        context = main.create_context(config)
+        elapsed = median_time(lambda: context.search(request), args.repeat)
+        counters = context.metrics.counters
+        results.add("rooms_wire_%s" % name, counters["http.bytes_wire"] / counters["http.request.requests"] / 1024, "KiB")
+        results.add("rooms_search_%s" % name, elapsed * 1000, "ms")
+
+# Peak memory for a big result decoded all at once versus a row at a time as it arrives, then
+# the end to end time of each. Both keep every room as a record, so the difference is what the
+# whole body and tree cost. The memory is measured on the body fetched beforehand, since the mock
+# server's own allocations (in this process) would swamp the client's
+def bench_streaming(server, results, args):
+    request = { "requests" : [{ "type" : "content", "fields" : "*", "query" : "" }, { "type" : "user", "fields" : "*", "query" : "" }] }
+    context = main.create_context(mock_config(server))
+    body = context.transport.post(server.url + "/request", headers = context.gen_header(), json = request).content
+    size = context.stream_chunk_size
+    def buffered():
+        result = json.loads(b"".join(body[i:i + size] for i in range(0, len(body), size)).decode("utf-8"))
+        return records.ContentRecord.from_list(result["objects"]["content"])
+    def streamed():
+        reader = jsonstream.RowReader(jsonstream.text_chunks(body[i:i + size] for i in range(0, len(body), size)))
+        return [records.ContentRecord.from_dict(row) for type, row in reader.rows() if type == "content"]
+    results.add("big_result_body", len(body) / 1024, "KiB")
+    for name, decode in [("buffered", buffered), ("streamed", streamed)]:
+        tracemalloc.start()
+        kept = decode()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del kept
+        results.add("big_result_peak_%s" % name, peak / 1024, "KiB")
+    for name, streaming in [("buffered", False), ("streamed", True)]:
+        context.streaming = streaming
+        elapsed = median_time(lambda: list(context.search_rows(request)), args.repeat)
+        results.add("big_result_%s" % name, elapsed * 1000, "ms")
+
+BENCHMARKS = [
+    ("startup", bench_startup),
+    ("messages", bench_messages),
+    ("headless", bench_headless),
+    ("send", bench_send),
+    ("userlist", bench_userlist),
+    ("search", bench_search),
+    ("history", bench_history),
+    ("records", bench_records),
+    ("compression", bench_compression),
+    ("streaming", bench_streaming)
+]
+
+# Print how each result moved compared to an earlier run
+def compare(previous_path, results):
+    with open(previous_path, "r", encoding = "utf-8") as f:
+        previous = dict((r["name"], r) for r in json.load(f)["results"])
+    print(" -- Compared to %s --" % previous_path)
+    for result in results:
+        old = previous.get(result["name"])
+        if old and old["value"]:
+            print("%-40s %+8.1f%%" % (result["name"], (result["value"] - old["value"]) * 100 / old["value"]))
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark the client against the mock contentapi")
+    parser.add_argument("--users", type = int, default = 1000)
+    parser.add_argument("--rooms", type = int, default = 1000)
+    parser.add_argument("--messages", type = int, default = 2000, help = "Live messages pushed for the throughput test")
+    parser.add_argument("--latency", type = float, default = 0, help = "Seconds the mock adds to every reply")
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--only", nargs = "*", help = "Benchmarks to run (%s)" % ", ".join(b[0] for b in BENCHMARKS))
+    parser.add_argument("--output", help = "Write the results as json to this file")
+    parser.add_argument("--compare", help = "An earlier --output file to compare against")
+    return parser.parse_args(argv)
+
+def run(args):
+    logging.basicConfig(level = logging.WARNING)
+    server = mockserver.MockServer(mockserver.MockData(args.users, args.rooms, 1000), latency = args.latency).start()
+    results = Results()
+    try:
+        for name, bench in BENCHMARKS:
+            if not args.only or name in args.only:
+                bench(server, results, args)
+    finally:
+        server.stop()
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as f:
+            json.dump(results.as_dict(args), f, indent = 2)
+    if args.compare:
+        compare(args.compare, results.results)
+    return results
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,154 @@
+import re
+import threading
+
+# contentapi's "request" endpoint takes any number of sub-requests in one body, so separate
+# searches can ride along in a single round trip. Each search gets a unique prefix for its
+# values and request names (queries are rewritten to match), and the merged result is split
+# back up so every caller sees exactly the result it would have gotten on its own.
+
+REFERENCE_REGEX = re.compile(r'@(\w+)')
+
+# Merge a list of contentapi search requests into one. Returns the merged request and, for each
+# original search, a mapping of "name in merged result" -> "name the caller expects"
+def merge_searches(searches):
+    merged = { "values" : {}, "requests" : [] }
+    namemaps = []
+    for i, search in enumerate(searches):
+        prefix = "r%d_" % i
+        renames = {}
+        for key, value in search.get("values", {}).items():
+            renames[key] = prefix + key
+            merged["values"][prefix + key] = value
+        namemap = {}
+        for request in search.get("requests", []):
+            name = request.get("name") or request["type"]
+            renames[name] = prefix + name
+            namemap[prefix + name] = name
+            request = dict(request)
+            request["name"] = prefix + name
+            if "query" in request:
+                request["query"] = REFERENCE_REGEX.sub(lambda m: "@" + renames.get(m.group(1), m.group(1)), request["query"])
+            merged["requests"].append(request)
+        namemaps.append(namemap)
+    return merged, namemaps
+
+# Given the result of a merged search, pull out the slice for one of the original searches
+def split_result(result, namemap):
+    sliced = dict((k, v) for k, v in result.items() if k != "objects")
+    objects = result.get("objects", {})
+    sliced["objects"] = dict((original, objects.get(merged, [])) for merged, original in namemap.items())
+    return sliced
+
+
+# One search waiting to go out with a batch. Call result() to block until it's done; it
+# raises whatever the batch raised. 'transform' lets wrappers like get_by_id post-process
+class PendingSearch:
+
+    def __init__(self, request, transform = None):
+        self.request = request
+        self.transform = transform
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+    def complete(self, value = None, error = None):
+        self.value = value
+        self.error = error
+        self.done.set()
+
+    def result(self, timeout = None):
+        if not self.done.wait(timeout):
+            raise TimeoutError("Batched search never completed")
+        if self.error:
+            raise self.error
+        return self.transform(self.value) if self.transform else self.value
+
+
+# Send a list of pending searches as one round trip (or the plain way if there's only one)
+def run_pending(context, pending):
+    if not pending:
+        return
+    try:
+        if len(pending) == 1:
+            pending[0].complete(context.search_now(pending[0].request))
+            return
+        merged, namemaps = merge_searches([p.request for p in pending])
+        result = context.search_now(merged)
+        for p, namemap in zip(pending, namemaps):
+            p.complete(split_result(result, namemap))
+    except Exception as ex:
+        for p in pending:
+            if not p.done.is_set():
+                p.complete(error = ex)
+
+
+# An explicit batch: everything searched inside the 'with' goes out in one request when the
+# block ends. Results are PendingSearch objects; call result() on them after the block
+class SearchBatch:
+
+    def __init__(self, context):
+        self.context = context
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def search(self, request, transform = None):
+        pending = PendingSearch(request, transform)
+        self.pending.append(pending)
+        return pending
+
+    def get_by_id(self, type, id, fields = "*"):
+        return self.search(self.context.get_by_id_request(type, id, fields), lambda r: self.context.pick_by_id(r, type, id))
+
+    def basic_search(self, searchterm, limit = 0, skip = 0, fields = "~text,engagement"):
+        return self.search(self.context.basic_search_request(searchterm, limit, skip, fields))
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        run_pending(self.context, pending)
+
+
+# Implicit batching: searches made from any thread within 'window' seconds of the first one are
+# merged into a single request. Callers block as usual, they just wait a little longer
+class SearchCoalescer:
+
+    def __init__(self, context, window = 0.02, max_batch = 20):
+        self.context = context
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []
+        self.timer = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.searches = 0
+
+    def search(self, request, transform = None):
+        pending = PendingSearch(request, transform)
+        flush_now = False
+        with self.lock:
+            self.pending.append(pending)
+            self.searches += 1
+            if len(self.pending) >= self.max_batch:
+                flush_now = True
+            elif self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if flush_now:
+            self.flush()
+        return pending.result()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if pending:
+                self.batches += 1
+        run_pending(self.context, pending)
@@ -1,7 +1,14 @@
 
-import requests
 import logging
 import json
+import records
+import jsonstream
+
+from transport import HttpTransport
+from userdirectory import UserDirectory
+from coalesce import SearchBatch, SearchCoalescer
+from apicache import ResultCache
+from metrics import MetricsRegistry
 
 class AuthenticationError(Exception):
     """ Exception for 401 errors, meaning your token was bad (expired maybe?) """
@@ -14,13 +21,29 @@ class NotFoundError(Exception):
     """Exception for 404 errors, meaning whatever you were looking for wasn't found
        (This is rare from the API) """
 
-# Given a normal result set for users, find the user by id or return some reasonable default
+# Given a normal result set for users, find the user by id or return some reasonable default.
+# This is a linear scan; prefer ApiContext.users (a UserDirectory) for anything in a loop
 def get_user_or_default(users, id):
     for u in users:
         if "id" in u and u["id"] == id:
             return u
     return { "id" : id, "username" : "???", "avatar": "0" }
 
+# How many bytes of a response actually came over the connection, which for a compressed response
+# is less than the decoded content. requests doesn't say directly, but the raw urllib3 response
+# counts what it read; failing that (a stand-in transport) use Content-Length, then the decoded size
+def wire_size(response, decoded):
+    try:
+        read = response.raw.tell()
+        if read:
+            return read
+    except Exception:
+        pass
+    try:
+        return int(response.headers["Content-Length"])
+    except (KeyError, TypeError, ValueError):
+        return decoded
+
 
 # Your gateway to the static endpoints for contentapi. It's a context because it needs
 # to track stuff like "which api am I contacting" and "which user am I authenticating as (if any)"
@@ -28,19 +51,52 @@ class ApiContext:
 
     # You MUST define the endpoint when creating the API context! You can optionally set
     # the token on startup, or you can set it at any time. Set to a "falsey" value to 
-    # to browse as an anonymous user
-    def __init__(self, endpoint: str, logger: logging.Logger, token = False):
+    # to browse as an anonymous user. The transport does the actual HTTP; by default it's a pooled
+    # keep-alive transport, but anything with the same get/post methods works. Every user seen in
+    # a search result lands in 'users', a directory you can share with the websocket side. Request
+    # counts, latency and bytes go into 'metrics' (share that one too)
+    def __init__(self, endpoint: str, logger: logging.Logger, token = False, transport = None, users = None, metrics = None):
         self.endpoint = endpoint
         self.logger = logger
         self.token = token
+        self.transport = transport or HttpTransport()
+        self.users = users if users is not None else UserDirectory()
+        self.metrics = metrics or MetricsRegistry()
+        self.coalescer = None
+        self.cache = None
+        self.store = None # Set to a MessageStore to keep everything searches return
+        self.accept_encoding = None # None leaves it to requests (which asks for gzip and deflate)
+        self.streaming = False # search_rows decodes rows as the body comes in instead of all at the end
+        self.stream_chunk_size = 65536
+
+    # Turn on caching for get_by_id and basic_search. ttls is a dict of type -> seconds ("search"
+    # is the type for basic_search), anything left out uses the cache defaults
+    def enable_cache(self, ttls = None, max_entries = 500):
+        self.cache = ResultCache(ttls, max_entries)
     
+    # Merge searches made from any thread within 'window' seconds into one "request" round trip.
+    # Pass 0 to turn it back off (the default)
+    def set_coalescing(self, window, max_batch = 20):
+        self.coalescer = SearchCoalescer(self, window, max_batch) if window else None
+
+    # Which compressed encodings to ask the API for, like "gzip, deflate". An empty string asks
+    # for uncompressed responses only
+    def set_compression(self, encodings):
+        self.accept_encoding = encodings or "identity"
 
-    # Contentapi websocket endpoint is always wss, and we assume the websocket is always secure too.
-    # If these are not reasonable assumptions... I guess make a regex replacement instead?
+    # Explicitly batch searches: everything done through the returned batch inside a 'with'
+    # block goes out as a single request at the end of the block
+    def batch(self):
+        return SearchBatch(self)
+    
+
+    # Contentapi websocket endpoint is the api endpoint with the scheme swapped: wss for https, and ws
+    # for plain http (a local instance, or the mock server). If these are not reasonable assumptions...
+    # I guess make a regex replacement instead?
     def websocket_endpoint(self, lastId = 0):
         if not self.token:
             raise Exception("Cannot connect to websocket endpoint without token!!")
-        result = self.endpoint.replace("https:", "wss:") + "/live/ws?token=%s" % self.token
+        result = self.endpoint.replace("https:", "wss:").replace("http:", "ws:") + "/live/ws?token=%s" % self.token
         if lastId:
             result += "&lastId=%d" % lastId
         return result
@@ -54,6 +110,8 @@ class ApiContext:
         }
         if self.token:
             headers["Authorization"] = "Bearer " + self.token
+        if self.accept_encoding:
+            headers["Accept-Encoding"] = self.accept_encoding
         return headers
     
     # Given a standard response from the API, parse the status code to throw the appropriate
@@ -75,15 +133,34 @@ class ApiContext:
     def get(self, endpoint):
         url = self.endpoint + "/" + endpoint
         # self.logger.debug("GET: " + url) # Not necessary, DEBUG in requests does this
-        response = requests.get(url, headers = self.gen_header())
+        with self.metrics.timer("http." + endpoint + ".ms"):
+            response = self.transport.get(url, headers = self.gen_header())
+        self.record_response(endpoint, response)
         return self.parse_response(response)
     
     def post(self, endpoint, data):
         url = self.endpoint + "/" + endpoint
         # self.logger.debug("POST: " + url)
-        response = requests.post(url, headers = self.gen_header(), json = data)
+        with self.metrics.timer("http." + endpoint + ".ms"):
+            response = self.transport.post(url, headers = self.gen_header(), json = data)
+        self.record_response(endpoint, response)
         return self.parse_response(response)
 
+    # Count the request and the bytes that went each way. bytes_in is the decoded size; bytes_wire
+    # is what actually came over the connection, which is smaller when the response was compressed.
+    # Streamed responses pass the decoded size they counted (their content can't be read again)
+    def record_response(self, endpoint, response, decoded = None):
+        self.metrics.inc("http." + endpoint + ".requests")
+        if decoded is None:
+            decoded = len(response.content or b"")
+        self.metrics.inc("http.bytes_in", decoded)
+        self.metrics.inc("http.bytes_wire", wire_size(response, decoded))
+        if response.headers.get("Content-Encoding", "identity") != "identity":
+            self.metrics.inc("http.compressed_responses")
+        request = getattr(response, "request", None)
+        if request is not None and request.body:
+            self.metrics.inc("http.bytes_out", len(request.body))
+
     # Connect to the API to determine if your token is still valid. Or, if you pass a token,
     # check if only the given token is valid
     def is_token_valid(self):
@@ -109,7 +186,9 @@ class ApiContext:
     # Return info about the current user based on the token. Useful to see if your token is valid
     # and who you are
     def user_me(self):
-        return self.get("user/me")
+        result = self.get("user/me")
+        self.users.add(result)
+        return result
 
     # Basic login endpoint, should return your token on success
     def login(self, username, password, expire_seconds = False):
@@ -126,28 +205,155 @@ class ApiContext:
         return self.get("status")
     
     # Access the raw search endpoint of the API (you must construct the special contentapi request yourself!)
+    # If coalescing is on, this may be merged with searches from other threads
     def search(self, requests):
-        return self.post("request", requests)
+        if self.coalescer:
+            return self.coalescer.search(requests)
+        return self.search_now(requests)
+
+    # Same as search, but always goes out immediately on its own
+    def search_now(self, requests):
+        result = self.post("request", requests)
+        if "objects" in result:
+            self.users.add_from_objects(result["objects"])
+            if self.store is not None:
+                self.store.add_from_objects(result["objects"])
+        return result
     
+    # Every row of a search result as (type, row), for results you don't need all at once. With
+    # streaming on, the rows are decoded from the body as it arrives (see jsonstream) and each one
+    # is yours as soon as it's ready, so a big result never has to be in memory whole; this always
+    # goes out on its own. Without, it's the same as going through search. Errors are the same either way
+    def search_rows(self, requests):
+        if not self.streaming:
+            result = self.search(requests)
+            for type, rows in result.get("objects", {}).items():
+                for row in rows:
+                    yield type, row
+            return
+        url = self.endpoint + "/request"
+        with self.metrics.timer("http.request.ms"):
+            response = self.transport.post(url, headers = self.gen_header(), json = requests, stream = True)
+        if response.status_code != 200:
+            self.record_response("request", response)
+            self.parse_response(response)
+        decoded = [0]
+        absorbed = { "user" : [], "message" : [] }
+        try:
+            reader = jsonstream.RowReader(jsonstream.text_chunks(response.iter_content(self.stream_chunk_size), decoded))
+            for type, row in reader.rows():
+                if type in absorbed:
+                    absorbed[type].append(row)
+                    if len(absorbed[type]) >= 500:
+                        self.absorb_rows(absorbed)
+                yield type, row
+        finally:
+            response.close()
+            self.record_response("request", response, decoded[0])
+            self.absorb_rows(absorbed)
+
+    # The same thing search_now does with users and messages it sees, for streamed rows (in batches)
+    def absorb_rows(self, absorbed):
+        self.users.add_all(absorbed["user"])
+        if self.store is not None:
+            self.store.add_users(absorbed["user"])
+            self.store.add_messages(absorbed["message"])
+        for rows in absorbed.values():
+            del rows[:]
+
+    # search_rows for a list of records.Query: (name, record) as each row is decoded
+    def query_rows(self, queries, values = None):
+        by_name = dict((query.name, query.record) for query in queries)
+        for name, row in self.search_rows(records.search_request(queries, values)):
+            if name in by_name:
+                yield name, by_name[name].from_dict(row)
+
+    # Run a list of records.Query against the request endpoint in one round trip. Only each query's
+    # declared fields are asked for; returns { name : [records] }
+    def query(self, queries, values = None):
+        return records.decode(self.search(records.search_request(queries, values)), queries)
+
     # A very basic search for outputting to the console. Constructs the contentapi search request for you: many assumptions are made!
-    def basic_search(self, searchterm, limit = 0):
-        return self.search({
+    def basic_search(self, searchterm, limit = 0, skip = 0, fields = "~text,engagement"):
+        key = ("search", searchterm, limit, skip, fields)
+        result = self.cache.get(key) if self.cache is not None else None
+        if result is None:
+            result = self.search(self.basic_search_request(searchterm, limit, skip, fields))
+            if self.cache is not None:
+                self.cache.put(key, result, "search")
+        return result
+
+    def basic_search_request(self, searchterm, limit = 0, skip = 0, fields = "~text,engagement"):
+        return {
             "values": {
                 "searchterm": searchterm,
                 "searchtermlike": "%" + searchterm + "%"
             },
             "requests": [{
                 "type": "content",
-                "fields": "~text,engagement", # All fields EXCEPT text and engagement
+                "fields": fields, # By default, all fields EXCEPT text and engagement
                 "query": "name LIKE @searchtermlike",
                 "order": "lastActionDate_desc",
-                "limit": limit
+                "limit": limit,
+                "skip": skip
             }]
-        })
+        }
+
+    # The same search as basic_search, but fetched a page at a time: yields each page (a list of
+    # content) as soon as it arrives, and only asks for the next one when you ask for it. Stops
+    # after the first short page, so nothing past the end is ever requested. Pages are in the same
+    # order (most recently active first), but each one starts after the (lastActionDate, id) of the
+    # last row of the one before instead of skipping a count of rows, so a room that gets activity
+    # while you're paging can't shift the later pages and repeat or hide a room. fields must include
+    # lastActionDate and id
+    def basic_search_pages(self, searchterm, page_size = 50, fields = "~text,engagement"):
+        before = None
+        while True:
+            key = ("search_page", searchterm, page_size, before, fields)
+            page = self.cache.get(key) if self.cache is not None else None
+            if page is None:
+                request = self.basic_search_request(searchterm, page_size, 0, fields)
+                request["requests"][0]["order"] = "lastActionDate_desc,id_desc" # Ties broken the way the cursor expects
+                if before:
+                    request["values"]["before"], request["values"]["beforeid"] = before
+                    request["requests"][0]["query"] += " and (lastActionDate < @before or (lastActionDate = @before and id < @beforeid))"
+                page = self.search(request)["objects"]["content"]
+                if self.cache is not None:
+                    self.cache.put(key, page, "search")
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            before = (page[-1]["lastActionDate"], page[-1]["id"])
+
+    # Every row from basic_search_pages, one at a time
+    def basic_search_rows(self, searchterm, page_size = 50, fields = "~text,engagement"):
+        for page in self.basic_search_pages(searchterm, page_size, fields):
+            for row in page:
+                yield row
     
     # Return the singular item of 'type' for the given ID. Raises a "NotFoundError" if nothing found.
     def get_by_id(self, type, id, fields = "*"):
-        result = self.search({
+        key = (type, id, fields)
+        result = self.cache.get(key) if self.cache is not None else None
+        if result is None:
+            result = self.pick_by_id(self.search(self.get_by_id_request(type, id, fields)), type, id)
+            if self.cache is not None:
+                self.cache.put(key, result, type, id)
+        return result
+
+    # Content rows looked up some other way (a room fetched along with its messages, say) are cached
+    # under the same key get_by_id would use for those fields, so live updates throw them out too
+    def cached_content(self, id, fields):
+        return self.cache.get(("content", id, fields)) if self.cache is not None else None
+
+    def cache_content(self, rows, fields):
+        if self.cache is not None:
+            for row in rows:
+                self.cache.put(("content", row["id"], fields), row, "content", row["id"])
+
+    def get_by_id_request(self, type, id, fields = "*"):
+        return {
             "values" : {
                 "id" : id
             },
@@ -156,8 +362,10 @@ class ApiContext:
                 "fields": fields,
                 "query": "id = @id"
             }]
-        })
+        }
 
+    # Pull the single item out of a get_by_id search result
+    def pick_by_id(self, result, type, id):
         things = result["objects"][type]
         if not len(things):
             raise NotFoundError("Couldn't find %s with id %d" % (type, id))
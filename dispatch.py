@@ -0,0 +1,146 @@
+import re
+import json
+import logging
+import threading
+
+from collections import deque
+from metrics import MetricsRegistry
+
+# Use the fastest json decoder that happens to be installed. None of these are required
+try:
+    import orjson as fastjson
+except ImportError:
+    try:
+        import ujson as fastjson
+    except ImportError:
+        fastjson = None
+
+# Live frames are the only ones we can afford to drop (the server replays them on a resumed
+# connection). Only checked once the queue is full, so it doesn't matter that it's a search
+LIVE_FRAME = re.compile(r'"type"\s*:\s*"live"')
+
+# Marks the spot in the queue where live frames started being dropped
+RESYNC = object()
+
+# Sits between the websocket reader thread and whoever consumes messages. The reader only
+# appends the raw frame to a bounded queue and returns (it never decodes, logs or renders), so
+# a slow terminal can't stall frame reads. If the consumer falls far enough behind that the
+# queue fills, new live frames are dropped and counted instead; everything else (acks, userlist
+# replies) is small and is always kept. A dropped live frame can't just be skipped, since the
+# ones after it would move last_id past it, so from the first drop every live frame is dropped
+# until the consumer has handled everything queued before it, then resync(connection) is called
+# there to reconnect from the last event actually handled. With backpressure on, nothing is ever
+# dropped: the reader thread waits for room instead, which stops it reading the socket until the
+# consumer catches up (for consumers that must not lose anything, and can't show a gap anyway).
+# Decoding and dispatch happen on the consumer side: each message goes to the handler registered
+# for its "type".
+class MessageDispatcher:
+
+    # 'post' schedules a function on the consumer (for us, the engine loop). batch_size is how
+    # many messages are handled before giving the consumer a chance to do something else.
+    # resync(connection) is called on the consumer after live frames were dropped (see above)
+    def __init__(self, post, maxsize = 10000, batch_size = 100, decoder = None, metrics = None, resync = None):
+        self.post = post
+        self.resync = resync
+        self.metrics = metrics or MetricsRegistry()
+        self.metrics.gauge("ws.queue_depth", self.queue_depth)
+        self.metrics.source("ws.dispatch", lambda: self.stats)
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.decode = decoder or (fastjson.loads if fastjson else json.loads)
+        self.handlers = {}
+        self.default_handler = None
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.room = threading.Condition(self.lock) # Notified when the consumer takes frames off the queue
+        self.backpressure = False
+        self.drain_scheduled = False
+        self.resyncing = False # Dropping live frames until the consumer reaches the RESYNC mark
+        self.stats = {
+            "received" : 0,
+            "dropped" : 0,
+            "resyncs" : 0,
+            "decode_errors" : 0,
+            "backpressure_waits" : 0,
+            "max_queue" : 0
+        }
+
+    # handler(connection, message) for every decoded message with the given type
+    def register(self, type, handler):
+        self.handlers[type] = handler
+
+    # handler(connection, message) for any type nothing else is registered for
+    def set_default(self, handler):
+        self.default_handler = handler
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    # Called on the reader thread for every frame. Must stay cheap!
+    def feed(self, connection, raw):
+        self.metrics.inc("ws.frames_in")
+        self.metrics.inc("ws.bytes_in", len(raw))
+        with self.lock:
+            self.stats["received"] += 1
+            if self.backpressure and len(self.queue) >= self.maxsize:
+                self.stats["backpressure_waits"] += 1
+                while len(self.queue) >= self.maxsize:
+                    self.room.wait()
+            if (self.resyncing or len(self.queue) >= self.maxsize) and LIVE_FRAME.search(raw):
+                self.stats["dropped"] += 1
+                if not self.resyncing:
+                    self.resyncing = True
+                    self.queue.append((connection, RESYNC))
+                return
+            self.queue.append((connection, raw))
+            if len(self.queue) > self.stats["max_queue"]:
+                self.stats["max_queue"] = len(self.queue)
+            if self.drain_scheduled:
+                return
+            self.drain_scheduled = True
+        self.post(self.drain)
+
+    # Called on the consumer: handle up to batch_size queued messages, then reschedule if there's more
+    def drain(self):
+        with self.lock:
+            count = min(self.batch_size, len(self.queue))
+            batch = [self.queue.popleft() for i in range(count)]
+            self.room.notify_all()
+        for connection, raw in batch:
+            self.dispatch(connection, raw)
+        with self.lock:
+            if not self.queue:
+                self.drain_scheduled = False
+                return
+        self.post(self.drain)
+
+    # Decode and hand a single raw message to its handler
+    def dispatch(self, connection, raw):
+        if raw is RESYNC:
+            return self.resync_now(connection)
+        logging.debug("WSRCV: %s", raw)
+        try:
+            with self.metrics.timer("ws.decode_ms"):
+                message = self.decode(raw)
+        except ValueError as ex:
+            self.stats["decode_errors"] += 1
+            logging.warning("Couldn't decode websocket message: %s", ex)
+            return
+        if not isinstance(message, dict):
+            self.stats["decode_errors"] += 1
+            logging.warning("Websocket message isn't an object: %s", raw[:100])
+            return
+        handler = self.handlers.get(message.get("type"), self.default_handler)
+        if handler:
+            with self.metrics.timer("ws.handle_ms"):
+                handler(connection, message)
+
+    # Everything before the first dropped live frame has been handled: reconnect from here. Live
+    # frames keep being dropped until resync has cut the old connection off
+    def resync_now(self, connection):
+        self.stats["resyncs"] += 1
+        logging.warning("Fell behind on websocket messages, resyncing from the last event handled")
+        if self.resync:
+            self.resync(connection)
+        with self.lock:
+            self.resyncing = False
@@ -0,0 +1,239 @@
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+
+import main
+
+# A client with no console: connects with the token and config the interactive client uses, then
+# writes every live event as one compact json line (to stdout or a file) for archiving or for bots
+# to consume. No input thread, no colors, no rendering. Lines go through JsonLinesWriter, which
+# does the actual writing on its own thread in large batches. If the output can't keep up, the
+# writer's queue fills and the handler waits; that backs up into the dispatcher's bounded queue,
+# and once that's full the socket reader waits too (the dispatcher is switched to backpressure),
+# so a slow disk slows us down instead of losing events. If the output fails outright (a closed
+# pipe, a full disk), the error is raised from write() and close() and the client stops.
+
+# Sentinel telling the writer thread to finish up
+CLOSE = object()
+
+class JsonLinesWriter:
+
+    # At most max_lines wait to be written. Buffered output is flushed at least every flush_seconds
+    def __init__(self, stream, max_lines = 10000, flush_seconds = 0.5):
+        self.stream = stream
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue(max_lines)
+        self.thread = None
+        self.error = None # Whatever stopped the writer thread, if something did
+        self.stats = {
+            "lines" : 0,
+            "bytes" : 0,
+            "writes" : 0,
+            "backpressure_waits" : 0
+        }
+
+    def start(self):
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    # Queue one object to be written as a line. Blocks while the queue is full. Raises the
+    # writer thread's error if the output has failed
+    def write(self, obj):
+        self.check()
+        line = json.dumps(obj, separators = (",", ":"), ensure_ascii = False)
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.stats["backpressure_waits"] += 1
+            self.put(line)
+
+    # Wait for room in the queue, but not on a writer thread that has died
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put(item, timeout = 0.5)
+                return
+            except queue.Full:
+                self.check()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        try:
+            self.write_batches()
+        except Exception as ex:
+            self.error = ex
+            logging.error("Can't write events: %s", ex)
+
+    def write_batches(self):
+        last_flush = time.monotonic()
+        dirty = False
+        closing = False
+        while not closing:
+            try:
+                batch = [self.queue.get(timeout = self.flush_seconds)]
+            except queue.Empty:
+                if dirty:
+                    self.stream.flush()
+                    dirty = False
+                    last_flush = time.monotonic()
+                continue
+            # Take everything that's waiting and write it in one go
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is CLOSE:
+                closing = True
+                batch.pop()
+            if batch:
+                text = "\n".join(batch) + "\n"
+                self.stream.write(text)
+                self.stats["lines"] += len(batch)
+                self.stats["bytes"] += len(text)
+                self.stats["writes"] += 1
+                dirty = True
+            if dirty and (closing or time.monotonic() - last_flush >= self.flush_seconds):
+                self.stream.flush()
+                dirty = False
+                last_flush = time.monotonic()
+
+    # Write out everything queued and stop the writer thread. Raises its error if it had one
+    def close(self):
+        if self.thread:
+            if self.error is None:
+                try:
+                    self.put(CLOSE)
+                except Exception:
+                    pass
+            self.thread.join()
+            self.thread = None
+        self.check()
+
+
+# The events in a live update as one flat dict each: the event itself plus the object it refers
+# to (the message for a message_event, and so on) and that object's room. Only rooms and types
+# in the given sets, if given
+def live_events(data, rooms = None, types = None):
+    objects = data.get("objects", {})
+    for event in data.get("events", []):
+        type = event.get("type", "")
+        if types and type not in types:
+            continue
+        # Objects for an event are under its type, then the object type (message_event -> message)
+        refs = objects.get(type, {}).get(type[:-6] if type.endswith("_event") else type, [])
+        obj = next((o for o in refs if o.get("id") == event.get("refId")), None)
+        room = obj.get("contentId") if obj else None
+        if rooms and room not in rooms:
+            continue
+        line = dict(event)
+        line["room"] = room
+        line["object"] = obj
+        yield line
+
+# A userlistupdate as lines, one per room it touches
+def userlist_events(data, rooms = None):
+    for room, statuses in data.get("statuses", {}).items():
+        if rooms and int(room) not in rooms:
+            continue
+        yield { "type" : "userlistupdate", "room" : int(room), "statuses" : statuses }
+
+
+# Hook a session's dispatcher up to a writer instead of the console. Events are never dropped:
+# the dispatcher makes the socket wait instead. Once the writer has failed, the connection is
+# closed (which stops the client) and last_id isn't saved again
+def attach(session, writer, rooms = None, types = None):
+    ws = session.connection
+    session.dispatcher.backpressure = True
+
+    def write_all(ws, lines):
+        if ws.closing:
+            return False
+        try:
+            for line in lines:
+                writer.write(line)
+            return True
+        except Exception:
+            ws.close()
+            return False
+
+    def onlive(ws, result):
+        data = ws.track_live(result["data"])
+        if data is None:
+            return
+        result = dict(result, data = data)
+        main.absorb_users(ws, result)
+        if write_all(ws, live_events(result["data"], rooms, types)) and ws.context.store is not None:
+            ws.context.store.set_last_id(ws.last_id)
+
+    def onuserlistupdate(ws, result):
+        if not types or "userlistupdate" in types:
+            write_all(ws, userlist_events(result["data"], rooms))
+
+    session.dispatcher.register("live", onlive)
+    session.dispatcher.register("userlistupdate", onuserlistupdate)
+    ws.context.metrics.source("headless.writer", lambda: writer.stats)
+    return ws
+
+def headless_onopen(ws, reconnected):
+    if reconnected:
+        logging.warning("Reconnected, resumed from event %d (%dms)", ws.last_id, ws.stats["last_reconnect_ms"])
+    else:
+        logging.info("Connected to live updates")
+
+def headless_onclose(ws):
+    logging.info("Websocket closed")
+    ws.engine.stop()
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = "Stream contentapi live events as json lines, no console needed. Uses the interactive client's config and token")
+    parser.add_argument("--output", help = "Append lines to this file instead of stdout")
+    parser.add_argument("--rooms", type = int, nargs = "*", help = "Only events in these rooms")
+    parser.add_argument("--types", nargs = "*", help = "Only these event types (message_event, activity_event, userlistupdate, ...)")
+    parser.add_argument("--max-lines", type = int, default = 10000, help = "Lines waiting to be written before events wait on the output")
+    parser.add_argument("--flush-seconds", type = float, default = 0.5)
+    return parser.parse_args(argv)
+
+def run(argv = None):
+    args = parse_args(argv)
+    main.load_or_create_global_config()
+    config = main.config
+    context = main.create_context(config)
+    user_info = context.is_token_valid() if main.load_token(config, context) else False
+    if not user_info:
+        logging.error("No valid token in %s; log in once with the interactive client first", config["tokenfile"])
+        return 1
+
+    stream = open(args.output, "a", encoding = "utf-8") if args.output else sys.stdout
+    writer = JsonLinesWriter(stream, args.max_lines, args.flush_seconds).start()
+    session = main.create_session(context, config, headless_onopen, headless_onclose, user_info)
+    attach(session, writer, set(args.rooms or []), set(args.types or []))
+    if context.store is not None:
+        session.connection.last_id = context.store.last_id
+
+    session.start()
+    try:
+        session.engine.run_forever()
+    except KeyboardInterrupt:
+        session.connection.close()
+    finally:
+        try:
+            writer.close()
+        except Exception:
+            pass # The writer already logged it
+        if args.output:
+            stream.close()
+    return 1 if writer.error else 0
+
+if __name__ == "__main__":
+    sys.exit(run())
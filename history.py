@@ -0,0 +1,141 @@
+from contentapi import NotFoundError
+from records import Query, ContentRecord, UserRecord, MessageRecord
+
+# Message history for one room, loaded newest first a chunk at a time. Each chunk is a single
+# "request" with the messages and their authors together, so one round trip is enough to render
+# it. Only the cursor (the oldest id loaded so far) is kept here; the messages themselves are
+# handed back to be printed, so a room with years of backlog costs no more memory than a new one.
+# With a message store on the context, whatever the store holds every message of (its coverage)
+# comes from there instead: the newest chunk only asks the server for what's newer than that, and
+# older chunks only for the part the store lacks, or not at all. What the server sends is stored
+# and extends the coverage, so the next run has it too.
+class RoomHistory:
+
+    def __init__(self, context, room, chunk_size = 30):
+        self.context = context
+        self.store = context.store
+        self.room = room
+        self.chunk_size = chunk_size
+        self.before = 0 # Oldest message id loaded so far (0 = nothing loaded yet)
+        self.exhausted = False
+        self.loading = False # A chunk has been asked for and isn't back yet (up to whoever asked)
+        self.stored = []     # The store's part of the chunk being loaded, newest first
+        self.coverage = None # The store's coverage of the room when the chunk was started
+        self.after = 0       # For the newest chunk: only messages newer than this are asked for
+
+    # Start on the next chunk back with what the store has of it. Returns the chunk (oldest first,
+    # like take_chunk) if the store has all of it; otherwise None, and chunk_queries() asks the
+    # server for the rest, which goes through take_chunk as usual
+    def start_chunk(self):
+        self.stored = []
+        self.after = 0
+        self.coverage = self.store.coverage(self.room) if self.store is not None else None
+        if self.coverage is None or self.exhausted:
+            return None
+        since, until = self.coverage
+        if not self.before:
+            self.after = until # Everything up to here is stored; take_chunk fills in from the store
+            return None
+        if not since < self.before <= until + 1:
+            return None
+        self.stored = self.stored_messages(self.before, self.chunk_size)
+        if len(self.stored) == self.chunk_size or not since:
+            return self.take_chunk([], False)
+        return None
+
+    # The queries for (the rest of) the next chunk. Pass include_room to get the room itself in the same request
+    def chunk_queries(self, include_room = False):
+        if self.after:
+            query = "contentId = @room and id > @after"
+        else:
+            query = "contentId = @room" + (" and id < @before" if self.cursor() else "")
+        queries = [
+            Query(MessageRecord, query, "id_desc", self.chunk_size - len(self.stored)),
+            Query(UserRecord, "id in @message.createUserId")
+        ]
+        if include_room:
+            queries.insert(0, Query(ContentRecord, "id = @room"))
+        return queries
+
+    def chunk_values(self):
+        return {
+            "room" : self.room,
+            "before" : self.cursor(),
+            "after" : self.after
+        }
+
+    # Where the server's part of the chunk starts (older than this)
+    def cursor(self):
+        return self.stored[-1].id if self.stored else self.before
+
+    # Finish a chunk with the server's part of it (newest first, as it comes back): move the cursor
+    # past it and return it oldest first, for printing. Deleted messages still move the cursor but
+    # aren't returned. 'asked' is False when the store had the whole chunk
+    def take_chunk(self, messages, asked = True):
+        since, until = self.coverage or (0, 0)
+        if self.after:
+            if len(messages) < self.chunk_size:
+                # Everything newer than the store came back, so the store carries on below it
+                until = messages[0].id if messages else until
+                self.store.set_coverage(self.room, since, until)
+                chunk = messages + self.stored_messages(messages[-1].id if messages else until + 1, self.chunk_size - len(messages))
+                self.exhausted = not since and len(chunk) < self.chunk_size
+                if not chunk:
+                    self.before = since
+            else:
+                # Too much is new to join up with what's stored: start again from this chunk
+                self.store.set_coverage(self.room, messages[-1].id, messages[0].id)
+                chunk = messages
+        else:
+            chunk = self.stored + messages
+            if asked:
+                self.exhausted = len(messages) < self.chunk_size - len(self.stored)
+                cursor = self.cursor()
+                oldest = 0 if self.exhausted else messages[-1].id
+                if self.store is not None and not cursor:
+                    self.store.set_coverage(self.room, oldest, messages[0].id if messages else 0)
+                elif self.coverage is not None and since <= cursor <= until + 1:
+                    self.store.set_coverage(self.room, min(since, oldest), until)
+            else:
+                self.exhausted = len(chunk) < self.chunk_size
+        if chunk:
+            self.before = chunk[-1].id
+        self.stored = []
+        self.after = 0
+        return [m for m in reversed(chunk) if not m.deleted]
+
+    # Stored messages older than 'before' but within the coverage, newest first (deleted ones
+    # too, they move the cursor). Their authors go into the user directory if it's lost them
+    def stored_messages(self, before, limit):
+        messages = MessageRecord.from_list(reversed(self.store.messages(self.room, before, limit, self.coverage[0], deleted = True)))
+        for id in set(m.createUserId for m in messages):
+            if self.context.users.get(id) is None:
+                user = self.store.user(id)
+                if user is not None:
+                    self.context.users.add(user)
+        return messages
+
+    # The next chunk back, oldest first. Empty once there's nothing older
+    def load_older(self):
+        if self.exhausted:
+            return []
+        chunk = self.start_chunk()
+        if chunk is not None:
+            return chunk
+        return self.take_chunk(self.context.query(self.chunk_queries(), self.chunk_values())["message"])
+
+
+# Look up a room and its newest chunk of history in a single round trip (the room isn't asked for
+# if it's in the context's cache). Returns (room, history, messages); raises NotFoundError if
+# there's no such room
+def join(context, room, chunk_size = 30):
+    history = RoomHistory(context, room, chunk_size)
+    history.start_chunk()
+    data = context.cached_content(room, ContentRecord.fields())
+    result = context.query(history.chunk_queries(include_room = data is None), history.chunk_values())
+    if data is None:
+        if not result["content"]:
+            raise NotFoundError("Couldn't find content with id %d" % room)
+        data = result["content"][0]
+        context.cache_content([data], ContentRecord.fields())
+    return data, history, history.take_chunk(result["message"])
@@ -0,0 +1,124 @@
+import re
+import json
+import codecs
+
+# Incremental decoding of a contentapi "request" result. Normally the whole body is read, then
+# the whole object tree is built, then the caller looks at the rows, so a big result briefly costs
+# the raw text plus every row at once. This reads the body a chunk at a time and hands out each
+# row of objects.<type> as soon as it has been decoded, so the caller can keep only what it wants
+# (or a compact record of it) and the rest is freed as it goes. Only the text of the row being
+# decoded and one chunk are held at a time. Everything outside "objects" is small and is decoded
+# whole into 'rest'.
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER_TAIL = re.compile(r"[0-9.eE+-]*$") # What could still be part of a number cut off by the chunk
+DECODER = json.JSONDecoder()
+
+class RowReader:
+
+    # chunks is any iterable of str
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ""
+        self.pos = 0
+        self.rest = {} # Top level values other than "objects"
+
+    # Every (type, row) under "objects", in the order they come in
+    def rows(self):
+        for key in self.members():
+            if key == "objects" and self.peek() == "{":
+                for type in self.members():
+                    if self.peek() == "[":
+                        for _ in self.elements():
+                            yield type, self.value()
+                    else:
+                        self.value()
+            else:
+                self.rest[key] = self.value()
+
+    # Read another chunk onto the buffer, dropping what's already been used. False at the end
+    def more(self):
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer = self.buffer[self.pos:] + chunk
+                self.pos = 0
+                return True
+        return False
+
+    # The next character that isn't whitespace (without using it up)
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.more():
+                raise ValueError("Response ended early")
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError("Expected '%s' but found '%s'" % (char, found))
+        self.pos += 1
+
+    # One complete json value. If it runs past the end of the buffer, read more and try again
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.more():
+                    continue
+                raise
+            # A number that ends with the buffer may have more digits in the next chunk, and one
+            # cut off after '.', 'e' or 'E' decodes as just the part before it
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and NUMBER_TAIL.match(self.buffer, end) and self.more():
+                continue
+            self.pos = end
+            return value
+
+    # The keys of an object. Each is yielded with the reader at its value, which the caller must use up
+    def members(self):
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ValueError("Expected a key but found %r" % (key,))
+            self.expect(":")
+            yield key
+            if self.separator("}"):
+                return
+
+    # The same for an array: yields once per element, with the reader at it
+    def elements(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.separator("]"):
+                return
+
+    # Use up the ',' between items (False) or the closing character (True)
+    def separator(self, close):
+        char = self.peek()
+        self.pos += 1
+        if char == close:
+            return True
+        if char != ",":
+            raise ValueError("Expected ',' or '%s' but found '%s'" % (close, char))
+        return False
+
+
+# Byte chunks (of utf-8) as text chunks, even when a character is split between two of them
+def text_chunks(byte_chunks, counter = None):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in byte_chunks:
+        if counter is not None:
+            counter[0] += len(chunk)
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", True)
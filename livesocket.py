@@ -0,0 +1,183 @@
+import time
+import random
+import socket
+import logging
+import threading
+
+# A supervised connection to the contentapi live websocket. It looks like a WebSocketApp to the
+# rest of the program (send, close, run_forever), but when the connection drops it reconnects
+# with jittered exponential backoff and resumes from the highest event id seen, so nothing that
+# happened while we were gone is lost. Callbacks are given this object, never the raw socket, so
+# you can hang whatever state you want off of it and it survives reconnects.
+class LiveConnection:
+
+    # on_open(conn, reconnected), on_message(conn, message), on_close(conn). max_attempts = 0
+    # means keep trying forever
+    def __init__(self, context, on_message, on_open = None, on_close = None, min_backoff = 1, max_backoff = 60, max_attempts = 0):
+        self.context = context
+        self.on_message = on_message
+        self.on_open = on_open
+        self.on_close = on_close
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.last_id = 0
+        self.app = None
+        self.connected = False
+        self.closing = False
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.stale_app = None # A connection we've given up on; anything more it delivers is ignored
+        self.resync_requested = False
+        self.opened_count = 0
+        self.dropped_at = None
+        self.resume_from = None  # last_id when we reconnected, until we've caught up past resume_until
+        self.resume_until = None # lastId of the first update after reconnecting (what was missed ends there)
+        self.stats = {
+            "reconnects" : 0,
+            "failed_attempts" : 0,
+            "last_reconnect_ms" : 0,
+            "max_reconnect_ms" : 0,
+            "total_reconnect_ms" : 0,
+            "events_recovered" : 0,
+            "events_replayed" : 0, # Duplicates the server sent again; these are dropped
+            "resyncs" : 0, # Reconnects we asked for because frames were lost on our side
+            "resumes_without_lastid" : 0 # Drops before we ever saw an event id; anything missed is gone
+        }
+
+    # Connect and keep connected until close() is called (or we run out of attempts). Blocks
+    def run_forever(self):
+        import websocket # Only loaded once we actually connect
+        attempt = 0
+        while not self.closing:
+            self.app = websocket.WebSocketApp(self.context.websocket_endpoint(self.last_id),
+                on_open = self._handle_open, on_message = self._handle_message,
+                on_error = self._handle_error, on_close = self._handle_close)
+            self.app.run_forever()
+            if self.closing:
+                break
+            if self.connected or self.dropped_at is None:
+                # We had a good connection and lost it: start the reconnect clock over
+                self.connected = False
+                self.dropped_at = time.monotonic()
+                if not self.last_id:
+                    self.stats["resumes_without_lastid"] += 1
+                attempt = 0
+            else:
+                self.stats["failed_attempts"] += 1
+            attempt += 1
+            if self.max_attempts and attempt > self.max_attempts:
+                logging.warning("Giving up on websocket after %d attempts", self.max_attempts)
+                break
+            delay = min(self.max_backoff, self.min_backoff * (2 ** (attempt - 1)))
+            delay = random.uniform(delay / 2, delay)
+            if self.resync_requested:
+                self.resync_requested = False
+                delay = 0 # The server's fine, we just need the events we lost again
+            logging.info("Websocket dropped, reconnecting in %.1fs (attempt %d, lastId %d)", delay, attempt, self.last_id)
+            self.wakeup.wait(delay)
+        if self.on_close:
+            self.on_close(self)
+
+    def send(self, data):
+        self.app.send(data)
+
+    # Close for good (no reconnect)
+    def close(self):
+        self.closing = True
+        self.wakeup.set()
+        # WebSocketApp.close() pulls the socket out from under its own reader thread (which then logs
+        # an error on the way out); closing the socket itself lets the reader finish normally
+        app = self.app
+        if app:
+            app.keep_running = False
+            if app.sock:
+                app.sock.close()
+
+    # Frames were lost on our side (we couldn't keep up). Drop the connection and reconnect from
+    # last_id, so the server sends everything after it again, and ignore anything else the current
+    # connection delivers in the meantime (it would move last_id past what was lost)
+    def resync(self):
+        with self.lock:
+            app = self.stale_app = self.app
+        self.stats["resyncs"] += 1
+        self.resync_requested = True
+        if app:
+            app.keep_running = False
+            if app.sock:
+                # Shutting the socket down wakes the reader up now; just closing it can leave it
+                # waiting out its poll timeout first
+                try:
+                    app.sock.sock.shutdown(socket.SHUT_RDWR)
+                except Exception:
+                    app.sock.close()
+
+    # Record the events in a live update. Events we've already handled (the server can send some
+    # again) are taken out, along with the objects only they referred to. Returns the update to
+    # handle, or None if every event in it was a replay (the caller should skip it)
+    def track_live(self, data):
+        events = data.get("events", [])
+        fresh = [e for e in events if e.get("id", self.last_id + 1) > self.last_id]
+        if len(fresh) < len(events):
+            self.stats["events_replayed"] += len(events) - len(fresh)
+            if not fresh:
+                return None
+            data = without_replayed(data, fresh)
+        ids = [e["id"] for e in fresh if "id" in e]
+        newest = max(ids + [data.get("lastId", 0)])
+        # After a reconnect, the events from where we were up to the first update's lastId are
+        # the ones we missed while disconnected
+        if self.resume_from is not None:
+            if self.resume_until is None:
+                self.resume_until = newest
+            self.stats["events_recovered"] += len([i for i in ids if self.resume_from < i <= self.resume_until])
+            if max(ids + [self.resume_from]) >= self.resume_until:
+                self.resume_from = None # Caught up
+        self.last_id = max(self.last_id, newest)
+        return data
+
+    def _handle_open(self, app):
+        self.connected = True
+        self.opened_count += 1
+        reconnected = self.opened_count > 1
+        if reconnected and self.dropped_at is not None:
+            latency = int((time.monotonic() - self.dropped_at) * 1000)
+            self.stats["reconnects"] += 1
+            self.stats["last_reconnect_ms"] = latency
+            self.stats["max_reconnect_ms"] = max(latency, self.stats["max_reconnect_ms"])
+            self.stats["total_reconnect_ms"] += latency
+            self.resume_from = self.last_id or None
+            self.resume_until = None
+        self.dropped_at = None
+        if self.on_open:
+            self.on_open(self, reconnected)
+
+    def _handle_message(self, app, message):
+        with self.lock:
+            if app is not self.stale_app:
+                self.on_message(self, message)
+
+    def _handle_error(self, app, error):
+        logging.debug("Websocket error: %s", error)
+
+    # Older websocket-client versions pass only the app, newer ones add status and reason
+    def _handle_close(self, app, *args):
+        logging.debug("Websocket closed: %s", args)
+
+
+# A copy of a live update with only the given events, and only the objects those events refer to
+# (objects are under their event's type, then the object's type: message_event -> message). Other
+# objects (like the users messages refer to) are kept as they are
+def without_replayed(data, events):
+    kept = dict(data)
+    kept["events"] = events
+    objects = {}
+    for type, by_type in data.get("objects", {}).items():
+        if not isinstance(by_type, dict):
+            objects[type] = by_type
+            continue
+        refs = set(e.get("refId") for e in events if e.get("type") == type)
+        primary = type[:-6] if type.endswith("_event") else type
+        objects[type] = dict((name, [o for o in rows if o.get("id") in refs] if name == primary else rows) for name, rows in by_type.items())
+    kept["objects"] = objects
+    return kept
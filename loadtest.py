@@ -0,0 +1,247 @@
+import sys
+import json
+import math
+import time
+import bisect
+import random
+import logging
+import argparse
+import threading
+import itertools
+
+from concurrent.futures import ProcessPoolExecutor
+
+import contentapi
+import livesocket
+import mockserver
+from transport import HttpTransport
+
+# Load generator for sizing a contentapi deployment. N sessions, each with its own login, HTTP
+# pool and live websocket, are spread over a pool of worker processes (one thread per session
+# inside each worker, so the GIL isn't the bottleneck). Every session runs the same weighted mix
+# of operations until the time is up: searches, get_by_id, userlist requests and message sends
+# over the websocket. Each operation is timed from request to reply; the report is throughput and
+# latency percentiles per operation. --mock runs the whole thing against a local mock server (CI).
+
+OPERATIONS = ["search", "get", "userlist", "send"]
+SEARCH_TERMS = ["mega", "chat", "big", "help", "a", "e", "programming", "zzz"]
+
+# Exact percentile (nearest rank) of an already sorted list
+def percentile(values, fraction):
+    if not values:
+        return 0
+    return values[min(len(values), max(1, math.ceil(fraction * len(values)))) - 1]
+
+# "search=4,get=4,userlist=1,send=1" -> { "search" : 4, ... }
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        if name.strip() not in OPERATIONS:
+            raise ValueError("Unknown operation %s (use %s)" % (name, ", ".join(OPERATIONS)))
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+# One simulated user. Websocket requests block the session's own thread until the reply with
+# the same id comes back, so their latency is measured the same way as HTTP calls
+class LoadSession:
+
+    def __init__(self, settings, index):
+        self.settings = settings
+        self.index = index
+        self.random = random.Random(settings["seed"] + index)
+        self.pending = {} # request id -> [event, reply]
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.live_frames = 0
+        self.opened = threading.Event()
+
+    def connect(self):
+        self.context = contentapi.ApiContext(self.settings["api"], logging, transport = HttpTransport(pool_size = 2, retries = 0))
+        username = self.settings["username_format"] % (self.index + 1)
+        self.context.token = self.context.login(username, self.settings["password"])
+        self.connection = livesocket.LiveConnection(self.context, self.on_message, lambda c, r: self.opened.set(), max_attempts = 3)
+        thread = threading.Thread(target = self.connection.run_forever)
+        thread.daemon = True
+        thread.start()
+        if not self.opened.wait(self.settings["timeout"]):
+            raise TimeoutError("Websocket for %s didn't open" % username)
+
+    def close(self):
+        self.connection.close()
+        self.context.transport.close()
+
+    def on_message(self, connection, raw):
+        message = json.loads(raw)
+        with self.lock:
+            waiting = self.pending.pop(message.get("id"), None)
+        if waiting:
+            waiting[1] = message
+            waiting[0].set()
+        elif message.get("type") == "live":
+            self.live_frames += 1
+
+    # Send a websocket request and wait for its reply
+    def request(self, type, data = None):
+        id = "load_%d_%d" % (self.index, next(self.ids))
+        waiting = [threading.Event(), None]
+        with self.lock:
+            self.pending[id] = waiting
+        self.connection.send(self.context.gen_ws_request(type, data, id))
+        if not waiting[0].wait(self.settings["timeout"]):
+            with self.lock:
+                self.pending.pop(id, None)
+            raise TimeoutError("No reply to %s" % type)
+        if waiting[1].get("error"):
+            raise contentapi.BadRequestError(waiting[1]["error"])
+        return waiting[1]
+
+    def run_operation(self, name):
+        if name == "search":
+            self.context.basic_search(self.random.choice(SEARCH_TERMS), 20)
+        elif name == "get":
+            self.context.get_by_id("content", self.random.randint(1, self.settings["rooms"]))
+        elif name == "userlist":
+            self.request("userlist")
+        elif name == "send":
+            self.request("write", { "contentId" : self.random.randint(1, self.settings["rooms"]), "text" : "Load test message from session %d" % self.index })
+
+    # Run the mix until the deadline, recording into results (name -> { latencies, errors }), which
+    # all the sessions in the worker share
+    def run(self, deadline, results, lock):
+        names = list(self.settings["mix"].keys())
+        cumulative = list(itertools.accumulate(self.settings["mix"][n] for n in names))
+        while time.monotonic() < deadline:
+            name = names[bisect.bisect_right(cumulative, self.random.random() * cumulative[-1])]
+            start = time.perf_counter()
+            try:
+                self.run_operation(name)
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    results[name]["latencies"].append(elapsed)
+            except Exception as ex:
+                with lock:
+                    results[name]["errors"] += 1
+                logging.debug("Session %d %s failed: %s", self.index, name, ex)
+            if self.settings["think"]:
+                time.sleep(self.random.uniform(0, 2 * self.settings["think"]))
+
+
+# Everything one worker process does: connect its sessions, run them all for the duration on
+# their own threads, and hand back the raw timings. Must be importable (it's run in other processes)
+def run_worker(settings, indexes):
+    logging.basicConfig(level = logging.WARNING)
+    results = dict((name, { "latencies" : [], "errors" : 0 }) for name in settings["mix"])
+    report = { "results" : results, "sessions" : 0, "connect_errors" : 0, "live_frames" : 0 }
+    sessions = []
+    for index in indexes:
+        session = LoadSession(settings, index)
+        try:
+            session.connect()
+            sessions.append(session)
+        except Exception as ex:
+            report["connect_errors"] += 1
+            logging.warning("Session %d couldn't connect: %s", index, ex)
+    report["sessions"] = len(sessions)
+    deadline = time.monotonic() + settings["duration"]
+    lock = threading.Lock()
+    threads = [threading.Thread(target = s.run, args = (deadline, results, lock)) for s in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for session in sessions:
+        report["live_frames"] += session.live_frames
+        session.close()
+    return report
+
+# Combine the worker reports into throughput and percentiles per operation
+def summarize(reports, duration):
+    summary = { "sessions" : 0, "connect_errors" : 0, "live_frames" : 0, "duration" : duration, "operations" : {} }
+    merged = {}
+    for report in reports:
+        for key in ["sessions", "connect_errors", "live_frames"]:
+            summary[key] += report[key]
+        for name, result in report["results"].items():
+            into = merged.setdefault(name, { "latencies" : [], "errors" : 0 })
+            into["latencies"].extend(result["latencies"])
+            into["errors"] += result["errors"]
+    for name, result in merged.items():
+        latencies = sorted(result["latencies"])
+        summary["operations"][name] = {
+            "count" : len(latencies),
+            "errors" : result["errors"],
+            "per_second" : len(latencies) / duration,
+            "p50_ms" : percentile(latencies, 0.5),
+            "p90_ms" : percentile(latencies, 0.9),
+            "p99_ms" : percentile(latencies, 0.99),
+            "max_ms" : latencies[-1] if latencies else 0
+        }
+    return summary
+
+def report_lines(summary):
+    lines = ["%d sessions (%d failed to connect), %.1fs, %d live frames received" %
+        (summary["sessions"], summary["connect_errors"], summary["duration"], summary["live_frames"])]
+    lines.append("%-10s %8s %7s %9s %9s %9s %9s %9s" % ("operation", "count", "errors", "per sec", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for name in sorted(summary["operations"]):
+        op = summary["operations"][name]
+        lines.append("%-10s %8d %7d %9.1f %9.2f %9.2f %9.2f %9.2f" % (name, op["count"], op["errors"], op["per_second"], op["p50_ms"], op["p90_ms"], op["p99_ms"], op["max_ms"]))
+    return lines
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = "Drive many concurrent client sessions against contentapi and report latency")
+    parser.add_argument("--api", default = "http://localhost:5000/api")
+    parser.add_argument("--mock", action = "store_true", help = "Start a local mock server and test against that instead")
+    parser.add_argument("--sessions", type = int, default = 20)
+    parser.add_argument("--processes", type = int, default = 4, help = "Worker processes the sessions are spread over (0 = run in this process)")
+    parser.add_argument("--duration", type = float, default = 10, help = "Seconds each session runs its mix")
+    parser.add_argument("--mix", default = "search=4,get=4,userlist=1,send=1", help = "Operation weights")
+    parser.add_argument("--think", type = float, default = 0, help = "Average seconds a session waits between operations")
+    parser.add_argument("--rooms", type = int, default = 100, help = "get_by_id and sends pick rooms from 1 to this")
+    parser.add_argument("--username-format", default = "user%d", help = "Session N logs in as this %% N (test accounts)")
+    parser.add_argument("--password", default = mockserver.PASSWORD)
+    parser.add_argument("--timeout", type = float, default = 10)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--output", help = "Write the summary as json to this file")
+    return parser.parse_args(argv)
+
+def run(args):
+    logging.basicConfig(level = logging.WARNING)
+    server = None
+    if args.mock:
+        server = mockserver.MockServer(mockserver.MockData(users = max(args.sessions, 10), rooms = args.rooms, messages = 1000)).start()
+        args.api = server.url
+    settings = {
+        "api" : args.api,
+        "mix" : parse_mix(args.mix),
+        "duration" : args.duration,
+        "think" : args.think,
+        "rooms" : args.rooms,
+        "username_format" : args.username_format,
+        "password" : args.password,
+        "timeout" : args.timeout,
+        "seed" : args.seed
+    }
+    try:
+        if args.processes:
+            slices = [range(i, args.sessions, args.processes) for i in range(min(args.processes, args.sessions))]
+            with ProcessPoolExecutor(len(slices)) as pool:
+                reports = list(pool.map(run_worker, [settings] * len(slices), [list(s) for s in slices]))
+        else:
+            reports = [run_worker(settings, range(args.sessions))]
+    finally:
+        if server:
+            server.stop()
+    summary = summarize(reports, args.duration)
+    for line in report_lines(summary):
+        print(line)
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as f:
+            json.dump(summary, f, indent = 2)
+    return summary
+
+if __name__ == "__main__":
+    summary = run(parse_args())
+    sys.exit(1 if summary["connect_errors"] or any(op["errors"] for op in summary["operations"].values()) else 0)
@@ -1,21 +1,34 @@
 
 import os
+import sys
 import json
 import logging
 import getpass
 import textwrap
-import threading
 import re
-import toml 
-import readchar
-import websocket
-import win_unicode_console
+import argparse
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from colorama import Fore, Back, Style, init as colorama_init
 
 import contentapi
 import myutils
+import transport
+import userdirectory
+import apicache
+import livesocket
+import asyncclient
+import dispatch
+import output
+import roomindex
+import metrics
+import rooms
+import store
+import history
+import userlist
+import sendqueue
+import records
 
 CONFIGFILE="config.toml"
 MAXTITLE=25
@@ -26,36 +39,99 @@ config = {
     "default_loglevel" : "WARNING",
     "websocket_trace" : False,
     "default_room" : 0, # Zero means it will ask you for a room
+    "watched_rooms" : [], # Other rooms to listen to at the same time (unread messages are counted)
     "expire_seconds" : 31536000, # 365 days in seconds, expiration for token
     "appear_in_global" : False,
-    "tokenfile" : ".qcstoken"
+    "tokenfile" : ".qcstoken",
+    "http_pool_size" : 4, # Keep-alive connections held open to the API
+    "http_connect_timeout" : 5,
+    "http_read_timeout" : 30,
+    "http_compression" : "gzip, deflate", # Encodings to accept from the API ("" = uncompressed only)
+    "stream_responses" : False, # Decode big search results a row at a time as they arrive (less memory, a little slower)
+    "http_retries" : 2, # Only idempotent (GET) calls are retried
+    "user_cache_size" : 5000, # Users remembered for rendering (least recently used are dropped)
+    "user_cache_seconds" : 3600,
+    "coalesce_ms" : 0, # Merge searches made this close together into one request (0 = off)
+    "cache_enabled" : False, # Cache room lookups and search pages (live updates invalidate them)
+    "cache_max_entries" : 500,
+    "cache_seconds" : { "content" : 300, "search" : 30 },
+    "reconnect_min_seconds" : 1, # Websocket reconnect backoff (doubles each failed attempt, with jitter)
+    "reconnect_max_seconds" : 60,
+    "reconnect_max_attempts" : 0, # 0 means never give up
+    "message_queue_size" : 10000, # Websocket messages held while the display catches up (past that, live updates are dropped and fetched again by reconnecting)
+    "max_paused_lines" : 1000, # Live output kept while a prompt (search, watched rooms, insert) waits on you; older lines are dropped
+    "send_rate" : 5, # Messages sent per second at most (bursts of up to send_burst go out at once)
+    "send_burst" : 20,
+    "send_max_in_flight" : 20, # Messages sent but not yet acknowledged by the server
+    "send_max_pending" : 1000, # Messages waiting to be sent before new ones are refused
+    "send_ack_seconds" : 10, # A message the server hasn't acknowledged by then is sent again (0 = wait forever)
+    "send_max_attempts" : 3, # Times a message is sent before giving up on it
+    "max_message_length" : 2000, # Longer messages (or pastes) are split into several
+    "userlist_max_seconds" : 600, # How long the local userlist is trusted before asking the server again (0 = forever)
+    "search_page_size" : 25, # Rooms shown per page of search results
+    "history_chunk_size" : 30, # Messages loaded when you join a room, and each time you ask for older ones
+    "room_index" : False, # Keep a local index of room names so search doesn't go to the server
+    "room_index_file" : ".qcsrooms.json",
+    "room_index_rebuild_hours" : 24, # Rebuild the saved index from scratch this often, to pick up renames and deletes missed while offline (0 = never)
+    "message_store" : False, # Keep messages, users and rooms on disk between runs (and resume from where we left off)
+    "message_store_file" : ".qcsmessages.db",
+    "message_store_retention" : 50000, # Newest messages kept in the store (0 = all of them)
+    "metrics_file" : "", # Append a json line of runtime metrics here every metrics_interval seconds (empty = off)
+    "metrics_interval" : 60
 }
 
+# All output goes through this so it can be batched (and held while paused). Replaced in main once the config is loaded
+display = output.OutputEngine()
+
 # The command dictionary (only used to display help)
 commands = OrderedDict([
     ("h", "Help, prints this menu!"),
-    ("s", "Search, find and/or set a room to listen to (one at a time!)"),
-    ("g", "Global userlist, print users using contentapi in general"),
+    ("s", "Search, find and/or set a room to listen to (it's added to your watched rooms)"),
+    ("w", "Watched rooms, see unread counts, switch rooms or stop watching one"),
+    ("n", "Next, switch to the next watched room with unread messages"),
+    ("o", "Older, show the chunk of messages before the oldest one shown in your room"),
+    ("g", "Global userlist, print users using contentapi in general (kept up to date locally)"),
     ("u", "Userlist, print users in the current room"),
-    ("i", "Insert mode, allows you to send a message (pauses messages!)"),
+    ("i", "Insert mode, type a message to send to your room (pauses messages!)"),
     ("t", "Statistics, see info about runtime"),
     ("q", "Quit, no warning!")
 ])
 
 
-def main():
-
-    print("Program start")
-    win_unicode_console.enable()
-    colorama_init() # colorama init
+def main(argv = None):
 
-    load_or_create_global_config()
-    logging.info("Config: " + json.dumps(config, indent = 2))
+    args = parse_args(argv)
+    profile = myutils.PhaseProfile(args.profile_startup)
 
-    context = contentapi.ApiContext(config["api"], logging)
-    logging.info("Testing connection to API at " + config["api"])
-    logging.debug(json.dumps(context.api_status(), indent = 2))
-    authenticate(config, context)
+    print("Program start")
+    with profile.phase("console setup"):
+        # Only needed (and only installable) on windows, so only loaded there
+        if sys.platform == "win32":
+            import win_unicode_console
+            win_unicode_console.enable()
+        colorama_init() # colorama init
+
+    with profile.phase("config"):
+        load_or_create_global_config()
+        logging.info("Config: " + json.dumps(config, indent = 2))
+
+    global display
+    display = output.OutputEngine(config["max_paused_lines"])
+
+    # The status check and the token check don't depend on each other, so they go out together.
+    # The status result is still checked first, so a bad endpoint fails the same way it always has
+    with profile.phase("status + token check"):
+        context = create_context(config)
+        logging.info("Testing connection to API at " + config["api"])
+        has_token = load_token(config, context)
+        with ThreadPoolExecutor(2) as pool:
+            status = pool.submit(context.api_status)
+            token_check = pool.submit(context.is_token_valid) if has_token else None
+            logging.debug(json.dumps(status.result(), indent = 2))
+            user_info = token_check.result() if token_check else False
+
+    with profile.phase("authenticate"):
+        user_info = authenticate(config, context, user_info, "Token file expired" if has_token else "No token file found")
 
     # - Enter input loop, but check room number on "input" mode, don't let messages send in room 0
     #   - h to help
@@ -67,137 +143,456 @@ def main():
 
     # Let users debug the websocket if they want I guess
     if config["websocket_trace"]:
+        import websocket
         websocket.enableTrace(True)
 
-    ws = websocket.WebSocketApp(context.websocket_endpoint())
-    # Might as well reuse the websocket object for my websocket context data (oops, is that bad?)
-    ws.context = context
-    ws.user_info = context.user_me()
-    ws.pause_output = False # Whether all output from the websocket should be paused (including status updates)
-    ws.output_buffer = [] # Individual print statements buffered from output. 
-    ws.main_config = config
-    ws.current_room = 0
-    ws.current_room_data = False
-    ws.ignored = {}
-
-    # Go out and get the default room if one was provided.
+    with profile.phase("session setup"):
+        session = create_session(context, config, user_info = user_info)
+    ws = session.connection
+    ws.profile = profile
+    engine = session.engine
+
+    # The room index loads whatever we had from last time, then catches up in the background.
+    # Search uses the server until it's caught up
+    if config["room_index"]:
+        ws.room_index = roomindex.RoomIndex()
+        ws.room_index.load(config["room_index_file"], config["room_index_rebuild_hours"] * 3600)
+        profile.expect("room index ready")
+        build = engine.run_blocking(ws.room_index.build, context)
+        build.add_done_callback(lambda f: save_room_index(ws, f))
+        build.add_done_callback(lambda f: profile.mark("room index ready"))
+
+    # With a store, the websocket picks up from the last event we handled. Room history comes
+    # from the store too, as far as it goes (see history.RoomHistory), so nothing is synced up front
+    if context.store is not None:
+        ws.last_id = context.store.last_id
+
+    # Watched rooms are all looked up in a single request. Like the default room below, this
+    # happens alongside the websocket connecting
+    if config["watched_rooms"]:
+        watching = ws.async_context.query([records.Query(records.ContentRecord, "id in @ids")], { "ids" : config["watched_rooms"] })
+        watching.add_done_callback(lambda f: watch_rooms(ws, f))
+
+    # Go out and get the default room (and its recent history) if one was provided. This happens
+    # alongside the websocket connecting; the result lands back on the loop
     if config["default_room"]:
-        try:
-            ws.current_room_data = context.get_by_id("content", config["default_room"])
-            ws.current_room = config["default_room"]
-            printr(Fore.GREEN + "Found default room %s" % ws.current_room_data["name"])
-        except Exception as ex:
-            printr(Fore.YELLOW + "Error searching for default room %d: %s" % (config["default_room"], ex))
+        profile.expect("default room found")
+        lookup = engine.run_blocking(history.join, context, config["default_room"], config["history_chunk_size"])
+        lookup.add_done_callback(lambda f: set_default_room(ws, config["default_room"], f))
+        lookup.add_done_callback(lambda f: profile.mark("default room found"))
+
+    if config["metrics_file"]:
+        metrics.JsonLinesDumper(context.metrics, config["metrics_file"], config["metrics_interval"]).start()
 
-    # set the callback functions
-    ws.on_open = ws_onopen
-    ws.on_close = ws_onclose
-    ws.on_message = ws_onmessage
+    # The report waits for everything above that finishes in the background (all of it on the loop)
+    profile.mark("websocket connecting")
+    profile.expect("websocket open")
+    profile.when_complete(lambda: printr_lines([" -- Startup profile --"] + profile.report()))
+    session.start()
+    engine.run_forever()
 
-    ws.run_forever()
+    if context.store is not None:
+        context.store.close()
 
     print("Program end")
 
 
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = "A very basic frontend for qcs (contentapi)")
+    parser.add_argument("--profile-startup", action = "store_true", help = "Print how long each part of startup took, once it has all finished")
+    return parser.parse_args(argv)
+
+# Build the ApiContext (and everything it hangs on to) from the config
+def create_context(config):
+    http = transport.HttpTransport(config["http_pool_size"], (config["http_connect_timeout"], config["http_read_timeout"]), config["http_retries"])
+    users = userdirectory.UserDirectory(config["user_cache_size"], config["user_cache_seconds"])
+    registry = metrics.MetricsRegistry()
+    context = contentapi.ApiContext(config["api"], logging, transport = http, users = users, metrics = registry)
+    registry.source("http.transport", lambda: { "retries" : http.retry_count })
+    context.set_compression(config["http_compression"])
+    context.streaming = config["stream_responses"]
+    registry.gauge("http.compression_ratio", lambda: compression_ratio(registry))
+    context.set_coalescing(config["coalesce_ms"] / 1000)
+    if config["cache_enabled"]:
+        context.enable_cache(config["cache_seconds"], config["cache_max_entries"])
+        registry.source("cache", context.cache.stats)
+    if config["message_store"]:
+        context.store = store.MessageStore(config["message_store_file"], config["message_store_retention"])
+        context.users.add_all(context.store.users())
+        registry.source("store", lambda: context.store.stats)
+    return context
+
+# Decoded bytes per byte that came over the wire (1 = no savings)
+def compression_ratio(registry):
+    wire = registry.counters.get("http.bytes_wire", 0)
+    return round(registry.counters.get("http.bytes_in", 0) / wire, 2) if wire else 1
+
+# Build the (not yet started) websocket session for an authenticated context. Everything it does
+# runs on a single loop: websocket messages, keypresses and lookups are all just events, so none
+# of the state hanging off 'ws' is touched from two threads at once
+def create_session(context, config, on_open = None, on_close = None, user_info = None):
+    engine = asyncclient.ClientEngine()
+    dispatcher = dispatch.MessageDispatcher(engine.post, config["message_queue_size"], metrics = context.metrics, resync = lambda connection: connection.resync())
+    dispatcher.register("userlist", ws_onuserlist)
+    dispatcher.register("userlistupdate", ws_onuserlistupdate)
+    dispatcher.register("write", ws_onwrite)
+    dispatcher.register("live", ws_onlive)
+    dispatcher.set_default(ws_onignored)
+    session = asyncclient.AsyncLiveSession(engine, livesocket.LiveConnection, context, dispatcher,
+        on_open or ws_onopen, on_close or ws_onclose,
+        config["reconnect_min_seconds"], config["reconnect_max_seconds"], config["reconnect_max_attempts"])
+    ws = session.connection
+    context.metrics.source("ws.connection", lambda: ws.stats)
+    display.set_metrics(context.metrics)
+    # Might as well reuse the websocket object for my websocket context data (it survives reconnects)
+    ws.engine = engine
+    ws.dispatcher = dispatcher
+    ws.context = context
+    ws.async_context = asyncclient.AsyncApiContext(context, engine)
+    ws.user_info = user_info or context.user_me()
+    ws.main_config = config
+    ws.current_room = 0
+    ws.current_room_data = False
+    ws.rooms = rooms.RoomSet()
+    ws.history = None
+    ws.userlist = userlist.UserListState(config["userlist_max_seconds"])
+    context.metrics.source("userlist", lambda: ws.userlist.stats)
+    ws.sends = sendqueue.SendQueue(config["send_rate"], config["send_burst"], config["send_max_in_flight"], config["send_max_pending"],
+        config["send_ack_seconds"], config["send_max_attempts"])
+    ws.send_timer = None # The one pending call_later for pump_timer, and when it fires
+    ws.send_timer_at = 0
+    context.metrics.source("sendqueue", lambda: ws.sends.stats)
+    ws.ignored = {}
+    ws.last_metrics = None
+    ws.room_index = None
+    ws.profile = myutils.PhaseProfile(False)
+    return session
+
+
+# Finish looking up the default room (called on the loop with the lookup future)
+def set_default_room(ws, roomid, lookup):
+    try:
+        data, room_history, messages = lookup.result()
+        set_current_room(ws, roomid, data, room_history)
+        printr(Fore.GREEN + "Found default room %s" % ws.current_room_data["name"])
+        print_messages(messages, ws.context.users)
+    except Exception as ex:
+        printr(Fore.YELLOW + "Error searching for default room %d: %s" % (roomid, ex))
+
+# Finish building the room index (called on the loop with the build future)
+def save_room_index(ws, build):
+    try:
+        build.result()
+        ws.room_index.save(ws.main_config["room_index_file"])
+    except Exception as ex:
+        printr(Fore.YELLOW + "Couldn't build room index, searching the server instead: %s" % ex)
+
+# Finish looking up the watched rooms from the config (called on the loop with the lookup future)
+def watch_rooms(ws, lookup):
+    try:
+        found = lookup.result()["content"]
+        ws.context.cache_content(found, records.ContentRecord.fields())
+        for content in found:
+            ws.rooms.watch(content["id"], content)
+        if ws.context.store is not None:
+            ws.context.store.add_rooms(found)
+    except Exception as ex:
+        printr(Fore.YELLOW + "Error looking up watched rooms: %s" % ex)
+
+# Make the given room the one you're in. It's watched from now on, even after you switch away.
+# Messages are loaded through room_history; without one, a new one starts from the newest and
+# nothing is shown yet (load_history shows the newest chunk)
+def set_current_room(ws, roomid, data, room_history = None):
+    room = ws.rooms.switch(roomid, data)
+    ws.current_room = roomid
+    ws.current_room_data = room.data
+    ws.history = room_history or history.RoomHistory(ws.context, roomid, ws.main_config["history_chunk_size"])
+    if data and ws.context.store is not None:
+        ws.context.store.add_rooms([data])
+
 def ws_onclose(ws):
     print("Websocket closed! Program exit (FYI: you were in room %d)" % ws.current_room)
-    exit()
+    if ws.room_index is not None and ws.room_index.ready and ws.room_index.dirty:
+        ws.room_index.save(ws.main_config["room_index_file"])
+    ws.engine.stop()
 
-def ws_onopen(ws):
+def ws_onopen(ws, reconnected):
 
-    def main_loop():
+    # Seed the userlist state. After a reconnect, we may have missed updates while we were gone
+    ws.userlist.mark_stale()
+    ws.send(ws.context.gen_ws_request("userlist", id = "userlist_seed"))
 
-        printr(Fore.GREEN + Style.BRIGHT + "\n-- Connected to live updates! --")
+    # Acks for anything sent before the drop aren't coming, so it goes out again (in order)
+    if reconnected:
+        ws.sends.requeue_in_flight()
+    pump_sends(ws)
 
-        if not ws.current_room:
-            printr(Fore.YELLOW + "* You are not connected to any room! Press 'S' to search for a room! *")
+    # The input loop keeps running across reconnects, we just let you know we're back
+    if reconnected:
+        printr(Fore.GREEN + "-- Reconnected, resumed from event %d (%dms) --" % (ws.last_id, ws.stats["last_reconnect_ms"]))
+        return
 
+    printr(Fore.GREEN + Style.BRIGHT + "\n-- Connected to live updates! --")
+
+    ws.profile.mark("websocket open")
+
+    if not ws.current_room:
+        printr(Fore.YELLOW + "* You are not connected to any room! Press 'S' to search for a room! *")
+
+    print_statusline(ws)
+
+    # Keys are read (and prompts answered) on their own thread; what they change happens on the loop
+    import readchar
+    ws.engine.start_input(readchar.readkey, lambda key: handle_key(ws, key))
+
+# Keys that prompt for more input, and the functions that do the prompting
+PROMPTS = { "s" : lambda ws: search(ws), "w" : lambda ws: watched(ws), "i" : lambda ws: compose(ws) }
+
+# Handle a single keypress. Runs on the input thread, so prompts can wait on you as long as they
+# like without holding up the loop (live updates are held back meanwhile, then shown all at once).
+# Everything else is handled on the loop. Returns False when it's time to stop reading keys
+def handle_key(ws, key):
+    if key not in PROMPTS:
+        return ws.engine.call(handle_command, ws, key)
+    display.pause()             # Hold live output while you type
+    try:
+        PROMPTS[key](ws)
+    finally:
+        display.resume()        # Allow arbitrary output again (and flush whatever was held)
+    ws.engine.call(print_statusline, ws)
+    return True
+
+# Handle a key that doesn't prompt. Runs on the engine loop, so it's free to touch any of the
+# client state, but mustn't wait on anything
+def handle_command(ws, key):
+
+    # Oops, websocket is not connected (probably reconnecting) but you asked for a command that requires websocket!
+    if not ws.connected and key in ["g", "u"]:
+        print("No websocket connection (reconnecting...)")
+        return True
+
+    printstatus = False         # Assume we are not printing the status every time (it's kinda annoying)
+
+    if key == "h":
+        printr_lines([" -- Help menu / Controls --"] + ["  " + Style.BRIGHT + key + Style.NORMAL + " - " + value for key, value in commands.items()])
+    elif key == "o":
+        load_history(ws)
+    elif key == "n":
+        room = ws.rooms.next_unread()
+        if room:
+            print(Fore.GREEN + "Switched to %s (%d unread)" % (room.name, room.unread) + Style.RESET_ALL)
+            set_current_room(ws, room.id, room.data)
+            load_history(ws)
+        else:
+            print("No unread messages in any watched room")
+        printstatus = True
+    elif key == "g":
+        show_userlist(ws, 0)
+    elif key == "u":
+        if not ws.current_room:
+            print("You're not in a room! Can't check userlist!")
+        else:
+            show_userlist(ws, ws.current_room)
+    elif key == "t":
+        printr_lines(statistics_lines(ws))
+    elif key == "q":
+        print("Quitting (may take a bit for the websocket to close)")
+        ws.close()
+        return False
+    elif key == " ":
         printstatus = True
 
-        # The infinite input loop! Or something!
-        while True:
-            if printstatus:
-                print_statusline(ws)
-
-            printstatus = False         # Assume we are not printing the status every time (it's kinda annoying)
-            ws.pause_output = False     # Allow arbitrary output again
-            key = readchar.readkey()
-
-            # # Oops, websocket is not connected but you asked for a command that requires websocket!
-            # if not ws_context.connected and key in ["s", "g", "u", "i"]:
-            #     print("No websocket connection")
-            #     continue
-
-            ws.pause_output = True      # Disable output for the duration of input handling
-
-            if key == "h":
-                print(" -- Help menu / Controls --")
-                for key, value in commands.items():
-                    print("  " + Style.BRIGHT + key + Style.NORMAL + " - " + value)
-            elif key == "s":
-                search(ws)
-                printstatus = True
-            elif key == "g":
-                ws.send(ws.context.gen_ws_request("userlist", id = "userlist_global"))
-            elif key == "u":
-                if not ws.current_room:
-                    print("You're not in a room! Can't check userlist!")
-                else:
-                    # Just send it out, we have to wait for the websocket handler to get the response
-                    ws.send(ws.context.gen_ws_request("userlist", id = "userlist_room_%d" % ws.current_room))
-            elif key == "i":
-                if not ws.current_room:
-                    print("You're not in a room! Can't send messages!")
-                else:
-                    print("not yet")
-                printstatus = True
-            elif key == "t":
-                print(" -- Ignored WS Data (normal) --")
-                for key,value in ws.ignored.items():
-                    printr(Style.BRIGHT + ("%16s" % key) + (" : %d" % value))
-            elif key == "q":
-                print("Quitting (may take a bit for the websocket to close)")
-                ws.close()
-                break
-            elif key == " ":
-                printstatus = True
-
-    # create a thread to run the blocking task
-    thread = threading.Thread(target=main_loop)
-    thread.start()
-
-# Message handler for our websocket; will handle live messages for the room you're listening to and 
-# userlist updates request results, but not much else (for now)
-def ws_onmessage(ws, message):
-    logging.debug("WSRCV: " + message)
-    result = json.loads(message)
-
-    # Someone asked for the userlist, check the id to figure out what to print and which list to see
-    if result["type"] == "userlist":
-        all_statuses = result["data"]["statuses"]
-        if result["id"] == "userlist_global":
-            usermessage = " -- Global userlist --"
-            statuses = all_statuses["0"] if "0" in all_statuses else {}
-        else: # This is a bad assumption, it should parse the room id out of the id instead (maybe?)
-            usermessage = " -- Userlist for %s -- " % ws.current_room_data["name"]
-            statuses = all_statuses[str(ws.current_room)] if str(ws.current_room) in all_statuses else {}
-        print(usermessage)
-        print_userlist(statuses, result["data"]["objects"]["user"])
+    if printstatus:
+        print_statusline(ws)
+
+    return True
+
+# Show the next chunk of messages in your room: the newest one if none have been shown yet (you
+# just switched to it), otherwise the one before the oldest shown. If the message store has all
+# of it, that's right away; otherwise the request goes out in the background and they're printed
+# when it comes back (unless you've switched rooms by then)
+def load_history(ws):
+    room_history = ws.history
+    if not room_history:
+        print("You're not in a room! Press 'S' to search for one")
+    elif room_history.exhausted:
+        print(Style.DIM + " -- No older messages -- " + Style.RESET_ALL)
+    elif not room_history.loading:
+        older = room_history.before != 0
+        messages = room_history.start_chunk()
+        if messages is not None:
+            print_chunk(ws, messages, older)
+            return
+        room_history.loading = True
+        lookup = ws.async_context.query(room_history.chunk_queries(), room_history.chunk_values())
+        lookup.add_done_callback(lambda f: show_chunk(ws, room_history, older, f))
+
+# Finish loading a chunk of messages (called on the loop with the query future)
+def show_chunk(ws, room_history, older, lookup):
+    room_history.loading = False
+    try:
+        messages = room_history.take_chunk(lookup.result()["message"])
+        if room_history is ws.history:
+            print_chunk(ws, messages, older)
+    except Exception as ex:
+        printr(Fore.YELLOW + "Couldn't load messages: %s" % ex)
+
+def print_chunk(ws, messages, older):
+    if older:
+        printr_lines([Style.DIM + (" -- Older messages -- " if messages else " -- No older messages -- ")] + [message_line(message, ws.context.users) for message in messages])
+    else:
+        print_messages(messages, ws.context.users)
+    print_statusline(ws)
+
+# Message handlers for our websocket; they're called by the dispatcher (on the engine loop) with
+# the decoded message. We handle live messages for the room you're listening to and userlist
+# request results, but not much else (for now)
+
+# Anything carrying users goes into the shared directory first so rendering can find them (and
+# into the store along with any messages, if we're keeping one)
+def absorb_users(ws, result):
+    if isinstance(result.get("data"), dict) and "objects" in result["data"]:
+        ws.context.users.add_from_objects(result["data"]["objects"])
+        if ws.context.store is not None:
+            ws.context.store.add_from_objects(result["data"]["objects"])
+
+# A full userlist came back. It always reseeds the local state; if someone was waiting on it (the
+# id says which list they wanted), print that list too
+def ws_onuserlist(ws, result):
+    absorb_users(ws, result)
+    ws.userlist.seed(result["data"]["statuses"])
+    match = re.match(r'userlist_room_(\d+)', result.get("id") or "")
+    if match:
+        room = int(match.group(1))
+    elif result.get("id") == "userlist_global":
+        room = 0
+    else:
         return
+    printr_lines(userlist_block(ws, room, ws.userlist.statuses.get(room, {})), pausable = True)
 
-    # Track ignored data
+# The server answered one of our writes (by id): either it's posted or it was refused
+def ws_onwrite(ws, result):
+    if result.get("error"):
+        if ws.sends.fail(result.get("id")):
+            printr(Fore.RED + "Message couldn't be sent: %s" % result["error"], pausable = True)
+    else:
+        ws.sends.ack(result.get("id"))
+    pump_sends(ws) # That's one less in flight
+
+# Someone's status changed somewhere; keep the local userlist current
+def ws_onuserlistupdate(ws, result):
+    absorb_users(ws, result)
+    ws.userlist.apply(result["data"].get("statuses", {}))
+
+# Print the userlist for a room (0 = global) from the local state if it's current, otherwise ask
+# the server for a fresh one (printed by ws_onuserlist when it arrives)
+def show_userlist(ws, room):
+    statuses = ws.userlist.get(room)
+    if statuses is None:
+        ws.send(ws.context.gen_ws_request("userlist", id = "userlist_room_%d" % room if room else "userlist_global"))
+    else:
+        printr_lines(userlist_block(ws, room, statuses))
+
+def userlist_block(ws, room, statuses):
+    if room:
+        watched = ws.rooms.get(room)
+        usermessage = " -- Userlist for %s -- " % (watched.name if watched else "#%d" % room)
+    else:
+        usermessage = " -- Global userlist --"
+    return [usermessage] + userlist_lines(statuses, ws.context.users)
+
+def ws_onlive(ws, result):
+    # Remember where we are in the event stream (so a reconnect can resume), and skip anything
+    # the server is sending us a second time
+    data = ws.track_live(result["data"])
+    if data is None:
+        return
+    result = dict(result, data = data)
+
+    absorb_users(ws, result)
+    if ws.context.store is not None:
+        ws.context.store.set_last_id(ws.last_id) # Only once what it covers is stored
+
+    # Anything a live update touches can't be trusted in the cache anymore
+    if ws.context.cache is not None:
+        for id in apicache.live_content_ids(result["data"]):
+            ws.context.cache.invalidate("content", id)
+
+    if ws.room_index is not None:
+        ws.room_index.update_from_live(result["data"])
+
+    # New messages go to their room: shown if it's the one you're in, counted as unread if it's
+    # another one you're watching, ignored otherwise
+    if len(ws.rooms):
+        for message in new_messages(result["data"]):
+            if ws.rooms.route(message):
+                print_message(message, ws.context.users)
+    else:
+        ws_onignored(ws, result)
+
+# Track ignored data
+def ws_onignored(ws, result):
     if result["type"] not in ws.ignored:
         ws.ignored[result["type"]] = 0
     ws.ignored[result["type"]] += 1
 
-# Print the plain userlist given a list of statuses (in a room or otherwise) and a list of user data
-# (usually provided by whatever gave you the statuses)
-def print_userlist(statuses, users):
+# Pull all objects of the given type out of a live update for the given event type
+def live_objects(data, event_type, object_type):
+    objects = data.get("objects", {}).get(event_type, {})
+    return objects.get(object_type, [])
+
+# Only the messages a live update says were just created (edits and deletes come through too)
+def new_messages(data):
+    created = set(e["refId"] for e in data.get("events", []) if e.get("type") == "message_event" and e.get("action") == 1)
+    return [m for m in live_objects(data, "message_event", "message") if m["id"] in created and not m.get("deleted")]
+
+# Lines for the plain userlist given a list of statuses (in a room or otherwise) and the user directory
+# (which should already have the users that came with the statuses). Printed as one block
+def userlist_lines(statuses, users):
+    lines = []
     for key,value in statuses.items():
         key = int(key)
-        user = contentapi.get_user_or_default(users,key)
+        user = users.get_or_default(key)
         # Weird parenthesis are because I was aligning printed data before
-        printr(Style.BRIGHT + "  " + ("%s" % (user["username"] + Style.DIM + " #%d" % key)) + Style.RESET_ALL + " - " + value)
+        lines.append(Style.BRIGHT + "  " + ("%s" % (user["username"] + Style.DIM + " #%d" % key)) + Style.RESET_ALL + " - " + value)
+    return lines
+
+
+# Everything on the 't' screen, as one block of lines
+def statistics_lines(ws):
+    lines = [" -- Ignored WS Data (normal) --"]
+    for key,value in ws.ignored.items():
+        lines.append(Style.BRIGHT + ("%16s" % key) + (" : %d" % value))
+    lines.extend(transport_stats_lines(ws.context.transport))
+    lines.append(" -- Websocket (last event %d) --" % ws.last_id)
+    ws.last_metrics = ws.context.metrics.snapshot(ws.last_metrics) # Rates since you last looked
+    lines.extend(ws.context.metrics.lines(ws.last_metrics))
+    return lines
+
+# Connection reuse for the HTTP transport (if the transport can tell us)
+def transport_stats_lines(http):
+    if not hasattr(http, "stats"):
+        return []
+    stats = http.stats()
+    lines = [" -- HTTP connections (retries: %d) --" % stats["retries"]]
+    for pool in stats["pools"]:
+        lines.append(Style.BRIGHT + "  " + pool["host"] + Style.RESET_ALL + " - %d requests over %d connections (%d reused)" % (pool["requests"], pool["connections"], pool["reused"]))
+    for connection in stats["connections"]:
+        lines.append(Style.DIM + "    connection to %s : %d requests" % (connection["host"], connection["requests"]))
+    return lines
+
+# Print a single chat message, resolving the author through the user directory
+def print_message(message, users):
+    printr(message_line(message, users), pausable = True)
+
+# Print a block of older messages (history) all at once. Not pausable: you asked for these
+def print_messages(messages, users):
+    printr_lines([message_line(message, users) for message in messages])
+
+def message_line(message, users):
+    user = users.get_or_default(message["createUserId"])
+    return Style.BRIGHT + Fore.CYAN + user["username"] + Style.RESET_ALL + ": " + message.get("text", "")
+
 
 
 # Loads the config from file into the global config var. If the file
@@ -206,6 +601,7 @@ def print_userlist(statuses, users):
 def load_or_create_global_config():
     global config
     # Check if the config file exists
+    import toml
     if os.path.isfile(CONFIGFILE):
         # Read and deserialize the config file
         with open(CONFIGFILE, 'r', encoding='utf-8') as f:
@@ -219,47 +615,157 @@ def load_or_create_global_config():
 
     myutils.set_logging_level(config["default_loglevel"])
 
-# Enter a search loop which will repeat until you quit. Output should be PAUSED here 
+# Enter a search loop which will repeat until you quit. Runs on the input thread: searches go
+# out on the worker pool and the room you pick is set on the loop. Output should be PAUSED here
 # (but someone else does it for us, we don't even know what 'pausing' is)
 def search(ws):
+    pages = None # The pages left from the last search, fetched only when you ask for them
     while True:
-        searchterm = input("Search text (#ROOMNUM = set room, # to quit): ")
+        searchterm = input("Search text (#ROOMNUM = set room, # to quit%s): " % (", enter = more" if pages else ""))
         if searchterm == "#":
             return
         match = re.match(r'#(\d+)', searchterm)
         if match:
             roomid = int(match.group(1))
             try:
-                ws.current_room_data = ws.context.get_by_id("content", roomid)
-                ws.current_room = roomid
-                print(Fore.GREEN + "Set room to %s" % ws.current_room_data["name"] + Style.RESET_ALL)
+                data, room_history, messages = ws.engine.wait_blocking(history.join, ws.context, roomid, ws.main_config["history_chunk_size"])
+                ws.engine.call(set_current_room, ws, roomid, data, room_history)
+                print(Fore.GREEN + "Set room to %s" % data["name"] + Style.RESET_ALL)
+                print_messages(messages, ws.context.users)
                 return
             except Exception as ex:
                 print(Fore.RED + "Couldn't find room with id %d" % roomid + Style.RESET_ALL)
         elif searchterm:
-            # Go search for rooms and display them
-            result = ws.context.basic_search(searchterm)["objects"]["content"]
-            if len(result):
-                for content in result:
-                    printr(Style.BRIGHT + "%7s" % ("#%d" % content["id"]) + Style.RESET_ALL + " - %s" % content["name"])
+            # Go search for rooms and display the first page right away
+            page_size = ws.main_config["search_page_size"]
+            if ws.room_index is not None and ws.room_index.ready:
+                pages = iter_pages(ws.room_index.search(searchterm), page_size)
             else:
-                printr(Style.DIM + " -- No results -- ")
-
-# Either pull the token from a file, or get the login from the command
-# line if that doesn't work. WILL test your token against the real API
-# even if it's pulled from file!
-def authenticate(config, context: contentapi.ApiContext):
-    message = "No token file found"
-    if os.path.isfile(config["tokenfile"]):
-        with open(config["tokenfile"], 'r') as f:
-            token = f.read()
-        logging.debug("Token from file: " + token)
-        context.token = token
-        if context.is_token_valid():
-            logging.info("Logged in using token file " + config["tokenfile"])
+                pages = (records.ContentRecord.from_list(page) for page in ws.context.basic_search_pages(searchterm, page_size, records.ContentRecord.fields()))
+            pages = print_search_page(ws, pages, page_size, True)
+        elif pages:
+            pages = print_search_page(ws, pages, page_size, False)
+
+# Split an in-memory result list into pages the same way the server search does
+def iter_pages(rows, page_size):
+    for i in range(0, len(rows), page_size):
+        yield rows[i:i + page_size]
+
+# Print the next page of search results (fetching it on the worker pool if it comes from the
+# server). Returns the pages left, or None if that was the last one
+def print_search_page(ws, pages, page_size, first):
+    page = ws.engine.wait_blocking(next, pages, None)
+    if not page:
+        printr(Style.DIM + (" -- No results -- " if first else " -- No more results -- "))
+        return None
+    printr_lines([Style.BRIGHT + "%7s" % ("#%d" % content["id"]) + Style.RESET_ALL + " - %s" % content["name"] for content in page])
+    return pages if len(page) == page_size else None
+
+# List the watched rooms and let you switch between them or stop watching them. Like search,
+# this runs on the input thread (the list and the changes are done on the loop) and output
+# should be PAUSED here
+def watched(ws):
+    while True:
+        lines = ws.engine.call(watched_lines, ws)
+        if not lines:
+            print("You aren't watching any rooms! Press 'S' to search for one")
             return
-        else:
-            message = "Token file expired"
+        printr_lines(lines)
+        command = input("#ROOMNUM = switch, -ROOMNUM = stop watching, # to quit: ")
+        match = re.match(r'(-|#)(\d+)', command)
+        if not match or ws.engine.call(watched_command, ws, match.group(1), int(match.group(2))):
+            return
+
+def watched_lines(ws):
+    return [(Fore.GREEN if room is ws.rooms.current else "") + Style.BRIGHT + "%7s" % ("#%d" % room.id) + Style.RESET_ALL +
+        " - %s" % room.name + (Style.BRIGHT + " (%d unread)" % room.unread if room.unread else "") for room in ws.rooms.rooms.values()]
+
+# Switch to (#) or stop watching (-) a room from the watched list. Runs on the loop. Returns
+# whether that's the end of the watched prompt
+def watched_command(ws, command, roomid):
+    if roomid not in ws.rooms:
+        print(Fore.RED + "You aren't watching room %d" % roomid + Style.RESET_ALL)
+    elif command == "#":
+        print(Fore.GREEN + "Set room to %s" % ws.rooms.get(roomid).name + Style.RESET_ALL)
+        set_current_room(ws, roomid, None)
+        load_history(ws)
+        return True
+    else:
+        ws.rooms.unwatch(roomid)
+        if roomid == ws.current_room:
+            ws.current_room = 0
+            ws.current_room_data = False
+    return False
+
+# Read a message (as many lines as you like, so pasting works) on the input thread and queue it
+# to be sent to the room you were in when you started. It goes out in the background; you don't
+# wait on the server
+def compose(ws):
+    room, data = ws.engine.call(lambda: (ws.current_room, ws.current_room_data))
+    if not room:
+        print("You're not in a room! Can't send messages!")
+        return
+    print("Message for %s (end with a line containing only '.', empty to cancel):" % data["name"])
+    lines = []
+    while True:
+        line = input()
+        if line == "." or (not lines and not line):
+            break
+        lines.append(line)
+    ws.engine.call(queue_message, ws, room, "\n".join(lines))
+
+# Split a message as needed and queue the parts to be sent. Runs on the loop
+def queue_message(ws, room, message):
+    for i, text in enumerate(sendqueue.split_text(message, ws.main_config["max_message_length"])):
+        if ws.sends.submit(room, text) is None:
+            print(Fore.RED + "Too many messages waiting to be sent, %s not sent" % ("that one was" if not i else "the rest were") + Style.RESET_ALL)
+            break
+    pump_sends(ws)
+
+# Send whatever the send queue allows right now (and again whatever went unacknowledged too long),
+# and come back when the rate limit allows more or the next ack is due. Runs on the loop, from
+# many places, but only one timer is ever pending: a new one only replaces it if it's sooner.
+# While disconnected nothing is sent; reconnecting pumps again
+def pump_sends(ws):
+    if not ws.connected:
+        return
+    for message in ws.sends.expire():
+        printr(Fore.RED + "Message couldn't be sent (no answer from the server): %s" % message.text, pausable = True)
+    try:
+        wait = ws.sends.pump(lambda m: ws.send(ws.context.gen_ws_request("write", m.data(), id = m.id)))
+    except Exception as ex:
+        logging.warning("Couldn't send message, trying again on reconnect: %s", ex)
+        return
+    if wait is None:
+        return
+    at = ws.engine.loop.time() + wait
+    if ws.send_timer is None or at < ws.send_timer_at:
+        if ws.send_timer is not None:
+            ws.send_timer.cancel()
+        ws.send_timer = ws.engine.loop.call_later(wait, pump_timer, ws)
+        ws.send_timer_at = at
+
+def pump_timer(ws):
+    ws.send_timer = None
+    pump_sends(ws)
+
+# Pull the token from the token file into the context, if there is one. Does NOT check
+# the token against the API; returns whether a token was found
+def load_token(config, context: contentapi.ApiContext):
+    if not os.path.isfile(config["tokenfile"]):
+        return False
+    with open(config["tokenfile"], 'r') as f:
+        token = f.read()
+    logging.debug("Token from file: " + token)
+    context.token = token
+    return True
+
+# If the token from file was already checked and good (user_info is the result of that check),
+# we're done. Otherwise get the login from the command line. Either way, returns your user info
+def authenticate(config, context: contentapi.ApiContext, user_info, message):
+    if user_info:
+        logging.info("Logged in using token file " + config["tokenfile"])
+        return user_info
     
     message += ", Please enter login for " + config["api"]
 
@@ -273,7 +779,7 @@ def authenticate(config, context: contentapi.ApiContext):
                 f.write(token)
             logging.info("Token accepted, written to " + config["tokenfile"])
             context.token = token
-            return
+            return context.user_me()
         except Exception as ex:
             print("ERROR: %s" % ex)
             message = "Please try logging in again:"
@@ -285,11 +791,17 @@ def print_statusline(ws):
         room = "'" + (name[:(MAXTITLE - 3)] + '...' if len(name) > MAXTITLE else name) + "'"
     else:
         room = Fore.RED + Style.DIM + "NONE" + Style.NORMAL + Fore.BLACK
-    print(Back.GREEN + Fore.BLACK + "\n " + ws.user_info["username"] + " - " + room + "  CTRL: h s g u i t q  " + Style.RESET_ALL)
+    counts = " [%d unread]" % ws.rooms.total_unread if ws.rooms.total_unread else ""
+    counts += " [sending %d]" % len(ws.sends) if len(ws.sends) else ""
+    print(Back.GREEN + Fore.BLACK + "\n " + ws.user_info["username"] + " - " + room + counts + "  CTRL: h s w n o g u i t q  " + Style.RESET_ALL)
+
+# Print and then reset the style. Pausable output (live updates) is held while input is being handled
+def printr(msg, pausable = False):
+    display.line(msg + Style.RESET_ALL, pausable)
 
-# Print and then reset the style
-def printr(msg):
-    print(msg + Style.RESET_ALL)
+# Same as printr but for a whole block of lines, which all go out in one write
+def printr_lines(lines, pausable = False):
+    display.lines([line + Style.RESET_ALL for line in lines], pausable)
 
 # Because python reasons
 if __name__ == "__main__":
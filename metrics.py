@@ -0,0 +1,172 @@
+import json
+import time
+import bisect
+import logging
+import threading
+
+# Runtime metrics for the whole client, in one place. Components are handed the same registry and
+# record into it by name: counters (things that happened, with a per-second rate), histograms
+# (durations in ms, or sizes) and gauges (a value read when asked, like a queue depth). Components
+# that already keep their own stats dict can register it as a source instead. Everything is cheap
+# enough to leave on all the time.
+
+# Upper bounds of the histogram buckets; anything bigger lands in the last (unbounded) one
+BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    # The bucket bound the given fraction of observations fall under (so an upper estimate)
+    def percentile(self, fraction):
+        if not self.count:
+            return 0
+        needed = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= needed:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count" : self.count,
+            "avg" : self.total / self.count if self.count else 0,
+            "p50" : self.percentile(0.5),
+            "p95" : self.percentile(0.95),
+            "p99" : self.percentile(0.99),
+            "max" : self.max
+        }
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.sources = {}
+
+    def inc(self, name, amount = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    # Time a block of code into the named histogram, in milliseconds
+    def timer(self, name):
+        return Timer(self, name)
+
+    # fn() is called for the current value whenever a snapshot is taken
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    # fn() returns a dict of name -> number, included under the given prefix
+    def source(self, prefix, fn):
+        self.sources[prefix] = fn
+
+    # Everything as one plain dict. Counter rates are per second: "overall_rates" since we started,
+    # "rates" since 'previous' (a snapshot this same caller took earlier, or since we started if
+    # None). Each consumer keeps its own previous snapshot, so the 't' screen and the dumper don't
+    # skew each other's rates
+    def snapshot(self, previous = None):
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            counters = dict(self.counters)
+            histograms = dict((name, h.summary()) for name, h in self.histograms.items())
+        last_uptime, last_counters = (previous["uptime"], previous["counters"]) if previous else (0, {})
+        result = {
+            "time" : time.time(),
+            "uptime" : uptime,
+            "counters" : counters,
+            "rates" : dict((name, (value - last_counters.get(name, 0)) / max(uptime - last_uptime, 0.001)) for name, value in counters.items()),
+            "overall_rates" : dict((name, value / max(uptime, 0.001)) for name, value in counters.items()),
+            "histograms" : histograms,
+            "gauges" : {}
+        }
+        for name, fn in list(self.gauges.items()):
+            result["gauges"][name] = fn()
+        for prefix, fn in list(self.sources.items()):
+            for name, value in fn().items():
+                if isinstance(value, (int, float)):
+                    result["gauges"][prefix + "." + name] = value
+        return result
+
+    # A snapshot (a fresh one if not given) as readable lines (for the 't' screen)
+    def lines(self, snapshot = None):
+        snapshot = snapshot or self.snapshot()
+        lines = [" -- Metrics (up %ds) --" % snapshot["uptime"]]
+        for name in sorted(snapshot["counters"]):
+            lines.append("%36s : %d (%.1f/s, %.1f/s overall)" % (name, snapshot["counters"][name], snapshot["rates"][name], snapshot["overall_rates"][name]))
+        for name in sorted(snapshot["gauges"]):
+            lines.append("%36s : %s" % (name, snapshot["gauges"][name]))
+        for name in sorted(snapshot["histograms"]):
+            h = snapshot["histograms"][name]
+            lines.append("%36s : n=%d avg=%.2f p50<=%s p95<=%s max=%.2f" % (name, h["count"], h["avg"], h["p50"], h["p95"], h["max"]))
+        return lines
+
+
+class Timer:
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, (time.perf_counter() - self.start) * 1000)
+
+
+# Appends a snapshot of the registry to a file as one json line every 'interval' seconds, so a
+# long-running client can be watched (or graphed later) without attaching anything to it
+class JsonLinesDumper:
+
+    def __init__(self, registry, path, interval = 60):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.last = None # Our previous snapshot, for the rates in the next one
+        self.stopped = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target = self.run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        self.last = self.registry.snapshot(self.last)
+        try:
+            with open(self.path, "a", encoding = "utf-8") as f:
+                f.write(json.dumps(self.last, separators = (",", ":")) + "\n")
+        except Exception as ex:
+            logging.warning("Couldn't write metrics to %s: %s", self.path, ex)
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,461 @@
+import re
+import sys
+import gzip
+import json
+import time
+import base64
+import struct
+import socket
+import hashlib
+import argparse
+import threading
+import datetime
+
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# A local stand-in for contentapi, good enough to run the client (and the benchmarks) against
+# without a real instance. It speaks the status, user/me, user/login and request HTTP endpoints
+# plus the live websocket, over generated data of whatever size you like, with optional injected
+# latency on every reply. Only the bits of the query language this client actually uses are
+# understood: "field op @value" clauses joined with "and" and "or" (and grouped with parentheses),
+# where op is one of = != < > <= >= LIKE in, and @value is either a value or a previous request's
+# field (@message.createUserId). "order" can be several fields, comma separated
+
+WS_MAGIC = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+ROOM_WORDS = ["Megathread", "Big Dumb", "Chat", "Programming", "Random", "Games", "Music", "Art", "Help", "Off-topic"]
+TOKEN_REGEX = re.compile(r'\(|\)|@[\w.]+|!=|>=|<=|[=<>]|\w+')
+OPERATORS = ["=", "!=", ">", "<", ">=", "<=", "LIKE", "IN"]
+PASSWORD = "password"
+
+class MockError(Exception):
+    """ Anything the mock can't handle turns into a 400, like a real bad request would """
+
+def now_string(offset = 0):
+    return (datetime.datetime(2023, 1, 1) + datetime.timedelta(seconds = offset)).isoformat() + "Z"
+
+
+# All the data the mock serves, plus the live event log
+class MockData:
+
+    def __init__(self, users = 100, rooms = 100, messages = 1000, userlist_size = None):
+        self.lock = threading.Lock()
+        self.tables = {
+            "user" : [{ "id" : i, "username" : "user%d" % i, "avatar" : "0", "type" : 1, "createDate" : now_string(i) } for i in range(1, users + 1)],
+            "content" : [{
+                "id" : i, "name" : "%s %d" % (ROOM_WORDS[i % len(ROOM_WORDS)], i), "contentType" : 1, "deleted" : False,
+                "text" : "Room %d description" % i, "engagement" : {}, "createUserId" : (i % users) + 1,
+                "createDate" : now_string(i), "lastActionDate" : now_string(i * 7 % (rooms + 1))
+            } for i in range(1, rooms + 1)],
+            "message" : []
+        }
+        self.events = []
+        for i in range(messages):
+            self.tables["message"].append(self.make_message((i % rooms) + 1, (i % users) + 1, "Message number %d" % i))
+        self.by_id = dict((type, dict((row["id"], row) for row in rows)) for type, rows in self.tables.items())
+        self.userlist_size = users if userlist_size is None else userlist_size
+        listed = self.tables["user"][:self.userlist_size]
+        self.statuses = {
+            "0" : dict((str(u["id"]), "online") for u in listed),
+            "1" : dict((str(u["id"]), "here") for u in listed[:10])
+        }
+
+    def make_message(self, room, user, text):
+        id = len(self.tables["message"]) + 1
+        return { "id" : id, "contentId" : room, "createUserId" : user, "text" : text, "createDate" : now_string(id), "deleted" : False, "edited" : False, "module" : None }
+
+    # Add a message as if someone posted it; returns the live data for it
+    def post_message(self, room, user, text):
+        with self.lock:
+            message = self.make_message(room, user, text)
+            self.tables["message"].append(message)
+            self.by_id["message"][message["id"]] = message
+            if room in self.by_id["content"]:
+                self.by_id["content"][room]["lastActionDate"] = message["createDate"]
+            event = { "id" : len(self.events) + 1, "type" : "message_event", "action" : 1, "refId" : message["id"], "userId" : user, "date" : message["createDate"] }
+            self.events.append(event)
+            return self.live_data([event])
+
+    # Build the "data" of a live websocket frame for the given events
+    def live_data(self, events):
+        messages = [self.by_id["message"][e["refId"]] for e in events]
+        userids = set(m["createUserId"] for m in messages)
+        return {
+            "lastId" : events[-1]["id"] if events else len(self.events),
+            "events" : events,
+            "objects" : { "message_event" : {
+                "message" : messages,
+                "user" : [self.by_id["user"][u] for u in userids if u in self.by_id["user"]]
+            }}
+        }
+
+    def events_after(self, lastId):
+        with self.lock:
+            return [e for e in self.events if e["id"] > lastId]
+
+    def userlist(self):
+        with self.lock:
+            statuses = dict((room, dict(users)) for room, users in self.statuses.items())
+        ids = set(int(u) for users in statuses.values() for u in users)
+        return {
+            "statuses" : statuses,
+            "objects" : { "user" : [u for u in self.tables["user"] if u["id"] in ids] }
+        }
+
+    # Change someone's status in a room (None = they left). Returns the data of the
+    # userlistupdate for it: the whole new list for that room, like the real server sends
+    def set_status(self, room, user, status):
+        with self.lock:
+            users = self.statuses.setdefault(str(room), {})
+            if status is None:
+                users.pop(str(user), None)
+            else:
+                users[str(user)] = status
+            return {
+                "statuses" : { str(room) : dict(users) },
+                "objects" : { "user" : [self.by_id["user"][user]] }
+            }
+
+    # Run a full contentapi search request: { "values" : {...}, "requests" : [...] }
+    def search(self, request):
+        values = request.get("values", {})
+        results = {}
+        with self.lock:
+            for sub in request.get("requests", []):
+                type = sub.get("type")
+                if type not in self.tables:
+                    raise MockError("Unknown type %s" % type)
+                rows = [r for r in self.tables[type] if self.matches(r, sub.get("query", ""), values, results)]
+                # Sorting on the last field first, then each one before it (sorts are stable)
+                for order in reversed([o.strip() for o in (sub.get("order", "id") or "").split(",") if o.strip()]):
+                    field = order[:-5] if order.endswith("_desc") else order
+                    rows.sort(key = lambda r: r.get(field) or 0, reverse = order.endswith("_desc"))
+                skip = sub.get("skip", 0) or 0
+                limit = sub.get("limit", 0) or 0
+                rows = rows[skip:skip + limit] if limit else rows[skip:]
+                results[sub.get("name") or type] = [self.project(r, sub.get("fields", "*")) for r in rows]
+        return { "objects" : results, "databaseTimes" : {}, "totalTime" : 0 }
+
+    # Whether a row matches a query: "or" of "and"s of clauses or parenthesized queries
+    def matches(self, row, query, values, results):
+        if not query.strip():
+            return True
+        tokens = TOKEN_REGEX.findall(query)
+        if "".join(tokens) != re.sub(r'\s+', "", query):
+            raise MockError("Mock can't parse query '%s'" % query)
+        position = [0]
+        def peek():
+            return tokens[position[0]].lower() if position[0] < len(tokens) else None
+        def take():
+            if position[0] >= len(tokens):
+                raise MockError("Query '%s' ended early" % query)
+            position[0] += 1
+            return tokens[position[0] - 1]
+        def either():
+            found = both()
+            while peek() == "or":
+                take()
+                found = both() or found # Always parsed, so the tokens are used up
+            return found
+        def both():
+            found = single()
+            while peek() == "and":
+                take()
+                found = single() and found
+            return found
+        def single():
+            if peek() == "(":
+                take()
+                found = either()
+                if take() != ")":
+                    raise MockError("Missing ')' in query '%s'" % query)
+                return found
+            field, op, ref = take(), take().upper(), take()
+            if op not in OPERATORS or not ref.startswith("@"):
+                raise MockError("Mock can't parse query clause '%s %s %s'" % (field, op, ref))
+            return self.clause(row, field, op, ref[1:], values, results)
+        found = either()
+        if position[0] != len(tokens):
+            raise MockError("Mock can't parse query '%s'" % query)
+        return found
+
+    def clause(self, row, field, op, ref, values, results):
+        if "." in ref:
+            name, refield = ref.split(".", 1)
+            if name not in results:
+                raise MockError("No earlier request named %s" % name)
+            value = [r.get(refield) for r in results[name]]
+        elif ref in values:
+            value = values[ref]
+        else:
+            raise MockError("No value named %s" % ref)
+        have = row.get(field)
+        if op == "=" and not have == value: return False
+        if op == "!=" and have == value: return False
+        if op == ">" and not (have is not None and have > value): return False
+        if op == "<" and not (have is not None and have < value): return False
+        if op == ">=" and not (have is not None and have >= value): return False
+        if op == "<=" and not (have is not None and have <= value): return False
+        if op == "IN" and have not in value: return False
+        if op == "LIKE":
+            pattern = "^" + ".*".join(re.escape(p) for p in value.split("%")) + "$"
+            if not re.match(pattern, str(have or ""), re.IGNORECASE | re.DOTALL):
+                return False
+        return True
+
+    def project(self, row, fields):
+        if not fields or fields == "*":
+            return dict(row)
+        if fields.startswith("~"):
+            excluded = fields[1:].split(",")
+            return dict((k, v) for k, v in row.items() if k not in excluded)
+        included = fields.split(",")
+        return dict((k, v) for k, v in row.items() if k in included)
+
+
+# One connected websocket. Sends are locked since replies and broadcasts come from different threads
+class MockSocket:
+
+    def __init__(self, connection, user):
+        self.connection = connection
+        self.user = user
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send_json(self, data):
+        self.send(json.dumps(data).encode("utf-8"))
+
+    def send(self, payload, opcode = 1):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 65536:
+            header += bytes([126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack("!Q", len(payload))
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.connection.sendall(header + payload)
+            except OSError:
+                self.closed = True
+
+    # Read one frame (client frames are always masked). Returns (opcode, payload) or None when closed
+    def receive(self, rfile):
+        header = rfile.read(2)
+        if len(header) < 2:
+            return None
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", rfile.read(8))[0]
+        mask = rfile.read(4) if header[1] & 0x80 else b"\0\0\0\0"
+        data = rfile.read(length)
+        return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Replies go out as headers then body; without this the second write can sit behind a delayed ack
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, data):
+        time.sleep(self.server.latency)
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        # Like a server with response compression turned on: only for clients that ask, and only when it's worth it
+        if self.server.compress and len(body) > 1024 and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, 5)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def current_user(self):
+        auth = self.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            return self.server.tokens.get(auth[7:])
+        return None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/api/status":
+            self.reply(200, { "version" : "mock", "appname" : "contentapi mock", "runtime" : sys.version })
+        elif url.path == "/api/user/me":
+            user = self.current_user()
+            if user is None:
+                self.reply(401, "Not logged in")
+            else:
+                self.reply(200, self.server.data.by_id["user"][user])
+        elif url.path == "/api/live/ws":
+            self.websocket(parse_qs(url.query))
+        else:
+            self.reply(404, "Not found: %s" % url.path)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length).decode("utf-8") or "null")
+        except ValueError:
+            return self.reply(400, "Bad json")
+        if url.path == "/api/user/login":
+            user = [u for u in self.server.data.tables["user"] if u["username"] == body.get("username")]
+            if not user or body.get("password") != PASSWORD:
+                return self.reply(400, "Bad login")
+            self.reply(200, self.server.make_token(user[0]["id"]))
+        elif url.path == "/api/request":
+            try:
+                self.reply(200, self.server.data.search(body))
+            except MockError as ex:
+                self.reply(400, str(ex))
+        else:
+            self.reply(404, "Not found: %s" % url.path)
+
+    # Upgrade to a websocket and serve it until the client goes away
+    def websocket(self, query):
+        user = self.server.tokens.get(query.get("token", [""])[0])
+        if user is None:
+            return self.reply(401, "Bad token")
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_MAGIC).encode("ascii")).digest()).decode("ascii")
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        sock = MockSocket(self.connection, user)
+        lastId = int(query.get("lastId", ["0"])[0])
+        if lastId:
+            missed = self.server.data.events_after(lastId)
+            if missed:
+                sock.send_json({ "type" : "live", "data" : self.server.data.live_data(missed) })
+        self.server.add_socket(sock)
+        try:
+            while not sock.closed:
+                frame = sock.receive(self.rfile)
+                if frame is None or frame[0] == 8:
+                    break
+                if frame[0] == 9:
+                    sock.send(frame[1], 10)
+                elif frame[0] == 1:
+                    self.server.handle_ws_request(sock, json.loads(frame[1].decode("utf-8")))
+        except (OSError, ValueError):
+            pass
+        finally:
+            sock.closed = True
+            self.server.remove_socket(sock)
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    # port 0 picks any free port; the real one is in .url after construction
+    def __init__(self, data = None, host = "127.0.0.1", port = 0, latency = 0, compress = True):
+        HTTPServer.__init__(self, (host, port), MockHandler)
+        self.data = data or MockData()
+        self.latency = latency
+        self.compress = compress
+        self.tokens = {}
+        self.sockets = []
+        self.sockets_lock = threading.Lock()
+        self.url = "http://%s:%d/api" % (host, self.server_address[1])
+
+    def make_token(self, userid):
+        token = "mocktoken-%d-%d" % (userid, len(self.tokens))
+        self.tokens[token] = userid
+        return token
+
+    def add_socket(self, sock):
+        with self.sockets_lock:
+            self.sockets.append(sock)
+
+    def remove_socket(self, sock):
+        with self.sockets_lock:
+            if sock in self.sockets:
+                self.sockets.remove(sock)
+
+    def handle_ws_request(self, sock, request):
+        time.sleep(self.latency)
+        if request.get("type") == "userlist":
+            sock.send_json({ "type" : "userlist", "id" : request.get("id"), "data" : self.data.userlist() })
+        elif request.get("type") == "write":
+            data = request.get("data") or {}
+            if not data.get("text") or data.get("contentId") not in self.data.by_id["content"]:
+                sock.send_json({ "type" : "write", "id" : request.get("id"), "error" : "Messages need text and an existing contentId" })
+            else:
+                live = self.data.post_message(data["contentId"], sock.user, data["text"])
+                sock.send_json({ "type" : "write", "id" : request.get("id"), "data" : live["objects"]["message_event"]["message"][0] })
+                self.broadcast("live", live)
+        elif request.get("type") == "ping":
+            sock.send_json({ "type" : "ping", "id" : request.get("id"), "data" : {} })
+        else:
+            sock.send_json({ "type" : "unexpected", "id" : request.get("id"), "error" : "Mock doesn't handle %s" % request.get("type") })
+
+    # Post a message and push it to every connected socket
+    def post_message(self, room, user, text):
+        self.broadcast("live", self.data.post_message(room, user, text))
+
+    # Change someone's status and push the userlistupdate to every connected socket
+    def set_status(self, room, user, status):
+        self.broadcast("userlistupdate", self.data.set_status(room, user, status))
+
+    def broadcast(self, type, data):
+        frame = json.dumps({ "type" : type, "data" : data }).encode("utf-8")
+        with self.sockets_lock:
+            sockets = list(self.sockets)
+        for sock in sockets:
+            sock.send(frame)
+
+    # Drop every websocket without a close frame, like a network blip would
+    def drop_sockets(self):
+        with self.sockets_lock:
+            sockets, self.sockets = self.sockets, []
+        for sock in sockets:
+            sock.closed = True
+            try:
+                sock.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self):
+        thread = threading.Thread(target = self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.drop_sockets()
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run a mock contentapi for testing the client")
+    parser.add_argument("--port", type = int, default = 5000)
+    parser.add_argument("--users", type = int, default = 100)
+    parser.add_argument("--rooms", type = int, default = 100)
+    parser.add_argument("--messages", type = int, default = 1000)
+    parser.add_argument("--latency", type = float, default = 0, help = "Seconds added to every reply")
+    parser.add_argument("--no-compression", action = "store_true", help = "Never gzip replies, even when asked to")
+    args = parser.parse_args()
+    server = MockServer(MockData(args.users, args.rooms, args.messages), port = args.port, latency = args.latency, compress = not args.no_compression)
+    print("Mock contentapi at %s (login with any userN / %s)" % (server.url, PASSWORD))
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
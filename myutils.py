@@ -1,5 +1,8 @@
+import time
 import logging
 
+from contextlib import contextmanager
+
 # Merge the "new_values" dictionary recursively into the "base_values" dictionary,
 # assigning where new_values is assigned but not fully overwriting nested dictionaries
 # (hence recursive)
@@ -15,4 +18,54 @@ def set_logging_level(level_str):
     level = getattr(logging, level_str.upper(), None)
     if not isinstance(level, int):
         raise ValueError('Invalid logging level: %s' % level_str)
-    logging.basicConfig(level=level)
\ No newline at end of file
+    logging.basicConfig(level=level)
+
+# Timing breakdown for a sequence of phases (used for --profile-startup). Phases are timed with
+# 'with profile.phase(name):'; things that finish on their own time (like a socket opening in the
+# background) can be recorded with mark(name), which is the time since the profile started. Marks
+# named with expect(name) are waited for: when_complete(fn) calls fn once they've all come in. When
+# disabled, nothing is recorded, report() returns nothing and fn is never called
+class PhaseProfile:
+
+    def __init__(self, enabled = True):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.phases = [] # (name, milliseconds, is a mark)
+        self.expected = set() # Marks still to come
+        self.on_complete = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.phases.append((name, (time.perf_counter() - start) * 1000, False))
+
+    def mark(self, name):
+        if self.enabled:
+            self.phases.append((name, (time.perf_counter() - self.start) * 1000, True))
+            self.expected.discard(name)
+            self.check_complete()
+
+    def expect(self, name):
+        self.expected.add(name)
+
+    def when_complete(self, fn):
+        self.on_complete = fn
+        self.check_complete()
+
+    def check_complete(self):
+        if self.enabled and self.on_complete is not None and not self.expected:
+            fn, self.on_complete = self.on_complete, None
+            fn()
+
+    # Lines describing every phase and mark, in the order they were recorded
+    def report(self):
+        if not self.enabled:
+            return []
+        lines = []
+        for name, ms, mark in self.phases:
+            lines.append(("%32s : %8.1fms" % (name, ms)) + ("  (since start)" if mark else ""))
+        return lines
@@ -0,0 +1,73 @@
+import sys
+import time
+import threading
+
+from collections import deque
+from metrics import MetricsRegistry
+
+# All console output goes through here so it can be batched. Every call writes its lines with a
+# single write (and flush), which matters a lot on old consoles where each print goes through
+# colorama's win32 translation. Output marked 'pausable' (live updates, basically) is held while
+# the engine is paused (the input thread pauses it while a prompt waits on you, so live lines
+# don't land in the middle of what you're typing), then flushed in one write on resume. Only the newest max_paused_lines are
+# kept while paused; the rest are counted as dropped.
+class OutputEngine:
+
+    # 'stream' is looked up on every write when not given, since colorama swaps sys.stdout out
+    def __init__(self, max_paused_lines = 1000, stream = None, metrics = None):
+        self.stream = stream
+        self.paused = False
+        self.held = deque(maxlen = max_paused_lines if max_paused_lines > 0 else None)
+        self.lock = threading.Lock()
+        self.stats = {
+            "writes" : 0,
+            "lines" : 0,
+            "held" : 0,
+            "dropped" : 0
+        }
+        self.set_metrics(metrics or MetricsRegistry())
+
+    # Record render time (and our own stats) into the given registry
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+        self.metrics.source("output", lambda: self.stats)
+
+    def pause(self):
+        with self.lock:
+            self.paused = True
+
+    # Unpause and write out everything held in the meantime, all at once
+    def resume(self):
+        with self.lock:
+            self.paused = False
+            held = list(self.held)
+            self.held.clear()
+        if held:
+            self.write(held)
+
+    # Write a block of lines. Pausable lines are held instead if we're paused
+    def lines(self, lines, pausable = False):
+        if pausable and self.paused:
+            with self.lock:
+                if self.paused:
+                    for line in lines:
+                        if len(self.held) == self.held.maxlen:
+                            self.stats["dropped"] += 1
+                        self.held.append(line)
+                        self.stats["held"] += 1
+                    return
+        self.write(lines)
+
+    def line(self, line, pausable = False):
+        self.lines([line], pausable)
+
+    def write(self, lines):
+        if not lines:
+            return
+        stream = self.stream or sys.stdout
+        start = time.perf_counter()
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+        self.metrics.observe("render_ms", (time.perf_counter() - start) * 1000)
+        self.stats["writes"] += 1
+        self.stats["lines"] += len(lines)
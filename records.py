@@ -0,0 +1,117 @@
+# Compact, typed rows for the things this client keeps lots of (rooms, users, messages). Each type
+# declares exactly the fields we use, which does two jobs: queries built from it ask the server for
+# only those fields (so less comes over the wire), and the rows are decoded into __slots__ objects
+# instead of dicts (so each one we hold on to costs a fraction of the memory). Records still act
+# like the dicts they replace for reading: record["name"] and record.get("text", "") both work.
+
+class Record:
+
+    __slots__ = ()
+    TYPE = None  # The contentapi type name
+    FIELDS = ()  # The fields we ask for and keep
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        for field in cls.FIELDS:
+            setattr(record, field, data.get(field))
+        return record
+
+    @classmethod
+    def from_list(cls, rows):
+        return [cls.from_dict(row) for row in rows]
+
+    # The 'fields' value for a search request of this type
+    @classmethod
+    def fields(cls):
+        return ",".join(cls.FIELDS)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    # Like dict.get. Fields the server didn't send are None, which counts as missing here
+    def get(self, key, default = None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return getattr(self, key, None) is not None
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, f) == getattr(other, f) for f in self.FIELDS)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % (f, getattr(self, f)) for f in self.FIELDS))
+
+
+class ContentRecord(Record):
+    TYPE = "content"
+    FIELDS = ("id", "name", "contentType", "deleted", "createUserId", "lastActionDate")
+    __slots__ = FIELDS
+
+class UserRecord(Record):
+    TYPE = "user"
+    FIELDS = ("id", "username", "avatar")
+    __slots__ = FIELDS
+
+class MessageRecord(Record):
+    TYPE = "message"
+    FIELDS = ("id", "contentId", "createUserId", "text", "createDate", "deleted")
+    __slots__ = FIELDS
+
+
+# One request of a search, for a record type: only that type's fields are requested, and the rows
+# come back as records. 'name' is what later requests refer to it by (@name.field); it defaults
+# to the type
+class Query:
+
+    def __init__(self, record, query = "", order = None, limit = 0, skip = 0, name = None):
+        self.record = record
+        self.query = query
+        self.order = order
+        self.limit = limit
+        self.skip = skip
+        self.name = name or record.TYPE
+
+    def request(self):
+        request = {
+            "type" : self.record.TYPE,
+            "fields" : self.record.fields(),
+            "query" : self.query
+        }
+        if self.name != self.record.TYPE:
+            request["name"] = self.name
+        if self.order:
+            request["order"] = self.order
+        if self.limit:
+            request["limit"] = self.limit
+        if self.skip:
+            request["skip"] = self.skip
+        return request
+
+# The full search request for a list of queries
+def search_request(queries, values = None):
+    return {
+        "values" : values or {},
+        "requests" : [query.request() for query in queries]
+    }
+
+# Decode a search result for the given queries: { name : [records] }
+def decode(result, queries):
+    objects = result["objects"]
+    return dict((query.name, query.record.from_list(objects.get(query.name, []))) for query in queries)
+
+# Plain dict for anything that might be a record (for json)
+def as_dict(row):
+    return row.to_dict() if isinstance(row, Record) else row
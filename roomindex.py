@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+# A local index of content ids and names so room search can be answered in memory instead of a
+# "name LIKE" round trip per search. Built with a bulk paged fetch (only content newer than what
+# we already have, if it was loaded from disk), then kept current from live content events.
+# Substring queries scan the lowercased names; prefix queries use a sorted list and bisect.
+# Catching up only sees new ids, so rooms renamed or deleted while we were offline are only fixed
+# by a full rebuild, which load() forces once the saved index is older than max_age.
+class RoomIndex:
+
+    VERSION = 1
+
+    def __init__(self):
+        self.names = {}   # id -> name
+        self.lowered = {} # id -> lowercase name
+        self.sorted = []  # (lowercase name, id), for prefix search
+        self.max_id = 0   # Everything up to here has been fetched (set once a build finishes)
+        self.built_at = 0 # When the last full build started (time.time())
+        self.ready = False
+        self.dirty = False
+        self.building = False
+        self.live_during_build = [] # Live content seen while building, reapplied after it so it wins
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, id, name):
+        with self.lock:
+            self._remove(id)
+            lowered = name.lower()
+            self.names[id] = name
+            self.lowered[id] = lowered
+            bisect.insort(self.sorted, (lowered, id))
+            self.dirty = True
+
+    def remove(self, id):
+        with self.lock:
+            self._remove(id)
+
+    def _remove(self, id):
+        lowered = self.lowered.pop(id, None)
+        if lowered is None:
+            return
+        del self.names[id]
+        i = bisect.bisect_left(self.sorted, (lowered, id))
+        if i < len(self.sorted) and self.sorted[i] == (lowered, id):
+            del self.sorted[i]
+        self.dirty = True
+
+    # All rooms whose name contains the term (case insensitive), as content-like dicts sorted by name
+    def search(self, term, limit = 0):
+        term = term.lower()
+        with self.lock:
+            found = sorted((name, id) for id, name in self.lowered.items() if term in name)
+            if limit:
+                found = found[:limit]
+            return [{ "id" : id, "name" : self.names[id] } for name, id in found]
+
+    # All rooms whose name starts with the prefix (case insensitive), for typeahead
+    def prefix(self, prefix, limit = 0):
+        prefix = prefix.lower()
+        result = []
+        with self.lock:
+            i = bisect.bisect_left(self.sorted, (prefix, 0))
+            while i < len(self.sorted) and self.sorted[i][0].startswith(prefix):
+                result.append({ "id" : self.sorted[i][1], "name" : self.names[self.sorted[i][1]] })
+                if limit and len(result) >= limit:
+                    break
+                i += 1
+        return result
+
+    # Fetch everything newer than what we have, page_size at a time. Only ids and names come down.
+    # This runs off the loop, while live updates keep coming in on it: the pages are walked with
+    # their own cursor, and live content that arrived meanwhile is applied again at the end, since
+    # it's newer than anything a page could have said about the same room
+    def build(self, context, page_size = 1000):
+        with self.lock:
+            self.building = True
+            after = self.max_id
+        started = time.time()
+        while True:
+            count = 0
+            for type, content in context.search_rows({
+                "values" : { "after" : after },
+                "requests" : [{
+                    "type" : "content",
+                    "fields" : "id,name,deleted",
+                    "query" : "id > @after",
+                    "order" : "id",
+                    "limit" : page_size
+                }]
+            }):
+                count += 1
+                if content.get("deleted"):
+                    self.remove(content["id"])
+                else:
+                    self.add(content["id"], content["name"])
+                after = max(after, content["id"])
+            if count < page_size:
+                break
+        with self.lock:
+            self.building = False
+            live, self.live_during_build = self.live_during_build, []
+            if not self.max_id:
+                self.built_at = started
+            self.max_id = after
+        self.apply_content(live)
+        self.ready = True
+        logging.info("Room index has %d rooms (up to id %d)", len(self), self.max_id)
+
+    # Apply any content that came through a live update (new, renamed or deleted rooms)
+    def update_from_live(self, data):
+        found = []
+        for objects in data.get("objects", {}).values():
+            if isinstance(objects, dict):
+                found.extend(c for c in objects.get("content", []) if "id" in c and "name" in c)
+        with self.lock:
+            if self.building:
+                self.live_during_build.extend(found)
+        self.apply_content(found)
+
+    def apply_content(self, found):
+        for content in found:
+            if content.get("deleted"):
+                self.remove(content["id"])
+            else:
+                self.add(content["id"], content["name"])
+
+    def save(self, path):
+        with self.lock:
+            data = { "version" : self.VERSION, "max_id" : self.max_id, "built_at" : self.built_at, "rooms" : [[id, name] for id, name in self.names.items()] }
+            self.dirty = False
+        with open(path + ".tmp", "w", encoding = "utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    # Load a saved index. It's still not 'ready' until build() has caught it up with the server.
+    # One whose last full build is older than max_age seconds isn't loaded (0 = keep it forever),
+    # so the next build starts from scratch
+    def load(self, path, max_age = 0):
+        if not os.path.isfile(path):
+            return False
+        try:
+            with open(path, "r", encoding = "utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != self.VERSION:
+                return False
+            if max_age and time.time() - data.get("built_at", 0) > max_age:
+                logging.info("Room index %s is over %ds old, rebuilding it", path, max_age)
+                return False
+            for id, name in data["rooms"]:
+                self.add(id, name)
+            self.max_id = data.get("max_id", 0)
+            self.built_at = data.get("built_at", 0)
+            self.dirty = False
+            return True
+        except Exception as ex:
+            logging.warning("Couldn't load room index %s: %s", path, ex)
+            return False
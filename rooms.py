@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+# Per-room state for a room we're watching
+class RoomState:
+
+    __slots__ = ["id", "data", "unread", "last_message_id"]
+
+    def __init__(self, id, data):
+        self.id = id
+        self.data = data
+        self.unread = 0
+        self.last_message_id = 0
+
+    @property
+    def name(self):
+        return self.data["name"] if self.data else "#%d" % self.id
+
+
+# The set of rooms being listened to in one session. Live messages are routed to their room with
+# a single dict lookup on contentId, so watching hundreds of rooms costs no more per event than
+# watching one. One room is 'current' (the one shown); the rest just count unread messages until
+# you switch to them. The total unread count is kept as we go rather than summed when asked.
+class RoomSet:
+
+    def __init__(self):
+        self.rooms = OrderedDict() # id -> RoomState, in the order they were watched
+        self.current = None
+        self.total_unread = 0
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def __contains__(self, id):
+        return id in self.rooms
+
+    def get(self, id):
+        return self.rooms.get(id)
+
+    # Start watching a room (or update its data if we already are). Returns its state
+    def watch(self, id, data = None):
+        room = self.rooms.get(id)
+        if room is None:
+            room = self.rooms[id] = RoomState(id, data)
+        elif data:
+            room.data = data
+        return room
+
+    def unwatch(self, id):
+        room = self.rooms.pop(id, None)
+        if room is None:
+            return
+        self.total_unread -= room.unread
+        if self.current is room:
+            self.current = None
+
+    # Make the given room current (watching it if we weren't) and clear its unread count
+    def switch(self, id, data = None):
+        room = self.watch(id, data)
+        self.total_unread -= room.unread
+        room.unread = 0
+        self.current = room
+        return room
+
+    # The next room after the current one (in watch order) with unread messages, or None
+    def next_unread(self):
+        ids = list(self.rooms.keys())
+        start = ids.index(self.current.id) + 1 if self.current else 0
+        for id in ids[start:] + ids[:start]:
+            if self.rooms[id].unread:
+                return self.rooms[id]
+        return None
+
+    # Route a new message to its room. Returns the room if it's the current one (show it),
+    # otherwise None; messages for other watched rooms are counted as unread
+    def route(self, message):
+        room = self.rooms.get(message.get("contentId"))
+        if room is None:
+            return None
+        if message.get("id", 0) > room.last_message_id:
+            room.last_message_id = message["id"]
+        if room is self.current:
+            return room
+        room.unread += 1
+        self.total_unread += 1
+        return None
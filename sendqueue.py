@@ -0,0 +1,172 @@
+import time
+import itertools
+
+from collections import deque, OrderedDict
+
+# One message waiting to go out (or waiting on its ack)
+class OutgoingMessage:
+
+    __slots__ = ["id", "room", "text", "attempts", "sent_at"]
+
+    def __init__(self, id, room, text):
+        self.id = id
+        self.room = room
+        self.text = text
+        self.attempts = 0
+        self.sent_at = None
+
+    # The "data" of the websocket write request for this message
+    def data(self):
+        return { "contentId" : self.room, "text" : self.text }
+
+
+# Outgoing messages for the websocket. Messages are written without waiting for the previous one's
+# ack (each write request carries an id, and its ack comes back with the same id), so sending a
+# burst costs one round trip total instead of one each. Limits: at most max_in_flight unacked at
+# once, and a token bucket of 'rate' messages a second (up to 'burst' at once). Anything over the
+# limits waits in order; past max_pending, new messages are refused so the caller can tell the user.
+# If the connection drops, everything still unacked goes back to the front of the queue (in its
+# original order) to be sent again once we're reconnected. An ack can also just never come (the
+# frame was lost somewhere), so a message unacked after ack_timeout seconds is sent again the same
+# way, and given up on after max_attempts tries. Nothing here blocks or schedules: the owner calls
+# expire() and pump() and reschedules them as told.
+class SendQueue:
+
+    def __init__(self, rate = 5, burst = 20, max_in_flight = 20, max_pending = 1000, ack_timeout = 10, max_attempts = 3, clock = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.ack_timeout = ack_timeout
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.tokens = burst
+        self.refilled_at = clock()
+        self.ids = itertools.count(1)
+        self.pending = deque()
+        self.in_flight = OrderedDict() # id -> message, in the order they were sent
+        self.stats = {
+            "submitted" : 0,
+            "sent" : 0,
+            "acked" : 0,
+            "failed" : 0,
+            "resent" : 0,
+            "timed_out" : 0,
+            "refused" : 0,
+            "max_in_flight" : 0,
+            "last_ack_ms" : 0
+        }
+
+    def __len__(self):
+        return len(self.pending) + len(self.in_flight)
+
+    # Queue a message. Returns its request id, or None if the queue is full
+    def submit(self, room, text):
+        if len(self) >= self.max_pending:
+            self.stats["refused"] += 1
+            return None
+        message = OutgoingMessage("send_%d" % next(self.ids), room, text)
+        self.pending.append(message)
+        self.stats["submitted"] += 1
+        return message.id
+
+    # Send whatever the limits allow with send(message). Returns how many seconds until it should
+    # be called again (with expire() first): when the rate limit lets the next one through, or the
+    # oldest unacked message times out, whichever is sooner. None if there's nothing to wait for
+    # (nothing pending or in flight, or only acks with no timeout). If send raises, the message
+    # stays first in line and the error is passed on
+    def pump(self, send):
+        self.refill()
+        wait = None
+        while self.pending and len(self.in_flight) < self.max_in_flight:
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                break
+            message = self.pending[0]
+            send(message)
+            self.pending.popleft()
+            self.tokens -= 1
+            message.attempts += 1
+            message.sent_at = self.clock()
+            self.in_flight[message.id] = message
+            self.stats["sent"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], len(self.in_flight))
+        if self.in_flight and self.ack_timeout:
+            oldest = next(iter(self.in_flight.values())) # In the order they were sent
+            deadline = max(0, oldest.sent_at + self.ack_timeout - self.clock())
+            wait = deadline if wait is None else min(wait, deadline)
+        return wait
+
+    # Messages whose ack is over ack_timeout late go back to the front of the queue to be sent
+    # again, unless they've had max_attempts already. Returns the ones given up on
+    def expire(self):
+        if not self.ack_timeout:
+            return []
+        now = self.clock()
+        late = [m for m in self.in_flight.values() if now - m.sent_at >= self.ack_timeout]
+        retry = []
+        failed = []
+        for message in late:
+            del self.in_flight[message.id]
+            (retry if message.attempts < self.max_attempts else failed).append(message)
+        self.pending.extendleft(reversed(retry))
+        self.stats["timed_out"] += len(late)
+        self.stats["resent"] += len(retry)
+        self.stats["failed"] += len(failed)
+        return failed
+
+    # The server accepted the write with this id. Returns the message, or None if it isn't ours.
+    # A late ack for a message waiting to be sent again still counts (and it isn't sent again)
+    def ack(self, id):
+        message = self.in_flight.pop(id, None)
+        if message is None:
+            message = next((m for m in self.pending if m.id == id and m.attempts), None)
+            if message is not None:
+                self.pending.remove(message)
+        if message is not None:
+            self.stats["acked"] += 1
+            self.stats["last_ack_ms"] = int((self.clock() - message.sent_at) * 1000)
+        return message
+
+    # The server refused the write with this id; it isn't retried. Returns the message, or None
+    def fail(self, id):
+        message = self.in_flight.pop(id, None)
+        if message is not None:
+            self.stats["failed"] += 1
+        return message
+
+    # The connection dropped, so acks for anything in flight may never come. Put it all back in
+    # front of what's pending to go out again. (If the server did get one before the drop, it'll
+    # be posted twice; better than losing it)
+    def requeue_in_flight(self):
+        messages = list(self.in_flight.values())
+        self.in_flight.clear()
+        self.pending.extendleft(reversed(messages))
+        self.stats["resent"] += len(messages)
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+
+# Split text into messages of at most max_length characters, on line breaks where possible, so a
+# big paste goes out as several messages instead of being refused
+def split_text(text, max_length = 2000):
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > max_length:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:max_length])
+            line = line[max_length:]
+        if current and len(current) + 1 + len(line) > max_length:
+            chunks.append(current)
+            current = line
+        else:
+            current = current + "\n" + line if current else line
+    if current.strip():
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import threading
+
+from records import as_dict
+
+# Keeps messages, users and rooms between runs in a single sqlite file. Messages are indexed by
+# room and id, so "the newest N in room X" and "everything after id Y" are both index scans. The
+# highest live event id we've handled is kept too, so the next run can resume the websocket from
+# there instead of starting over. Only the newest 'retention' messages are kept (0 = keep them all).
+# For each room we also remember the stretch of ids we hold every message of (see coverage), which
+# is what lets room history come from here instead of the server. The connection is shared between
+# the loop and background lookups, so everything goes through a lock.
+class MessageStore:
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, contentId INTEGER, createUserId INTEGER, deleted INTEGER, data TEXT)",
+        "CREATE INDEX IF NOT EXISTS messages_room ON messages (contentId, id)",
+        "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, data TEXT)",
+        "CREATE TABLE IF NOT EXISTS rooms (id INTEGER PRIMARY KEY, data TEXT)",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)",
+        "CREATE TABLE IF NOT EXISTS coverage (room INTEGER PRIMARY KEY, since INTEGER, until INTEGER)"
+    ]
+
+    def __init__(self, path, retention = 50000):
+        self.path = path
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+        self.added = 0 # Messages added since the last prune
+        self.stats = {
+            "messages_written" : 0,
+            "users_written" : 0,
+            "messages_pruned" : 0,
+            "messages_served" : 0
+        }
+
+    def add_messages(self, messages):
+        rows = [(m["id"], m.get("contentId"), m.get("createUserId"), 1 if m.get("deleted") else 0, json.dumps(as_dict(m))) for m in messages]
+        if not rows:
+            return
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?,?,?,?,?)", rows)
+            self.db.commit()
+            self.stats["messages_written"] += len(rows)
+            self.added += len(rows)
+        # Pruning is a full index walk, so it's only done once we're well over the cap
+        if self.retention and self.added > self.retention / 10:
+            self.prune()
+
+    def add_users(self, users):
+        rows = [(u["id"], json.dumps(as_dict(u))) for u in users]
+        if not rows:
+            return
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO users VALUES (?,?)", rows)
+            self.db.commit()
+            self.stats["users_written"] += len(rows)
+
+    def add_rooms(self, rooms):
+        rows = [(r["id"], json.dumps(as_dict(r))) for r in rooms]
+        if not rows:
+            return
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO rooms VALUES (?,?)", rows)
+            self.db.commit()
+
+    # Store messages and users from a search result or live update (live nests them under the event type)
+    def add_from_objects(self, objects):
+        if not isinstance(objects, dict):
+            return
+        for key, value in objects.items():
+            if key == "message" and isinstance(value, list):
+                self.add_messages(value)
+            elif key == "user" and isinstance(value, list):
+                self.add_users(value)
+            elif isinstance(value, dict):
+                self.add_from_objects(value)
+
+    # Up to 'limit' of the newest messages in a room, oldest first. Only messages older than
+    # 'before' and from 'since' on, if given. Deleted messages are left out unless asked for
+    def messages(self, room, before = 0, limit = 50, since = 0, deleted = False):
+        with self.lock:
+            rows = self.db.execute("SELECT data FROM messages WHERE contentId = ? AND id < ? AND id >= ?" + ("" if deleted else " AND deleted = 0") +
+                " ORDER BY id DESC LIMIT ?", (room, before or (1 << 62), since, limit)).fetchall()
+            self.stats["messages_served"] += len(rows)
+        return [json.loads(r[0]) for r in reversed(rows)]
+
+    def user(self, id):
+        return self._load("users", id)
+
+    def room(self, id):
+        return self._load("rooms", id)
+
+    def users(self):
+        with self.lock:
+            return [json.loads(r[0]) for r in self.db.execute("SELECT data FROM users")]
+
+    # The newest message id we have, in a room or overall
+    def max_message_id(self, room = None):
+        with self.lock:
+            if room is None:
+                row = self.db.execute("SELECT MAX(id) FROM messages").fetchone()
+            else:
+                row = self.db.execute("SELECT MAX(id) FROM messages WHERE contentId = ?", (room,)).fetchone()
+        return row[0] or 0
+
+    # The highest live event id handled last time (0 if we've never connected)
+    @property
+    def last_id(self):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'last_id'").fetchone()
+        return row[0] if row else 0
+
+    def set_last_id(self, value):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('last_id', ?)", (value,))
+            self.db.commit()
+
+    # The stretch of a room's history we hold every message of, as (since, until): every message
+    # in the room with an id from since to until is here, and since = 0 means all the way back to
+    # the first. None if we've never loaded a stretch of it from the server. Messages that only
+    # came in live may be past 'until', since we can't tell whether any were missed between runs.
+    # Edits and deletes made while we weren't running aren't seen either
+    def coverage(self, room):
+        with self.lock:
+            row = self.db.execute("SELECT since, until FROM coverage WHERE room = ?", (room,)).fetchone()
+        return tuple(row) if row else None
+
+    def set_coverage(self, room, since, until):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO coverage VALUES (?,?,?)", (room, since, until))
+            self.db.commit()
+
+    # Drop the oldest messages past the retention cap (what's covered shrinks to match)
+    def prune(self):
+        with self.lock:
+            self.added = 0
+            if not self.retention:
+                return
+            row = self.db.execute("SELECT id FROM messages ORDER BY id DESC LIMIT 1 OFFSET ?", (self.retention,)).fetchone()
+            if row:
+                deleted = self.db.execute("DELETE FROM messages WHERE id <= ?", (row[0],)).rowcount
+                self.db.execute("DELETE FROM coverage WHERE until <= ?", (row[0],))
+                self.db.execute("UPDATE coverage SET since = ? WHERE since <= ?", (row[0] + 1, row[0]))
+                self.db.commit()
+                self.stats["messages_pruned"] += deleted
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _load(self, table, id):
+        with self.lock:
+            row = self.db.execute("SELECT data FROM %s WHERE id = ?" % table, (id,)).fetchone()
+        return json.loads(row[0]) if row else None
@@ -6,3 +6,23 @@ set pyexe=python34\python.exe
 REM And now, run all the various tests we have
 %pyexe% test_myutils.py
 %pyexe% test_contentapi.py
+%pyexe% test_transport.py
+%pyexe% test_userdirectory.py
+%pyexe% test_coalesce.py
+%pyexe% test_apicache.py
+%pyexe% test_livesocket.py
+%pyexe% test_asyncclient.py
+%pyexe% test_dispatch.py
+%pyexe% test_output.py
+%pyexe% test_roomindex.py
+%pyexe% test_mockserver.py
+%pyexe% test_metrics.py
+%pyexe% test_rooms.py
+%pyexe% test_store.py
+%pyexe% test_history.py
+%pyexe% test_userlist.py
+%pyexe% test_headless.py
+%pyexe% test_sendqueue.py
+%pyexe% test_loadtest.py
+%pyexe% test_records.py
+%pyexe% test_jsonstream.py
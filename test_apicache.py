@@ -0,0 +1,67 @@
+import unittest
+import time
+import apicache
+import contentapi
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = apicache.ResultCache({ "content" : 60, "search" : 60 }, max_entries = 3)
+
+    def test_hit_miss(self):
+        self.assertIsNone(self.cache.get(("content", 1, "*")))
+        self.cache.put(("content", 1, "*"), { "id" : 1 }, "content", 1)
+        self.assertEqual(self.cache.get(("content", 1, "*"))["id"], 1)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_ttl(self):
+        self.cache.ttls["content"] = 0.01
+        self.cache.put(("content", 1, "*"), { "id" : 1 }, "content", 1)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get(("content", 1, "*")))
+
+    def test_zero_ttl_not_cached(self):
+        self.cache.ttls["user"] = 0
+        self.cache.put(("user", 1, "*"), { "id" : 1 }, "user", 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_bounded(self):
+        for i in range(5):
+            self.cache.put(("content", i, "*"), { "id" : i }, "content", i)
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get(("content", 0, "*")))
+        self.assertIsNotNone(self.cache.get(("content", 4, "*")))
+
+    def test_invalidate(self):
+        self.cache.put(("content", 1, "*"), { "id" : 1 }, "content", 1)
+        self.cache.put(("content", 2, "*"), { "id" : 2 }, "content", 2)
+        self.cache.put(("search", "a", 0), {}, "search")
+        self.cache.invalidate("content", 1)
+        self.assertIsNone(self.cache.get(("content", 1, "*")))
+        self.assertIsNone(self.cache.get(("search", "a", 0)))
+        self.assertIsNotNone(self.cache.get(("content", 2, "*")))
+
+    def test_live_content_ids(self):
+        data = { "objects" : {
+            "activity_event" : { "activity" : [{ "id" : 9, "contentId" : 5 }], "content" : [{ "id" : 6 }] },
+            "message_event" : { "message" : [{ "id" : 1, "contentId" : 7 }] }
+        }}
+        self.assertEqual(apicache.live_content_ids(data), set([5, 6]))
+
+class TestContextCache(unittest.TestCase):
+
+    def test_get_by_id_cached(self):
+        context = contentapi.ApiContext("http://localhost", None, transport = object())
+        sent = []
+        context.search_now = lambda r: sent.append(r) or { "objects" : { "content" : [{ "id" : 5 }] } }
+        context.enable_cache()
+        context.get_by_id("content", 5)
+        context.get_by_id("content", 5)
+        self.assertEqual(len(sent), 1)
+        context.cache.invalidate("content", 5)
+        context.get_by_id("content", 5)
+        self.assertEqual(len(sent), 2)
+
+if __name__ == '__main__':
+    unittest.main()
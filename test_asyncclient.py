@@ -0,0 +1,76 @@
+import unittest
+import threading
+import asyncclient
+
+class TestClientEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = asyncclient.ClientEngine()
+        self.loop_thread = None
+
+    def run_engine(self):
+        def mark():
+            self.loop_thread = threading.current_thread()
+        self.engine.post(mark)
+        runner = threading.Thread(target = self.engine.run_forever)
+        runner.start()
+        runner.join(5)
+        self.assertFalse(runner.is_alive())
+
+    def test_threadsafe_runs_on_loop(self):
+        seen = []
+        posted = self.engine.threadsafe(lambda x: seen.append((x, threading.current_thread())))
+        self.engine.start_thread(posted, 1)
+        self.engine.start_thread(lambda: self.engine.loop.call_soon_threadsafe(self.engine.loop.call_later, 0.05, self.engine.loop.stop))
+        self.run_engine()
+        self.assertEqual(seen, [(1, self.loop_thread)])
+
+    def test_blocking_result_lands_on_loop(self):
+        seen = []
+        def done(future):
+            seen.append((future.result(), threading.current_thread()))
+            self.engine.loop.stop()
+        self.engine.run_blocking(lambda: 42).add_done_callback(done)
+        self.run_engine()
+        self.assertEqual(seen, [(42, self.loop_thread)])
+
+    def test_input_handled_in_order(self):
+        keys = iter(["a", "b", "q"])
+        handled = []
+        def on_key(key):
+            # Keys are handled off the loop, and state changes go through it
+            self.assertIsNot(threading.current_thread(), self.loop_thread)
+            handled.append(self.engine.call(lambda: (key, threading.current_thread())))
+            if key == "q":
+                self.engine.stop()
+                return False
+        self.engine.start_input(lambda: next(keys), on_key)
+        self.run_engine()
+        self.assertEqual(handled, [("a", self.loop_thread), ("b", self.loop_thread), ("q", self.loop_thread)])
+
+    def test_call_raises_on_caller(self):
+        def fail():
+            raise ValueError("nope")
+        def caller():
+            with self.assertRaises(ValueError):
+                self.engine.call(fail)
+            self.assertEqual(self.engine.wait_blocking(lambda: 7), 7)
+            self.engine.stop()
+        self.engine.start_thread(caller)
+        self.run_engine()
+
+class TestAsyncApiContext(unittest.TestCase):
+
+    def test_get_by_id(self):
+        class Context:
+            def get_by_id(self, type, id, fields = "*"):
+                return { "id" : id, "type" : type }
+        engine = asyncclient.ClientEngine()
+        api = asyncclient.AsyncApiContext(Context(), engine)
+        future = api.get_by_id("content", 5)
+        future.add_done_callback(lambda f: engine.loop.stop())
+        engine.run_forever()
+        self.assertEqual(future.result(), { "id" : 5, "type" : "content" })
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import threading
+import coalesce
+import contentapi
+
+# Pretends to be the server: answers a merged request by echoing each sub-request's
+# name back with a single object holding the values that sub-request used
+class FakeContext(contentapi.ApiContext):
+
+    def __init__(self):
+        super().__init__("http://localhost", None, transport = object())
+        self.sent = []
+
+    def search_now(self, requests):
+        self.sent.append(requests)
+        objects = {}
+        for request in requests["requests"]:
+            name = request.get("name") or request["type"]
+            objects[name] = [{ "id" : v } for k, v in requests["values"].items() if "@" + k in request["query"]]
+        return { "objects" : objects }
+
+class TestMerge(unittest.TestCase):
+
+    def test_merge_renames(self):
+        merged, namemaps = coalesce.merge_searches([
+            { "values" : { "id" : 1 }, "requests" : [{ "type" : "content", "query" : "id = @id" }] },
+            { "values" : { "id" : 2 }, "requests" : [
+                { "type" : "message", "query" : "id = @id" },
+                { "type" : "user", "query" : "id in @message.createUserId" }
+            ]}
+        ])
+        self.assertEqual(merged["values"], { "r0_id" : 1, "r1_id" : 2 })
+        self.assertEqual([r["name"] for r in merged["requests"]], ["r0_content", "r1_message", "r1_user"])
+        self.assertEqual(merged["requests"][1]["query"], "id = @r1_id")
+        self.assertEqual(merged["requests"][2]["query"], "id in @r1_message.createUserId")
+        self.assertEqual(namemaps[1], { "r1_message" : "message", "r1_user" : "user" })
+
+    def test_split(self):
+        result = { "objects" : { "r0_content" : [1], "r1_content" : [2] }, "totalTime" : 5 }
+        self.assertEqual(coalesce.split_result(result, { "r1_content" : "content" }), { "objects" : { "content" : [2] }, "totalTime" : 5 })
+
+class TestBatching(unittest.TestCase):
+
+    def setUp(self):
+        self.context = FakeContext()
+
+    def test_explicit_batch(self):
+        with self.context.batch() as batch:
+            rooms = [batch.get_by_id("content", i) for i in range(1, 6)]
+        self.assertEqual(len(self.context.sent), 1)
+        self.assertEqual([r.result()["id"] for r in rooms], [1, 2, 3, 4, 5])
+
+    def test_batch_notfound(self):
+        self.context.search_now = lambda r: { "objects" : { "r0_content" : [], "r1_content" : [{ "id" : 2 }] } }
+        with self.context.batch() as batch:
+            missing = batch.get_by_id("content", 1)
+            found = batch.get_by_id("content", 2)
+        self.assertEqual(found.result()["id"], 2)
+        self.assertRaises(contentapi.NotFoundError, missing.result)
+
+    def test_window_coalescing(self):
+        self.context.set_coalescing(0.05)
+        results = {}
+        def lookup(i):
+            results[i] = self.context.get_by_id("content", i)
+        threads = [threading.Thread(target = lookup, args = (i,)) for i in range(1, 4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.context.sent), 1)
+        self.assertEqual(dict((i, r["id"]) for i, r in results.items()), { 1 : 1, 2 : 2, 3 : 3 })
+
+if __name__ == '__main__':
+    unittest.main()
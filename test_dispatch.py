@@ -0,0 +1,100 @@
+import unittest
+import json
+import threading
+import dispatch
+
+class TestMessageDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.posted = []
+        self.resyncs = []
+        self.dispatcher = dispatch.MessageDispatcher(self.posted.append, maxsize = 3, batch_size = 2, resync = self.resync)
+        self.handled = []
+        self.dispatcher.register("live", lambda c, m: self.handled.append(("live", m["data"])))
+        self.dispatcher.set_default(lambda c, m: self.handled.append(("other", m["type"])))
+
+    def resync(self, connection):
+        self.resyncs.append(list(self.handled))
+
+    # Pretend to be the consumer loop
+    def run_posted(self):
+        while self.posted:
+            self.posted.pop(0)()
+
+    def test_dispatch_by_type(self):
+        self.dispatcher.feed(None, json.dumps({ "type" : "live", "data" : 1 }))
+        self.dispatcher.feed(None, json.dumps({ "type" : "ping" }))
+        self.assertEqual(len(self.posted), 1) # Only one drain scheduled for both
+        self.run_posted()
+        self.assertEqual(self.handled, [("live", 1), ("other", "ping")])
+
+    def test_batches_reschedule(self):
+        for i in range(3):
+            self.dispatcher.feed(None, json.dumps({ "type" : "live", "data" : i }))
+        self.posted.pop(0)()
+        self.assertEqual(len(self.handled), 2)
+        self.assertEqual(len(self.posted), 1)
+        self.run_posted()
+        self.assertEqual([h[1] for h in self.handled], [0, 1, 2])
+
+    def test_full_queue_drops_live_and_resyncs(self):
+        for i in range(5):
+            self.dispatcher.feed(None, json.dumps({ "type" : "live", "data" : i }))
+        self.assertEqual(self.dispatcher.stats["dropped"], 2)
+        self.assertEqual(self.dispatcher.stats["max_queue"], 3)
+        self.run_posted()
+        self.assertEqual([h[1] for h in self.handled], [0, 1, 2])
+        self.assertEqual(self.resyncs, [[("live", 0), ("live", 1), ("live", 2)]]) # Once, right after the last frame kept
+        self.dispatcher.feed(None, json.dumps({ "type" : "live", "data" : 5 }))
+        self.run_posted()
+        self.assertEqual(self.handled[-1], ("live", 5))
+
+    def test_live_dropped_until_resync(self):
+        for i in range(4):
+            self.dispatcher.feed(None, json.dumps({ "type" : "live", "data" : i }))
+        self.posted.pop(0)() # Room in the queue again, but we're still behind a lost frame
+        self.dispatcher.feed(None, json.dumps({ "type" : "live", "data" : 4 }))
+        self.run_posted()
+        self.assertEqual([h[1] for h in self.handled], [0, 1, 2])
+        self.assertEqual(self.dispatcher.stats["dropped"], 2)
+
+    def test_acks_never_dropped(self):
+        for i in range(3):
+            self.dispatcher.feed(None, json.dumps({ "type" : "live", "data" : i }))
+        self.dispatcher.feed(None, json.dumps({ "type" : "write", "id" : "send_1" }))
+        self.dispatcher.feed(None, json.dumps({ "type" : "live", "data" : 3 }))
+        self.dispatcher.feed(None, json.dumps({ "type" : "userlist", "id" : "userlist_seed" }))
+        self.run_posted()
+        self.assertEqual(self.handled, [("live", 0), ("live", 1), ("live", 2), ("other", "write"), ("other", "userlist")])
+        self.assertEqual(self.dispatcher.stats["dropped"], 1)
+
+    def test_backpressure_waits_instead_of_dropping(self):
+        self.dispatcher.backpressure = True
+        for i in range(3):
+            self.dispatcher.feed(None, json.dumps({ "type" : "live", "data" : i }))
+        reader = threading.Thread(target = self.dispatcher.feed, args = (None, json.dumps({ "type" : "live", "data" : 3 })))
+        reader.start()
+        reader.join(0.1)
+        self.assertTrue(reader.is_alive()) # Waiting on the full queue
+        self.posted.pop(0)()
+        reader.join(5)
+        self.run_posted()
+        self.assertEqual([h[1] for h in self.handled], [0, 1, 2, 3])
+        self.assertEqual(self.dispatcher.stats["dropped"], 0)
+        self.assertEqual(self.dispatcher.stats["backpressure_waits"], 1)
+
+    def test_bad_json_counted(self):
+        self.dispatcher.feed(None, "{nope")
+        self.run_posted()
+        self.assertEqual(self.dispatcher.stats["decode_errors"], 1)
+        self.assertEqual(self.handled, [])
+
+    def test_not_an_object(self):
+        self.dispatcher.feed(None, "[1, 2]")
+        self.dispatcher.feed(None, '"live"')
+        self.run_posted()
+        self.assertEqual(self.dispatcher.stats["decode_errors"], 2)
+        self.assertEqual(self.handled, [])
+
+if __name__ == '__main__':
+    unittest.main()
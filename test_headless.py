@@ -0,0 +1,92 @@
+import unittest
+import io
+import json
+import threading
+import time
+import main
+import headless
+import mockserver
+
+class TestJsonLinesWriter(unittest.TestCase):
+
+    def test_lines_and_close(self):
+        stream = io.StringIO()
+        writer = headless.JsonLinesWriter(stream, max_lines = 5, flush_seconds = 10).start()
+        for i in range(100):
+            writer.write({ "i" : i, "text" : "café" })
+        writer.close()
+        lines = stream.getvalue().splitlines()
+        self.assertEqual([json.loads(l)["i"] for l in lines], list(range(100)))
+        self.assertEqual(lines[0], '{"i":0,"text":"café"}')
+        self.assertEqual(writer.stats["lines"], 100)
+        self.assertTrue(writer.stats["writes"] < 100)
+
+    def test_broken_output_raises(self):
+        class Broken(io.StringIO):
+            def write(self, text):
+                raise BrokenPipeError("gone")
+        writer = headless.JsonLinesWriter(Broken(), max_lines = 2, flush_seconds = 0.01).start()
+        with self.assertRaises(BrokenPipeError): # Not a hang, even though the queue fills
+            for i in range(100):
+                writer.write({ "i" : i })
+        self.assertRaises(BrokenPipeError, writer.close)
+
+class TestLiveEvents(unittest.TestCase):
+
+    def setUp(self):
+        data = mockserver.MockData(users = 5, rooms = 3, messages = 0)
+        self.frames = [data.post_message(1 + i % 3, 2, "m%d" % i) for i in range(6)]
+
+    def events(self, rooms = None, types = None):
+        return [e for frame in self.frames for e in headless.live_events(frame, rooms, types)]
+
+    def test_flattened(self):
+        events = self.events()
+        self.assertEqual(len(events), 6)
+        self.assertEqual(events[0]["type"], "message_event")
+        self.assertEqual(events[0]["room"], 1)
+        self.assertEqual(events[0]["object"]["text"], "m0")
+
+    def test_filters(self):
+        self.assertEqual([e["object"]["text"] for e in self.events(rooms = { 2 })], ["m1", "m4"])
+        self.assertEqual(self.events(types = { "activity_event" }), [])
+
+    def test_userlist_events(self):
+        lines = list(headless.userlist_events({ "statuses" : { "1" : { "2" : "here" }, "3" : {} } }, { 1 }))
+        self.assertEqual(lines, [{ "type" : "userlistupdate", "room" : 1, "statuses" : { "2" : "here" } }])
+
+class TestHeadlessSession(unittest.TestCase):
+
+    def test_stream_from_mock(self):
+        server = mockserver.MockServer(mockserver.MockData(users = 5, rooms = 3, messages = 0)).start()
+        config = dict(main.config)
+        config["api"] = server.url
+        context = main.create_context(config)
+        context.token = server.make_token(1)
+        stream = io.StringIO()
+        writer = headless.JsonLinesWriter(stream).start()
+        opened = threading.Event()
+        session = main.create_session(context, config, lambda ws, r: opened.set(), headless.headless_onclose, { "id" : 1, "username" : "user1" })
+        ws = headless.attach(session, writer, rooms = { 2 })
+        thread = threading.Thread(target = session.engine.run_forever, daemon = True)
+        thread.start()
+        session.start()
+        self.assertTrue(opened.wait(5))
+        while not server.sockets: # The mock only starts pushing once it's done with the handshake
+            time.sleep(0.01)
+        for i in range(20):
+            server.post_message(1 + i % 2, 3, "m%d" % i)
+        server.set_status(2, 4, "here")
+        deadline = time.monotonic() + 5
+        while writer.stats["lines"] < 11 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        ws.close()
+        session.engine.stop()
+        writer.close()
+        server.stop()
+        lines = [json.loads(l) for l in stream.getvalue().splitlines()]
+        self.assertEqual([l["object"]["text"] for l in lines[:10]], ["m%d" % i for i in range(1, 20, 2)])
+        self.assertEqual(lines[10]["type"], "userlistupdate")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import os
+import logging
+import tempfile
+import contentapi
+import mockserver
+import history
+import store
+
+class TestRoomHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockserver.MockServer(mockserver.MockData(users = 10, rooms = 3, messages = 0)).start()
+        self.api = contentapi.ApiContext(self.server.url, logging)
+        for i in range(25):
+            self.server.data.post_message(1 + i % 2, 1 + i % 10, "message %d" % i)
+        self.requests = 0
+        search = self.api.search
+        def counting(request):
+            self.requests += 1
+            return search(request)
+        self.api.search = counting
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_join_one_request(self):
+        room, room_history, messages = history.join(self.api, 1, 5)
+        self.assertEqual(self.requests, 1)
+        self.assertEqual(room["id"], 1)
+        self.assertEqual([m["text"] for m in messages], ["message %d" % i for i in [16, 18, 20, 22, 24]])
+        self.assertEqual(self.api.users.get(messages[0]["createUserId"])["username"], "user7")
+
+    def test_chunks_back_to_start(self):
+        room, room_history, messages = history.join(self.api, 1, 5)
+        seen = list(messages)
+        while not room_history.exhausted:
+            seen = room_history.load_older() + seen
+        self.assertEqual([m["text"] for m in seen], ["message %d" % i for i in range(0, 25, 2)])
+        self.assertEqual(room_history.load_older(), [])
+        self.assertEqual(self.requests, 3)
+
+    def test_deleted_skipped(self):
+        self.server.data.tables["message"][-1]["deleted"] = True # message 24
+        room, room_history, messages = history.join(self.api, 1, 3)
+        self.assertEqual([m["text"] for m in messages], ["message 20", "message 22"])
+        self.assertEqual(room_history.load_older()[-1]["text"], "message 18")
+
+    def test_missing_room(self):
+        self.assertRaises(contentapi.NotFoundError, history.join, self.api, 99)
+
+    def test_room_cached(self):
+        self.api.enable_cache()
+        history.join(self.api, 1, 5)
+        sent = []
+        search = self.api.search
+        self.api.search = lambda request: sent.append(request) or search(request)
+        room, room_history, messages = history.join(self.api, 1, 5)
+        self.assertEqual(room["name"], self.server.data.tables["content"][0]["name"])
+        self.assertEqual([r["type"] for r in sent[0]["requests"]], ["message", "user"]) # Just the messages
+        self.api.cache.invalidate("content", 1) # What a live update to the room does
+        history.join(self.api, 1, 5)
+        self.assertEqual(sent[1]["requests"][0]["type"], "content")
+
+    def texts(self, messages):
+        return [m["text"] for m in messages]
+
+    def use_store(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.api.store = store.MessageStore(os.path.join(self.dir.name, "messages.db"), retention = 0)
+        self.addCleanup(self.api.store.close)
+
+    def test_store_serves_what_it_has(self):
+        self.use_store()
+        room, room_history, messages = history.join(self.api, 1, 5)
+        self.assertEqual(self.api.store.coverage(1), (17, 25))
+        # Next run: only what's newer comes from the server, the rest of the chunk from the store
+        self.server.data.post_message(1, 1, "new 0")
+        self.server.data.post_message(1, 1, "new 1")
+        room, room_history, messages = history.join(self.api, 1, 5)
+        self.assertEqual(self.texts(messages), ["message 20", "message 22", "message 24", "new 0", "new 1"])
+        self.assertEqual(self.requests, 2)
+        # Two older ones are stored, the other three are asked for (and stored)
+        self.assertEqual(self.texts(room_history.load_older()), ["message %d" % i for i in [10, 12, 14, 16, 18]])
+        self.assertEqual(self.requests, 3)
+        self.assertEqual(self.api.store.coverage(1), (11, 27))
+        while not room_history.exhausted:
+            room_history.load_older()
+        self.assertEqual(self.api.store.coverage(1), (0, 27))
+        # Once it's all stored, the whole room's history is one request (for anything new)
+        requests = self.requests
+        room, room_history, messages = history.join(self.api, 1, 5)
+        seen = list(messages)
+        while not room_history.exhausted:
+            seen = room_history.load_older() + seen
+        self.assertEqual(self.texts(seen), ["message %d" % i for i in range(0, 25, 2)] + ["new 0", "new 1"])
+        self.assertEqual(self.requests, requests + 1)
+
+    def test_store_too_far_behind(self):
+        self.use_store()
+        history.join(self.api, 1, 3)
+        for i in range(4):
+            self.server.data.post_message(1, 1, "new %d" % i)
+        room, room_history, messages = history.join(self.api, 1, 3)
+        self.assertEqual(self.texts(messages), ["new 1", "new 2", "new 3"])
+        self.assertEqual(self.api.store.coverage(1), (27, 29)) # Starts over from the new chunk
+        self.assertEqual(self.texts(room_history.load_older()), ["message 22", "message 24", "new 0"])
+
+if __name__ == '__main__':
+    unittest.main()
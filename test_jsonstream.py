@@ -0,0 +1,61 @@
+import unittest
+import json
+import jsonstream
+
+RESULT = {
+    "databaseTimeMs" : 12,
+    "objects" : {
+        "content" : [{ "id" : 1, "name" : "Megathread", "values" : { "a" : [1, 2] } }, { "id" : 22, "name" : "Ünïcödé \"quoted\"" }],
+        "user" : [],
+        "message" : [{ "id" : 3, "text" : "1.5e3 true null", "deleted" : False }]
+    },
+    "requests" : [{ "type" : "content" }]
+}
+
+def rows_of(text, size):
+    reader = jsonstream.RowReader(text[i:i + size] for i in range(0, len(text), size))
+    return list(reader.rows()), reader.rest
+
+class TestRowReader(unittest.TestCase):
+
+    def expected(self):
+        return [(type, row) for type, rows in RESULT["objects"].items() for row in rows]
+
+    def test_any_chunking(self):
+        for text in [json.dumps(RESULT), json.dumps(RESULT, indent = 2)]:
+            for size in [1, 2, 3, 7, 64, len(text)]:
+                rows, rest = rows_of(text, size)
+                self.assertEqual(rows, self.expected())
+                self.assertEqual(rest, { "databaseTimeMs" : 12, "requests" : [{ "type" : "content" }] })
+
+    def test_number_split_between_chunks(self):
+        reader = jsonstream.RowReader(['{"objects":{"a":[12', '34]},"x":5', '6}'])
+        self.assertEqual(list(reader.rows()), [("a", 1234)])
+        self.assertEqual(reader.rest, { "x" : 56 })
+        for chunks, number in [(['{"objects":{"a":[1.', '5]}}'], 1.5), (['{"objects":{"a":[1e', '3]}}'], 1e3),
+                (['{"objects":{"a":[1.5E', '-3]}}'], 1.5e-3), (['{"objects":{"a":[1.5E-', '3]}}'], 1.5e-3), (['{"objects":{"a":[-', '2]}}'], -2)]:
+            self.assertEqual(list(jsonstream.RowReader(chunks).rows()), [("a", number)])
+
+    def test_empty(self):
+        self.assertEqual(rows_of("{}", 1), ([], {}))
+        self.assertEqual(rows_of('{"objects":{}}', 3), ([], {}))
+
+    def test_malformed(self):
+        for text in ['{"objects":{"a":[1,2', '{"objects":{"a":[1 2]}}', '["objects"]', '{"objects":{"a":[{"id":1}']:
+            self.assertRaises(ValueError, rows_of, text, 4)
+
+    def test_rows_come_before_the_end(self):
+        chunks = iter(['{"objects":{"a":[{"id":1},', '{"id":2}]}}'])
+        rows = jsonstream.RowReader(chunks).rows()
+        self.assertEqual(next(rows), ("a", { "id" : 1 }))
+        self.assertEqual(next(chunks), '{"id":2}]}}') # The first row was handed out before the rest was read
+
+    def test_text_chunks(self):
+        data = json.dumps(RESULT, ensure_ascii = False).encode("utf-8")
+        counter = [0]
+        text = "".join(jsonstream.text_chunks([data[i:i + 1] for i in range(len(data))], counter))
+        self.assertEqual(json.loads(text), RESULT)
+        self.assertEqual(counter[0], len(data))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import livesocket
+
+class TestTrackLive(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = livesocket.LiveConnection(None, None)
+
+    def test_tracks_highest(self):
+        self.assertTrue(self.conn.track_live({ "lastId" : 12, "events" : [{ "id" : 11 }, { "id" : 12 }] }))
+        self.assertEqual(self.conn.last_id, 12)
+
+    def test_lastid_without_events(self):
+        self.assertTrue(self.conn.track_live({ "lastId" : 40, "events" : [] }))
+        self.assertEqual(self.conn.last_id, 40)
+
+    def test_replay_dropped(self):
+        self.conn.track_live({ "lastId" : 12, "events" : [{ "id" : 12 }] })
+        self.assertFalse(self.conn.track_live({ "lastId" : 12, "events" : [{ "id" : 10 }, { "id" : 12 }] }))
+        self.assertEqual(self.conn.stats["events_replayed"], 2)
+        self.assertEqual(self.conn.last_id, 12)
+
+    def test_recovered_after_resume(self):
+        self.conn.track_live({ "lastId" : 5, "events" : [{ "id" : 5 }] })
+        self.conn.dropped_at = 0
+        self.conn.opened_count = 1
+        self.conn._handle_open(None)
+        self.assertEqual(self.conn.stats["reconnects"], 1)
+        self.conn.track_live({ "lastId" : 8, "events" : [{ "id" : 6 }, { "id" : 7 }, { "id" : 8 }] })
+        self.assertEqual(self.conn.stats["events_recovered"], 3)
+        self.assertEqual(self.conn.last_id, 8)
+
+    def test_partial_replay_filtered(self):
+        self.conn.track_live({ "lastId" : 12, "events" : [{ "id" : 12 }] })
+        data = self.conn.track_live({ "lastId" : 14, "events" : [
+            { "id" : 11, "type" : "message_event", "refId" : 1 },
+            { "id" : 13, "type" : "message_event", "refId" : 2 },
+            { "id" : 14, "type" : "activity_event", "refId" : 5 }
+        ], "objects" : {
+            "message_event" : { "message" : [{ "id" : 1 }, { "id" : 2 }], "user" : [{ "id" : 7 }] },
+            "activity_event" : { "activity" : [{ "id" : 5 }] }
+        }})
+        self.assertEqual([e["id"] for e in data["events"]], [13, 14])
+        self.assertEqual(data["objects"]["message_event"], { "message" : [{ "id" : 2 }], "user" : [{ "id" : 7 }] })
+        self.assertEqual(data["objects"]["activity_event"], { "activity" : [{ "id" : 5 }] })
+        self.assertEqual(self.conn.stats["events_replayed"], 1)
+        self.assertEqual(self.conn.last_id, 14)
+
+    def test_recovered_counts_only_the_gap(self):
+        self.conn.track_live({ "lastId" : 5, "events" : [{ "id" : 5 }] })
+        self.conn.dropped_at = 0
+        self.conn.opened_count = 1
+        self.conn._handle_open(None)
+        self.conn.track_live({ "lastId" : 8, "events" : [{ "id" : 5 }, { "id" : 6 }, { "id" : 7 }, { "id" : 8 }] }) # Missed 6 to 8 (5 again)
+        self.conn.track_live({ "lastId" : 9, "events" : [{ "id" : 9 }] }) # New, not missed
+        self.assertEqual(self.conn.stats["events_recovered"], 3)
+        self.assertEqual(self.conn.stats["events_replayed"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+import loadtest
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 0.5), 50)
+        self.assertEqual(loadtest.percentile(values, 0.99), 99)
+        self.assertEqual(loadtest.percentile(values, 1), 100)
+        self.assertEqual(loadtest.percentile([7], 0.5), 7)
+        self.assertEqual(loadtest.percentile([], 0.5), 0)
+
+    def test_parse_mix(self):
+        self.assertEqual(loadtest.parse_mix("search=3, get=1"), { "search" : 3, "get" : 1 })
+        self.assertRaises(ValueError, loadtest.parse_mix, "delete=1")
+
+    def test_summarize(self):
+        reports = [
+            { "sessions" : 2, "connect_errors" : 0, "live_frames" : 5, "results" : { "get" : { "latencies" : [3, 1], "errors" : 1 } } },
+            { "sessions" : 1, "connect_errors" : 1, "live_frames" : 2, "results" : { "get" : { "latencies" : [2], "errors" : 0 } } }
+        ]
+        summary = loadtest.summarize(reports, 2)
+        self.assertEqual(summary["sessions"], 3)
+        self.assertEqual(summary["operations"]["get"]["count"], 3)
+        self.assertEqual(summary["operations"]["get"]["errors"], 1)
+        self.assertEqual(summary["operations"]["get"]["per_second"], 1.5)
+        self.assertEqual(summary["operations"]["get"]["max_ms"], 3)
+
+    def run_mock(self, processes):
+        args = loadtest.parse_args(["--mock", "--sessions", "4", "--processes", str(processes), "--duration", "0.5", "--rooms", "10"])
+        summary = loadtest.run(args)
+        self.assertEqual(summary["sessions"], 4)
+        self.assertEqual(summary["connect_errors"], 0)
+        self.assertEqual(sorted(summary["operations"]), sorted(loadtest.OPERATIONS))
+        for op in summary["operations"].values():
+            self.assertEqual(op["errors"], 0)
+        self.assertTrue(summary["operations"]["search"]["count"] > 0)
+
+    def test_against_mock_in_process(self):
+        self.run_mock(0)
+
+    def test_against_mock_process_pool(self):
+        self.run_mock(2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import os
+import json
+import tempfile
+import metrics
+
+class TestHistogram(unittest.TestCase):
+
+    def test_summary(self):
+        histogram = metrics.Histogram()
+        for value in [0.3, 1.5, 1.8, 40, 7000]:
+            histogram.observe(value)
+        summary = histogram.summary()
+        self.assertEqual(summary["count"], 5)
+        self.assertEqual(summary["p50"], 2)
+        self.assertEqual(summary["max"], 7000)
+        self.assertEqual(summary["p99"], 7000)
+
+    def test_empty(self):
+        self.assertEqual(metrics.Histogram().summary()["p95"], 0)
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_snapshot(self):
+        self.registry.inc("http.request.requests")
+        self.registry.inc("http.bytes_in", 100)
+        with self.registry.timer("http.request.ms"):
+            pass
+        depth = [3]
+        self.registry.gauge("ws.queue_depth", lambda: depth[0])
+        self.registry.source("cache", lambda: { "hits" : 2, "name" : "not a number" })
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot["counters"]["http.bytes_in"], 100)
+        self.assertEqual(snapshot["histograms"]["http.request.ms"]["count"], 1)
+        self.assertEqual(snapshot["gauges"]["ws.queue_depth"], 3)
+        self.assertEqual(snapshot["gauges"]["cache.hits"], 2)
+        self.assertNotIn("cache.name", snapshot["gauges"])
+        self.assertTrue(len(self.registry.lines()) > 4)
+
+    def test_rates_since_last_snapshot(self):
+        self.registry.started -= 10
+        self.registry.inc("ws.frames_in", 10)
+        first = self.registry.snapshot()
+        other = self.registry.snapshot() # Someone else looking doesn't move our baseline
+        snapshot = self.registry.snapshot(first)
+        self.assertEqual(snapshot["rates"]["ws.frames_in"], 0)
+        self.assertGreater(other["rates"]["ws.frames_in"], 0)
+        self.assertAlmostEqual(snapshot["overall_rates"]["ws.frames_in"], 10 / snapshot["uptime"]) # About 1/s
+
+    def test_dump(self):
+        path = os.path.join(tempfile.mkdtemp(), "metrics.jsonl")
+        dumper = metrics.JsonLinesDumper(self.registry, path)
+        self.registry.inc("thing")
+        dumper.dump()
+        dumper.dump()
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]["counters"]["thing"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
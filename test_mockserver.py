@@ -0,0 +1,145 @@
+import unittest
+import json
+import logging
+import threading
+import contentapi
+import livesocket
+import mockserver
+
+class TestMockServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockserver.MockServer(mockserver.MockData(users = 20, rooms = 30, messages = 50)).start()
+        self.api = contentapi.ApiContext(self.server.url, logging)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def login(self):
+        self.api.token = self.api.login("user1", mockserver.PASSWORD)
+
+    def test_apistatus(self):
+        self.assertIn("version", self.api.api_status())
+
+    def test_token(self):
+        self.assertFalse(self.api.is_token_valid())
+        self.login()
+        self.assertEqual(self.api.is_token_valid()["username"], "user1")
+
+    def test_bad_login(self):
+        self.assertRaises(contentapi.BadRequestError, self.api.login, "user1", "wrong")
+
+    def test_get_by_id(self):
+        self.assertEqual(self.api.get_by_id("content", 5)["id"], 5)
+        self.assertRaises(contentapi.NotFoundError, self.api.get_by_id, "content", 0)
+
+    def test_basic_search(self):
+        result = self.api.basic_search("megathread")["objects"]["content"]
+        self.assertTrue(len(result) >= 1)
+        self.assertTrue(all("Megathread" in c["name"] and "text" not in c for c in result))
+        rows = list(self.api.basic_search_rows("", 7))
+        self.assertEqual(len(rows), 30)
+
+    def test_basic_search_pages(self):
+        # Two rooms last active at the same moment: the tie is broken by id
+        self.server.data.by_id["content"][3]["lastActionDate"] = self.server.data.by_id["content"][4]["lastActionDate"]
+        pages = list(self.api.basic_search_pages("", 7))
+        self.assertEqual([len(page) for page in pages], [7, 7, 7, 7, 2])
+        rows = [item["id"] for page in pages for item in page]
+        everything = self.api.search({ "requests" : [{ "type" : "content", "fields" : "*", "query" : "" }] })["objects"]["content"]
+        self.assertEqual(rows, [c["id"] for c in sorted(everything, key = lambda c: (c["lastActionDate"], c["id"]), reverse = True)])
+        self.assertEqual(rows, [item["id"] for item in self.api.basic_search_rows("", 7)])
+        # A room that gets busy while you're paging moves to the front, but doesn't shift the pages after it
+        pages = self.api.basic_search_pages("", 7)
+        first = next(pages)
+        self.server.post_message(first[-1]["id"], 2, "bump")
+        self.assertEqual([item["id"] for page in pages for item in page], rows[7:])
+        self.assertEqual(next(self.api.basic_search_pages("", 7))[0]["id"], first[-1]["id"])
+
+    def test_compression(self):
+        rows = list(self.api.basic_search_rows("", 30))
+        counters = self.api.metrics.counters
+        self.assertGreater(counters["http.compressed_responses"], 0)
+        self.assertLess(counters["http.bytes_wire"], counters["http.bytes_in"])
+        # Asking for nothing but identity gets the same rows, uncompressed
+        plain = contentapi.ApiContext(self.server.url, logging)
+        plain.set_compression("")
+        self.assertEqual(list(plain.basic_search_rows("", 30)), rows)
+        self.assertNotIn("http.compressed_responses", plain.metrics.counters)
+        self.assertEqual(plain.metrics.counters["http.bytes_wire"], plain.metrics.counters["http.bytes_in"])
+
+    def test_streamed_rows(self):
+        self.login()
+        request = { "requests" : [{ "type" : "content", "fields" : "*", "query" : "" }, { "type" : "user", "fields" : "*", "query" : "" }] }
+        buffered = list(self.api.search_rows(request))
+        self.api.streaming = True
+        self.api.stream_chunk_size = 100
+        self.assertEqual(list(self.api.search_rows(request)), buffered)
+        self.assertEqual(len([row for type, row in buffered if type == "user"]), 20)
+        self.assertEqual(self.api.metrics.counters["http.request.requests"], 2)
+        queries = [contentapi.records.Query(contentapi.records.ContentRecord, "id = @id")]
+        self.assertEqual([record.id for name, record in self.api.query_rows(queries, { "id" : 5 })], [5])
+        self.assertRaises(contentapi.BadRequestError, list, self.api.search_rows({ "requests" : [{ "type" : "nothing" }] }))
+
+    def test_references(self):
+        result = self.api.search({
+            "values" : { "room" : 3 },
+            "requests" : [
+                { "type" : "message", "fields" : "*", "query" : "contentId = @room" },
+                { "type" : "user", "fields" : "*", "query" : "id in @message.createUserId" }
+            ]
+        })["objects"]
+        self.assertTrue(len(result["message"]) >= 1)
+        self.assertEqual(set(u["id"] for u in result["user"]), set(m["createUserId"] for m in result["message"]))
+
+    def test_websocket_userlist_and_resume(self):
+        self.login()
+        received = []
+        opened = threading.Event()
+        got = threading.Semaphore(0)
+        def on_message(conn, message):
+            received.append(json.loads(message))
+            got.release()
+        conn = livesocket.LiveConnection(self.api, on_message, lambda c, r: opened.set(), min_backoff = 0.05, max_backoff = 0.1)
+        threading.Thread(target = conn.run_forever, daemon = True).start()
+        self.assertTrue(opened.wait(5))
+        conn.send(self.api.gen_ws_request("userlist", id = "userlist_global"))
+        self.assertTrue(got.acquire(timeout = 5))
+        self.assertEqual(received[-1]["type"], "userlist")
+
+        self.server.set_status(2, 3, "here")
+        self.assertTrue(got.acquire(timeout = 5))
+        self.assertEqual(received[-1]["type"], "userlistupdate")
+        self.assertEqual(received[-1]["data"]["statuses"], { "2" : { "3" : "here" } })
+
+        conn.send(self.api.gen_ws_request("write", { "contentId" : 2, "text" : "sent" }, id = "send_1"))
+        self.assertTrue(got.acquire(timeout = 5))
+        self.assertTrue(got.acquire(timeout = 5))
+        self.assertEqual(received[-2]["id"], "send_1")
+        self.assertEqual(received[-2]["data"]["createUserId"], 1)
+        self.assertEqual(received[-1]["type"], "live")
+
+        self.server.post_message(1, 2, "hello")
+        self.assertTrue(got.acquire(timeout = 5))
+        conn.track_live(received[-1]["data"])
+
+        # Messages posted while the socket is down come back when it resumes
+        opened.clear()
+        self.server.drop_sockets()
+        self.server.post_message(1, 2, "while you were gone")
+        self.assertTrue(opened.wait(5))
+        self.assertTrue(got.acquire(timeout = 5))
+        self.assertEqual(received[-1]["data"]["objects"]["message_event"]["message"][0]["text"], "while you were gone")
+
+        # A resync (we lost frames) reconnects right away from the last event handled, which
+        # wasn't that one, so it comes again
+        opened.clear()
+        conn.resync()
+        self.assertTrue(opened.wait(5))
+        self.assertTrue(got.acquire(timeout = 5))
+        self.assertEqual(received[-1]["data"]["objects"]["message_event"]["message"][0]["text"], "while you were gone")
+        self.assertEqual(conn.stats["resyncs"], 1)
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
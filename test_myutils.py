@@ -43,5 +43,36 @@ class TestMergeDictionary(unittest.TestCase):
         myutils.merge_dictionary(new, base)
         self.assertDictEqual(base, expected)
 
+class TestPhaseProfile(unittest.TestCase):
+
+    def test_phases(self):
+        profile = myutils.PhaseProfile()
+        with profile.phase("one"):
+            pass
+        profile.mark("two")
+        self.assertEqual([p[0] for p in profile.phases], ["one", "two"])
+        self.assertEqual([p[2] for p in profile.phases], [False, True])
+        self.assertEqual(len(profile.report()), 2)
+
+    def test_when_complete(self):
+        profile = myutils.PhaseProfile()
+        reports = []
+        profile.expect("one")
+        profile.expect("two")
+        profile.when_complete(lambda: reports.append(profile.report()))
+        profile.mark("two")
+        self.assertEqual(reports, [])
+        profile.mark("one")
+        profile.mark("three")
+        self.assertEqual(len(reports), 1) # Once, as soon as the last expected mark is in
+        self.assertEqual(len(reports[0]), 2)
+
+    def test_disabled(self):
+        profile = myutils.PhaseProfile(False)
+        with profile.phase("one"):
+            pass
+        profile.mark("two")
+        self.assertEqual(profile.report(), [])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import unittest
+import io
+import types
+import threading
+import output
+import asyncclient
+import main
+
+# Counts how many times write is called, so we can check output is batched
+class CountingStream(io.StringIO):
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+class TestOutputEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = CountingStream()
+        self.display = output.OutputEngine(max_paused_lines = 3, stream = self.stream)
+
+    def test_block_is_one_write(self):
+        self.display.lines(["user %d" % i for i in range(2000)])
+        self.assertEqual(self.stream.writes, 1)
+        self.assertEqual(len(self.stream.getvalue().splitlines()), 2000)
+
+    def test_paused_held_until_resume(self):
+        self.display.pause()
+        self.display.line("live 1", pausable = True)
+        self.display.line("interactive")
+        self.display.line("live 2", pausable = True)
+        self.assertEqual(self.stream.getvalue(), "interactive\n")
+        self.display.resume()
+        self.assertEqual(self.stream.getvalue(), "interactive\nlive 1\nlive 2\n")
+        self.assertEqual(self.stream.writes, 2)
+
+    def test_paused_cap(self):
+        self.display.pause()
+        self.display.lines(["%d" % i for i in range(5)], pausable = True)
+        self.display.resume()
+        self.assertEqual(self.stream.getvalue(), "2\n3\n4\n")
+        self.assertEqual(self.display.stats["dropped"], 2)
+
+# The real client: live output printed on the loop while a prompt waits on the input thread
+class TestPromptPause(unittest.TestCase):
+
+    def test_live_output_held_while_prompting(self):
+        stream = CountingStream()
+        engine = asyncclient.ClientEngine()
+        runner = threading.Thread(target = engine.run_forever)
+        runner.start()
+        saved = (main.display, main.PROMPTS, main.print_statusline)
+        seen = []
+        def prompt(ws):
+            engine.call(main.printr, "live", True)
+            seen.append(stream.getvalue())
+        try:
+            main.display = output.OutputEngine(stream = stream)
+            main.PROMPTS = { "s" : prompt }
+            main.print_statusline = lambda ws: main.printr("status")
+            main.handle_key(types.SimpleNamespace(engine = engine), "s")
+        finally:
+            main.display, main.PROMPTS, main.print_statusline = saved
+            engine.stop()
+            runner.join(5)
+        self.assertEqual(seen, [""])
+        self.assertLess(stream.getvalue().index("live"), stream.getvalue().index("status")) # Shown once the prompt was done
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import logging
+import contentapi
+import mockserver
+import records
+
+class TestRecords(unittest.TestCase):
+
+    def test_dict_like(self):
+        room = records.ContentRecord.from_dict({ "id" : 5, "name" : "Room", "text" : "not kept", "deleted" : False })
+        self.assertEqual(room["name"], "Room")
+        self.assertEqual(room.name, "Room")
+        self.assertEqual(room.get("lastActionDate", "never"), "never")
+        self.assertRaises(KeyError, lambda: room["text"])
+        self.assertIn("id", room)
+        self.assertNotIn("createUserId", room)
+        self.assertFalse(hasattr(room, "__dict__"))
+        self.assertEqual(room.to_dict()["id"], 5)
+        self.assertEqual(room, records.ContentRecord.from_dict(room.to_dict()))
+        self.assertNotEqual(room, records.ContentRecord.from_dict({ "id" : 6 }))
+
+    def test_query_request(self):
+        request = records.search_request([
+            records.Query(records.MessageRecord, "contentId = @room", "id_desc", 10),
+            records.Query(records.UserRecord, "id in @message.createUserId", name = "authors")
+        ], { "room" : 1 })
+        self.assertEqual(request["values"], { "room" : 1 })
+        self.assertEqual(request["requests"][0], { "type" : "message", "fields" : "id,contentId,createUserId,text,createDate,deleted",
+            "query" : "contentId = @room", "order" : "id_desc", "limit" : 10 })
+        self.assertEqual(request["requests"][1]["name"], "authors")
+
+class TestQueryMock(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockserver.MockServer(mockserver.MockData(users = 10, rooms = 5, messages = 20)).start()
+        self.api = contentapi.ApiContext(self.server.url, logging)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_projected_and_decoded(self):
+        result = self.api.query([
+            records.Query(records.MessageRecord, "contentId = @room", limit = 3),
+            records.Query(records.UserRecord, "id in @message.createUserId")
+        ], { "room" : 2 })
+        self.assertEqual([m.contentId for m in result["message"]], [2, 2, 2])
+        self.assertTrue(all(isinstance(u, records.UserRecord) for u in result["user"]))
+        self.assertEqual(result["user"][0].username, "user%d" % result["user"][0].id)
+        # The directory keeps records too
+        self.assertIsInstance(self.api.users.get(result["user"][0].id), records.UserRecord)
+
+if __name__ == '__main__':
+    unittest.main()
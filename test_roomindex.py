@@ -0,0 +1,89 @@
+import unittest
+import os
+import tempfile
+import roomindex
+
+# Serves content ids and names like the "request" endpoint would, a page at a time
+class FakeContext:
+
+    def __init__(self, rooms, during = None):
+        self.rooms = rooms
+        self.searches = 0
+        self.during = during # Called before each page is served (for live updates mid-build)
+
+    def search_rows(self, request):
+        self.searches += 1
+        if self.during:
+            self.during(self.searches)
+        after = request["values"]["after"]
+        limit = request["requests"][0]["limit"]
+        for id, name in [(id, name) for id, name in sorted(self.rooms.items()) if id > after][:limit]:
+            yield "content", { "id" : id, "name" : name }
+
+class TestRoomIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.rooms = { 1 : "Megathread", 2 : "Big Dumb", 3 : "mega test", 4 : "Other" }
+        self.index = roomindex.RoomIndex()
+        self.index.build(FakeContext(self.rooms), page_size = 2)
+
+    def test_build_paged(self):
+        self.assertTrue(self.index.ready)
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.max_id, 4)
+
+    def test_substring(self):
+        self.assertEqual([r["id"] for r in self.index.search("EGA")], [3, 1])
+        self.assertEqual(self.index.search("dumb"), [{ "id" : 2, "name" : "Big Dumb" }])
+
+    def test_prefix(self):
+        self.assertEqual([r["id"] for r in self.index.prefix("mega")], [3, 1])
+        self.assertEqual(self.index.prefix("zzz"), [])
+
+    def test_live_updates(self):
+        self.index.update_from_live({ "objects" : { "activity_event" : { "content" : [
+            { "id" : 2, "name" : "Renamed" },
+            { "id" : 4, "name" : "Other", "deleted" : True },
+            { "id" : 9, "name" : "New room" }
+        ]}}})
+        self.assertEqual(self.index.search("dumb"), [])
+        self.assertEqual([r["id"] for r in self.index.search("n")], [9, 2])
+        self.assertEqual(self.index.prefix("renamed")[0]["id"], 2)
+
+    def test_persist_and_incremental(self):
+        path = os.path.join(tempfile.mkdtemp(), "rooms.json")
+        self.index.save(path)
+        loaded = roomindex.RoomIndex()
+        self.assertTrue(loaded.load(path))
+        self.assertEqual(len(loaded), 4)
+        self.rooms[5] = "Fresh"
+        context = FakeContext(self.rooms)
+        loaded.build(context, page_size = 2)
+        self.assertEqual(context.searches, 1) # Only content newer than the saved index
+        self.assertEqual(loaded.search("fresh")[0]["id"], 5)
+
+    def test_live_during_build(self):
+        index = roomindex.RoomIndex()
+        def live(page):
+            if page == 2:
+                index.update_from_live({ "objects" : { "content_event" : { "content" : [{ "id" : 50, "name" : "Made live" }, { "id" : 3, "name" : "Renamed live" }] } } })
+        index.build(FakeContext(self.rooms, live), page_size = 2)
+        self.assertEqual(len(index), 5) # Nothing between the cursor and the live room was skipped
+        self.assertEqual(index.max_id, 4)
+        self.assertEqual(index.search("mega"), [{ "id" : 1, "name" : "Megathread" }]) # The page's old name for 3 didn't win
+        self.assertEqual(index.prefix("renamed")[0]["id"], 3)
+
+    def test_full_rebuild_when_old(self):
+        path = os.path.join(tempfile.mkdtemp(), "rooms.json")
+        self.index.built_at -= 7200
+        self.index.save(path)
+        self.assertTrue(roomindex.RoomIndex().load(path, 3 * 3600))
+        stale = roomindex.RoomIndex()
+        self.assertFalse(stale.load(path, 3600))
+        del self.rooms[2]
+        stale.build(FakeContext(self.rooms), page_size = 2)
+        self.assertEqual(stale.search("dumb"), [])
+        self.assertGreater(stale.built_at, self.index.built_at)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import rooms
+
+def message(id, room):
+    return { "id" : id, "contentId" : room, "text" : "hi" }
+
+class TestRoomSet(unittest.TestCase):
+
+    def setUp(self):
+        self.rooms = rooms.RoomSet()
+        self.rooms.watch(1, { "id" : 1, "name" : "One" })
+        self.rooms.watch(2, { "id" : 2, "name" : "Two" })
+        self.rooms.watch(3)
+        self.rooms.switch(1)
+
+    def test_route_current(self):
+        room = self.rooms.route(message(10, 1))
+        self.assertEqual(room.id, 1)
+        self.assertEqual(room.last_message_id, 10)
+        self.assertEqual(self.rooms.total_unread, 0)
+
+    def test_route_other_counts_unread(self):
+        self.assertIsNone(self.rooms.route(message(10, 2)))
+        self.assertIsNone(self.rooms.route(message(11, 2)))
+        self.assertIsNone(self.rooms.route(message(12, 3)))
+        self.assertEqual(self.rooms.get(2).unread, 2)
+        self.assertEqual(self.rooms.total_unread, 3)
+
+    def test_route_unwatched(self):
+        self.assertIsNone(self.rooms.route(message(10, 99)))
+        self.assertEqual(self.rooms.total_unread, 0)
+
+    def test_switch_clears_unread(self):
+        self.rooms.route(message(10, 2))
+        self.rooms.route(message(11, 3))
+        room = self.rooms.switch(2)
+        self.assertEqual(room.name, "Two")
+        self.assertEqual(room.unread, 0)
+        self.assertEqual(self.rooms.total_unread, 1)
+        self.assertEqual(self.rooms.route(message(12, 2)), room)
+
+    def test_switch_keeps_data(self):
+        self.assertEqual(self.rooms.switch(3).name, "#3")
+        self.assertEqual(self.rooms.switch(1).name, "One")
+
+    def test_next_unread_wraps(self):
+        self.assertIsNone(self.rooms.next_unread())
+        self.rooms.switch(2)
+        self.rooms.route(message(10, 1))
+        self.assertEqual(self.rooms.next_unread().id, 1)
+        self.rooms.route(message(11, 3))
+        self.assertEqual(self.rooms.next_unread().id, 3)
+
+    def test_unwatch(self):
+        self.rooms.route(message(10, 2))
+        self.rooms.unwatch(2)
+        self.rooms.unwatch(1)
+        self.assertNotIn(2, self.rooms)
+        self.assertIsNone(self.rooms.current)
+        self.assertEqual(self.rooms.total_unread, 0)
+        self.assertEqual(len(self.rooms), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import sendqueue
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class TestSendQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.queue = sendqueue.SendQueue(rate = 10, burst = 3, max_in_flight = 5, max_pending = 8, clock = self.clock)
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message.text)
+
+    def submit(self, count):
+        return [self.queue.submit(1, "m%d" % i) for i in range(count)]
+
+    def test_burst_then_rate(self):
+        self.submit(5)
+        wait = self.queue.pump(self.send)
+        self.assertEqual(self.sent, ["m0", "m1", "m2"])
+        self.assertAlmostEqual(wait, 0.1)
+        self.clock.now += 0.2
+        self.assertAlmostEqual(self.queue.pump(self.send), 9.8) # Nothing left to send; m0's ack is due then
+        self.assertEqual(self.sent, ["m0", "m1", "m2", "m3", "m4"])
+
+    def test_in_flight_limit_and_acks(self):
+        self.queue.burst = self.queue.tokens = 100
+        ids = self.submit(7)
+        self.assertEqual(self.queue.pump(self.send), 10) # Waiting on acks (or for them to time out)
+        self.assertEqual(len(self.sent), 5)
+        self.assertEqual(self.queue.ack(ids[0]).text, "m0")
+        self.assertIsNone(self.queue.ack(ids[0]))
+        self.queue.pump(self.send)
+        self.assertEqual(self.sent[-1], "m5")
+        self.assertEqual(len(self.queue), 6)
+
+    def test_refused_when_full(self):
+        ids = self.submit(10)
+        self.assertEqual(ids[-2:], [None, None])
+        self.assertEqual(self.queue.stats["refused"], 2)
+
+    def test_requeue_keeps_order(self):
+        self.submit(5)
+        self.queue.pump(self.send)
+        self.queue.requeue_in_flight()
+        self.clock.now += 1
+        self.queue.pump(self.send)
+        self.assertEqual(self.sent, ["m0", "m1", "m2", "m0", "m1", "m2"])
+        self.assertEqual(self.queue.stats["resent"], 3)
+
+    def test_send_error_keeps_message(self):
+        self.submit(2)
+        def broken(message):
+            raise IOError("closed")
+        self.assertRaises(IOError, self.queue.pump, broken)
+        self.queue.pump(self.send)
+        self.assertEqual(self.sent, ["m0", "m1"])
+
+    def test_fail(self):
+        id = self.submit(1)[0]
+        self.queue.pump(self.send)
+        self.assertEqual(self.queue.fail(id).text, "m0")
+        self.assertEqual(len(self.queue), 0)
+
+    def test_ack_timeout(self):
+        self.queue.max_attempts = 2
+        ids = self.submit(2)
+        self.queue.pump(self.send)
+        self.queue.ack(ids[1])
+        self.clock.now += 10
+        self.assertEqual(self.queue.expire(), []) # m0 goes out again
+        self.queue.pump(self.send)
+        self.assertEqual(self.sent, ["m0", "m1", "m0"])
+        self.clock.now += 10
+        self.assertEqual([m.text for m in self.queue.expire()], ["m0"]) # Twice is enough
+        self.assertEqual(len(self.queue), 0)
+        self.assertIsNone(self.queue.pump(self.send))
+        self.assertEqual(self.queue.stats["timed_out"], 2)
+        self.assertEqual(self.queue.stats["failed"], 1)
+
+    def test_late_ack_while_waiting_to_resend(self):
+        id = self.submit(1)[0]
+        self.queue.pump(self.send)
+        self.clock.now += 10
+        self.queue.expire()
+        self.assertEqual(self.queue.ack(id).text, "m0")
+        self.queue.pump(self.send)
+        self.assertEqual(self.sent, ["m0"])
+        self.assertEqual(len(self.queue), 0)
+
+class TestSplitText(unittest.TestCase):
+
+    def test_short(self):
+        self.assertEqual(sendqueue.split_text("hello\nthere", 20), ["hello\nthere"])
+        self.assertEqual(sendqueue.split_text("", 20), [])
+
+    def test_lines(self):
+        self.assertEqual(sendqueue.split_text("aaaa\nbbbb\ncccc", 9), ["aaaa\nbbbb", "cccc"])
+
+    def test_long_line(self):
+        self.assertEqual(sendqueue.split_text("abcdefghij\nk", 4), ["abcd", "efgh", "ij\nk"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import os
+import logging
+import tempfile
+import contentapi
+import mockserver
+import store
+
+def message(id, room, user = 1, deleted = False):
+    return { "id" : id, "contentId" : room, "createUserId" : user, "text" : "message %d" % id, "deleted" : deleted }
+
+class TestMessageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "messages.db")
+        self.store = store.MessageStore(self.path, retention = 0)
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+
+    def test_messages_by_room(self):
+        self.store.add_messages([message(i, 1 + i % 2) for i in range(1, 11)])
+        self.assertEqual([m["id"] for m in self.store.messages(1, limit = 3)], [6, 8, 10])
+        self.assertEqual([m["id"] for m in self.store.messages(2, before = 6, limit = 2)], [3, 5])
+        self.assertEqual(self.store.max_message_id(2), 9)
+        self.assertEqual(self.store.max_message_id(3), 0)
+
+    def test_replace_and_deleted(self):
+        self.store.add_messages([message(1, 1), message(2, 1)])
+        self.store.add_messages([message(2, 1, deleted = True)])
+        self.assertEqual([m["id"] for m in self.store.messages(1)], [1])
+        self.assertEqual(self.store.count(), 2)
+
+    def test_live_objects(self):
+        self.store.add_from_objects({ "message_event" : { "message" : [message(3, 1)], "user" : [{ "id" : 1, "username" : "one" }] } })
+        self.assertEqual(self.store.messages(1)[0]["id"], 3)
+        self.assertEqual(self.store.user(1)["username"], "one")
+        self.assertIsNone(self.store.user(2))
+
+    def test_persists(self):
+        self.store.add_messages([message(1, 1)])
+        self.store.add_rooms([{ "id" : 1, "name" : "Room" }])
+        self.store.set_last_id(42)
+        self.store.close()
+        self.store = store.MessageStore(self.path)
+        self.assertEqual(self.store.last_id, 42)
+        self.assertEqual(self.store.room(1)["name"], "Room")
+        self.assertEqual(len(self.store.messages(1)), 1)
+
+    def test_retention(self):
+        self.store.retention = 20
+        for i in range(10):
+            self.store.add_messages([message(i * 5 + j, 1) for j in range(1, 6)])
+        self.store.prune()
+        self.assertEqual(self.store.count(), 20)
+        self.assertEqual(self.store.messages(1, limit = 100)[0]["id"], 31)
+
+    def test_coverage(self):
+        self.assertIsNone(self.store.coverage(1))
+        self.store.set_coverage(1, 0, 20)
+        self.store.set_coverage(2, 5, 8)
+        self.store.set_coverage(1, 0, 30)
+        self.assertEqual(self.store.coverage(1), (0, 30))
+        self.store.add_messages([message(i, 1) for i in range(1, 31)])
+        self.assertEqual([m["id"] for m in self.store.messages(1, before = 12, limit = 5, since = 10)], [10, 11])
+        # Pruning takes the covered stretch with it
+        self.store.retention = 20
+        self.store.prune()
+        self.assertEqual(self.store.coverage(1), (11, 30))
+        self.assertIsNone(self.store.coverage(2))
+
+class TestMessageStoreContext(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockserver.MockServer(mockserver.MockData(users = 10, rooms = 5, messages = 0)).start()
+        self.api = contentapi.ApiContext(self.server.url, logging)
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = store.MessageStore(os.path.join(self.dir.name, "messages.db"))
+
+    def tearDown(self):
+        self.store.close()
+        self.dir.cleanup()
+        self.server.stop()
+
+    def test_context_feeds_store(self):
+        self.api.store = self.store
+        self.server.data.post_message(2, 4, "hello")
+        self.api.search({ "requests" : [{ "type" : "message", "fields" : "*", "query" : "" }] })
+        self.assertEqual(self.store.messages(2)[0]["text"], "hello")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import threading
+import json
+import transport
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# Tiny keep-alive server that answers everything with the same json
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = json.dumps({ "path" : self.path }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestHttpTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), EchoHandler)
+        self.thread = threading.Thread(target = self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.http = transport.HttpTransport(pool_size = 2, timeout = 5, retries = 0)
+
+    def tearDown(self):
+        self.http.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get(self):
+        response = self.http.get(self.url + "/status")
+        self.assertEqual(response.json()["path"], "/status")
+
+    def test_connection_reused(self):
+        for i in range(5):
+            self.http.get(self.url + "/status")
+        pools = self.http.stats()["pools"]
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(pools[0]["requests"], 5)
+        self.assertEqual(pools[0]["connections"], 1)
+        self.assertEqual(pools[0]["reused"], 4)
+
+    def test_retry_then_fail(self):
+        self.http.retries = 2
+        self.http.backoff = 0
+        with self.assertRaises(Exception):
+            self.http.get("http://127.0.0.1:1/nothing")
+        self.assertEqual(self.http.stats()["retries"], 2)
+
+if __name__ == '__main__':
+    unittest.main()
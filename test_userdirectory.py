@@ -0,0 +1,43 @@
+import unittest
+import time
+import userdirectory
+
+class TestUserDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.users = userdirectory.UserDirectory(max_size = 3, ttl = 0)
+
+    def test_get(self):
+        self.users.add({ "id" : 5, "username" : "five" })
+        self.assertEqual(self.users.get(5)["username"], "five")
+        self.assertIsNone(self.users.get(6))
+
+    def test_default(self):
+        self.assertEqual(self.users.get_or_default(7)["username"], "???")
+        self.assertEqual(self.users.get_or_default(7)["id"], 7)
+
+    def test_lru_eviction(self):
+        for i in range(3):
+            self.users.add({ "id" : i, "username" : str(i) })
+        self.users.get(0) # 0 is now the most recent, 1 is the oldest
+        self.users.add({ "id" : 3, "username" : "3" })
+        self.assertEqual(len(self.users), 3)
+        self.assertIsNone(self.users.get(1))
+        self.assertIsNotNone(self.users.get(0))
+
+    def test_ttl(self):
+        self.users.ttl = 0.01
+        self.users.add({ "id" : 1, "username" : "1" })
+        time.sleep(0.02)
+        self.assertIsNone(self.users.get(1))
+
+    def test_add_from_search_objects(self):
+        self.users.add_from_objects({ "user" : [{ "id" : 1, "username" : "a" }], "content" : [{ "id" : 1, "name" : "room" }] })
+        self.assertEqual(self.users.get(1)["username"], "a")
+
+    def test_add_from_live_objects(self):
+        self.users.add_from_objects({ "message_event" : { "user" : [{ "id" : 2, "username" : "b" }], "message" : [] } })
+        self.assertEqual(self.users.get(2)["username"], "b")
+
+if __name__ == '__main__':
+    unittest.main()
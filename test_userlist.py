@@ -0,0 +1,50 @@
+import unittest
+import time
+import userlist
+
+class TestUserListState(unittest.TestCase):
+
+    def setUp(self):
+        self.state = userlist.UserListState()
+
+    def seed(self):
+        self.state.seed({ "0" : { "1" : "online", "2" : "online" }, "5" : { "1" : "here" } })
+
+    def test_unseeded_asks_server(self):
+        self.assertIsNone(self.state.get(0))
+        self.state.apply({ "5" : { "3" : "here" } }) # Nothing to apply it to yet
+        self.assertEqual(self.state.statuses, {})
+        self.assertEqual(self.state.stats["fetches"], 1)
+
+    def test_seed_answers_locally(self):
+        self.seed()
+        self.assertEqual(self.state.get(0), { 1 : "online", 2 : "online" })
+        self.assertEqual(self.state.get(5), { 1 : "here" })
+        self.assertEqual(self.state.get(6), {})
+        self.assertEqual(self.state.stats["local_answers"], 3)
+
+    def test_updates_replace_rooms(self):
+        self.seed()
+        self.state.apply({ "5" : { "1" : "here", "3" : "here" }, "7" : { "2" : "here" } })
+        self.assertEqual(self.state.get(5), { 1 : "here", 3 : "here" })
+        self.assertEqual(self.state.get(7), { 2 : "here" })
+        self.state.apply({ "5" : {} })
+        self.assertEqual(self.state.get(5), {})
+        self.assertNotIn(5, self.state.statuses)
+        self.assertEqual(self.state.get(0), { 1 : "online", 2 : "online" })
+
+    def test_stale_until_reseeded(self):
+        self.seed()
+        self.state.mark_stale()
+        self.assertIsNone(self.state.get(0))
+        self.seed()
+        self.assertIsNotNone(self.state.get(0))
+
+    def test_max_age(self):
+        self.state.max_age = 0.01
+        self.seed()
+        time.sleep(0.02)
+        self.assertIsNone(self.state.get(0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import time
+import weakref
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+
+# The HTTP layer underneath ApiContext. It owns a single requests session so every call to
+# the API rides on a pooled, keep-alive connection instead of paying a fresh TCP (and TLS)
+# handshake each time. Anything with the same get/post signature can be swapped in.
+class HttpTransport:
+
+    # pool_size is the number of connections kept alive per host, timeout is either a single
+    # number of seconds or a (connect, read) tuple. Idempotent calls (GET only, unless you
+    # add more methods to retry_methods) are retried up to 'retries' times with exponential backoff
+    def __init__(self, pool_size = 4, timeout = (5, 30), retries = 2, backoff = 0.5, retry_methods = ("GET",)):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_methods = retry_methods
+        self.retry_count = 0
+        self.session = requests.Session()
+        self.adapter = TrackingAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def get(self, url, headers = None):
+        return self.request("GET", url, headers = headers)
+
+    # With stream, the body is left unread for response.iter_content (close the response when done)
+    def post(self, url, headers = None, json = None, stream = False):
+        return self.request("POST", url, headers = headers, json = json, stream = stream)
+
+    # Perform a request through the pool. Connection errors and timeouts on retryable methods
+    # are retried after backoff * 2^attempt seconds; everything else goes straight back out
+    def request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return self.session.request(method, url, timeout = self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if method not in self.retry_methods or attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+                self.retry_count += 1
+
+    # Per-host and per-connection reuse info. 'reused' is how many requests went out over an
+    # already-open connection, meaning that many handshakes were skipped
+    def stats(self):
+        return {
+            "pools" : self.adapter.pool_stats(),
+            "connections" : self.adapter.connection_stats(),
+            "retries" : self.retry_count
+        }
+
+    def close(self):
+        self.session.close()
+
+
+# A normal requests adapter that also remembers how many requests each underlying
+# connection has served. Connections are held weakly so dead ones just drop out
+class TrackingAdapter(HTTPAdapter):
+
+    def __init__(self, *args, **kwargs):
+        self._uses = weakref.WeakKeyDictionary()
+        self._uses_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        response = super().send(request, *args, **kwargs)
+        # urllib3 hands the connection to the response until the body is read; it's private,
+        # so if it ever goes away we simply lose the per-connection numbers
+        connection = getattr(response.raw, "_connection", None)
+        if connection is not None:
+            with self._uses_lock:
+                self._uses[connection] = self._uses.get(connection, 0) + 1
+        return response
+
+    # How many requests each currently open connection has carried
+    def connection_stats(self):
+        with self._uses_lock:
+            return [{ "host" : getattr(c, "host", "?"), "requests" : n, "reused" : n - 1 } for c, n in self._uses.items()]
+
+    # Totals straight from the urllib3 pools, one entry per host
+    def pool_stats(self):
+        result = []
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            result.append({
+                "host" : "%s://%s:%s" % (pool.scheme, pool.host, pool.port),
+                "connections" : pool.num_connections,
+                "requests" : pool.num_requests,
+                "reused" : max(0, pool.num_requests - pool.num_connections)
+            })
+        return result
@@ -0,0 +1,71 @@
+import time
+import threading
+
+from collections import OrderedDict
+from records import UserRecord
+
+# A shared directory of every user we've seen, keyed by id. Fed from anything that carries
+# user objects (search results, websocket userlists, live events) so lookups while rendering
+# are O(1) instead of scanning whatever user list came with the data. Size is bounded: the
+# least recently used user falls off the end, and entries older than ttl seconds are refetched
+# from the next response that carries them (or reported as missing). Users are kept as compact
+# UserRecords (just the fields we render), not the whole dict they came in as
+class UserDirectory:
+
+    def __init__(self, max_size = 5000, ttl = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.users = OrderedDict() # id -> (user, time added)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.users)
+
+    def add(self, user):
+        if "id" not in user:
+            return
+        if isinstance(user, dict):
+            user = UserRecord.from_dict(user)
+        with self.lock:
+            self.users[user["id"]] = (user, time.monotonic())
+            self.users.move_to_end(user["id"])
+            while len(self.users) > self.max_size:
+                self.users.popitem(last = False)
+
+    def add_all(self, users):
+        for user in users:
+            self.add(user)
+
+    # Pull users out of a contentapi "objects" result. Handles both the normal search shape
+    # ({ "user" : [...] }) and the live shape, which is one more level deep ({ "message_event" : { "user" : [...] } })
+    def add_from_objects(self, objects):
+        if not isinstance(objects, dict):
+            return
+        for key, value in objects.items():
+            if key == "user" and isinstance(value, list):
+                self.add_all(value)
+            elif isinstance(value, dict):
+                self.add_from_objects(value)
+
+    # Return the user for the given id, or None if we don't have them (or they expired)
+    def get(self, id):
+        with self.lock:
+            entry = self.users.get(id)
+            if entry is None:
+                return None
+            if self.ttl and time.monotonic() - entry[1] > self.ttl:
+                del self.users[id]
+                return None
+            self.users.move_to_end(id)
+            return entry[0]
+
+    # Same as get, but return some reasonable default if the user isn't known
+    def get_or_default(self, id):
+        user = self.get(id)
+        if user is None:
+            return { "id" : id, "username" : "???", "avatar": "0" }
+        return user
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
@@ -0,0 +1,61 @@
+import time
+
+# Who's where, kept locally so the userlist doesn't need a round trip every time you look at it.
+# It's seeded from one full "userlist" response, then kept current with the "userlistupdate"
+# messages the server pushes whenever statuses change. Each update carries the complete status
+# list for every room it touches, so a room's list is just replaced. Room 0 is the global list.
+# Anything missed (a dropped connection) or simply old makes the state stale, and the caller
+# should fetch a fresh snapshot instead of trusting it.
+class UserListState:
+
+    # max_age is how long (seconds) a seed is trusted without a fresh snapshot; 0 = forever
+    def __init__(self, max_age = 600):
+        self.max_age = max_age
+        self.statuses = {} # room id -> { user id : status }
+        self.seeded_at = None
+        self.stale = True
+        self.stats = {
+            "seeds" : 0,
+            "updates" : 0,
+            "local_answers" : 0,
+            "fetches" : 0
+        }
+
+    # Replace everything with a full snapshot (the "statuses" of a userlist response)
+    def seed(self, statuses):
+        self.statuses = dict((int(room), self.normalize(users)) for room, users in statuses.items())
+        self.seeded_at = time.monotonic()
+        self.stale = False
+        self.stats["seeds"] += 1
+
+    # Apply a userlistupdate's "statuses". Ignored until we've been seeded (we'd only have part of the picture)
+    def apply(self, statuses):
+        if self.seeded_at is None:
+            return
+        for room, users in statuses.items():
+            if users:
+                self.statuses[int(room)] = self.normalize(users)
+            else:
+                self.statuses.pop(int(room), None)
+        self.stats["updates"] += 1
+
+    # Updates may have been missed (say we reconnected), so don't answer from this until reseeded
+    def mark_stale(self):
+        self.stale = True
+
+    def is_fresh(self):
+        if self.stale or self.seeded_at is None:
+            return False
+        return not self.max_age or time.monotonic() - self.seeded_at < self.max_age
+
+    # The statuses for a room ({ user id : status }), or None if the state can't be trusted and
+    # you should ask the server instead
+    def get(self, room):
+        if not self.is_fresh():
+            self.stats["fetches"] += 1
+            return None
+        self.stats["local_answers"] += 1
+        return dict(self.statuses.get(room, {}))
+
+    def normalize(self, users):
+        return dict((int(user), status) for user, status in users.items())